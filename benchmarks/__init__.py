@@ -0,0 +1,5 @@
+"""
+Benchmarks for the preservica adaptor, run from the repository root.
+
+    python -m benchmarks.e2e --help
+"""
@@ -0,0 +1,144 @@
+"""
+Benchmark of parallel deflate against zipfile.
+
+Adds one large compressible file to an archive with ZipFile.write and with
+ParallelDeflater at several thread counts, and reports time, MB/s,
+compressed size and speedup over zipfile as JSON.
+
+    python -m benchmarks.deflate --size 256M --threads 2,4,8
+"""
+import argparse
+import collections
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import zipfile
+
+from preservicaservice.offload import OffloadBackend
+from preservicaservice.pdeflate import DEFAULT_BLOCK_SIZE, ParallelDeflater
+
+from .messages import parse_size, write_file
+
+ARCNAME = 'object/data.csv'
+
+
+def zipfile_write(zip_path, path, level):
+    with zipfile.ZipFile(zip_path, 'w', compression=zipfile.ZIP_DEFLATED) as f:
+        zinfo = zipfile.ZipInfo.from_file(path, ARCNAME)
+        zinfo.compress_type = zipfile.ZIP_DEFLATED
+        zinfo._compresslevel = level
+        with open(path, 'rb') as src, f.open(zinfo, 'w') as dst:
+            while True:
+                chunk = src.read(1024 * 1024)
+                if not chunk:
+                    break
+                dst.write(chunk)
+
+
+def parallel_write(zip_path, path, level, threads, block_size):
+    deflater = ParallelDeflater(threads, 0, block_size)
+    try:
+        with zipfile.ZipFile(zip_path, 'w') as f:
+            OffloadBackend(parallel=deflater).write(
+                f, path, ARCNAME, zipfile.ZIP_DEFLATED, level,
+            )
+    finally:
+        deflater.shutdown()
+
+
+def measure(func, zip_path, repeat):
+    """ Best of repeat runs
+
+    :return: seconds and archive size
+    :rtype: tuple of (float, int)
+    """
+    best = None
+    for _ in range(repeat):
+        if os.path.exists(zip_path):
+            os.unlink(zip_path)
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    with zipfile.ZipFile(zip_path) as f:
+        if f.testzip() is not None:
+            raise RuntimeError('corrupt archive from {}'.format(func))
+    return best, os.path.getsize(zip_path)
+
+
+def run(args):
+    size = parse_size(args.size)
+    results = collections.OrderedDict()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'data')
+        zip_path = os.path.join(directory, 'bundle.zip')
+        write_file(path, size, random.Random(args.seed), not args.random_content)
+
+        cases = [('zipfile', lambda: zipfile_write(zip_path, path, args.level))]
+        for threads in args.threads:
+            cases.append((
+                'parallel[{}]'.format(threads),
+                lambda t=threads: parallel_write(
+                    zip_path, path, args.level, t, args.block_size,
+                ),
+            ))
+
+        for name, func in cases:
+            seconds, archive_bytes = measure(func, zip_path, args.repeat)
+            results[name] = {
+                'seconds': seconds,
+                'mb_per_second': size / seconds / 1e6,
+                'archive_bytes': archive_bytes,
+            }
+            sys.stderr.write('{:<15} {:>9.3f}s {:>12} bytes\n'.format(
+                name, seconds, archive_bytes,
+            ))
+
+    baseline = results['zipfile']['seconds']
+    for result in results.values():
+        result['speedup'] = baseline / result['seconds']
+    return {
+        'file_bytes': size,
+        'level': args.level,
+        'cpus': os.cpu_count(),
+        'results': results,
+    }
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--size', default='256M', help='file size, e.g. 1G')
+    parser.add_argument(
+        '--threads', default=','.join(
+            str(n) for n in sorted({2, 4, os.cpu_count() or 1}) if n > 1
+        ),
+        type=lambda value: [int(n) for n in value.split(',')],
+        help='comma separated thread counts',
+    )
+    parser.add_argument('--block-size', type=parse_size, default=DEFAULT_BLOCK_SIZE)
+    parser.add_argument('--level', type=int, default=6)
+    parser.add_argument(
+        '--random-content', action='store_true',
+        help='incompressible file content instead of text',
+    )
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='also write report json here')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run(args)
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
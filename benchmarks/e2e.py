@@ -0,0 +1,243 @@
+"""
+End to end ingest benchmark.
+
+Generates synthetic MetadataCreate messages with files in an in process S3
+or behind a local HTTP server, then drives RecordProcessor.process_records
+against them with moto standing in for S3 and Kinesis.
+
+    python -m benchmarks.e2e --messages 50 --files 4 \\
+        --sizes lognormal:2M:1.5 --engine pipeline --output report.json
+"""
+import argparse
+import base64
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+from preservicaservice.config import ENGINES, Config
+from preservicaservice.processor import RecordProcessor
+from preservicaservice.scheduling import RecordScheduler
+
+from .messages import (
+    metadata_create,
+    object_file,
+    parse_size_distribution,
+    write_file,
+)
+from .stats import peak_rss_mb, percentile
+from .standins import (
+    ERROR_STREAM,
+    INVALID_STREAM,
+    REGION,
+    SOURCE_BUCKET,
+    UPLOAD_BUCKET,
+    FileServer,
+    local_aws,
+)
+
+ORGANISATION_ID = 'bench-org'
+
+
+class BenchmarkRecord:
+    """ Kinesis record shaped input """
+
+    def __init__(self, message, sequence_number):
+        self.data = base64.b64encode(json.dumps(message).encode('utf-8'))
+        self.sequence_number = sequence_number
+
+
+class NullCheckpointer:
+    def __init__(self):
+        self.checkpoints = 0
+
+    def checkpoint(self, sequence_number=None):
+        self.checkpoints += 1
+
+
+class TimingScheduler(RecordScheduler):
+    """ Scheduler keeping the latency of every completed record """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.latencies = []
+
+    def completed(self, record):
+        seconds = super().completed(record)
+        if seconds is not None:
+            self.latencies.append(seconds)
+        return seconds
+
+
+class BenchmarkProcessor(RecordProcessor):
+    """ Record processor counting failures it reports """
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.failures = 0
+        self.scheduler = TimingScheduler(
+            config.admission_default_file_bytes,
+            config.record_order,
+        )
+
+    def handle_error(self, record, error):
+        self.failures += 1
+        super().handle_error(record, error)
+
+
+def build_corpus(args, rng, directory, source_bucket, file_server):
+    """ Generate files and the messages referencing them
+
+    :param argparse.Namespace args: benchmark arguments
+    :param random.Random rng: seeded randomness
+    :param str directory: where generated files are written
+    :param source_bucket: stand-in S3 bucket for S3 hosted files
+    :param FileServer file_server: server for HTTP hosted files
+    :return: messages, total file bytes
+    :rtype: tuple of (list of dict, int)
+    """
+    sizes = parse_size_distribution(args.sizes)
+    messages = []
+    total_bytes = 0
+    for i in range(args.messages):
+        files = []
+        for j in range(args.files):
+            name = 'message-{}-file-{}'.format(i, j)
+            path = os.path.join(directory, name)
+            size = sizes(rng)
+            md5 = write_file(path, size, rng, not args.random_content)
+            total_bytes += size
+            declared = size if args.declare_sizes else None
+            if rng.random() < args.http_fraction:
+                files.append(object_file(
+                    file_server.url(name), name, declared, md5, 2,
+                ))
+            else:
+                source_bucket.upload_file(path, name)
+                os.unlink(path)
+                files.append(object_file(
+                    's3://{}/{}'.format(SOURCE_BUCKET, name),
+                    name, declared, md5, 1,
+                ))
+        messages.append(metadata_create(
+            files, ORGANISATION_ID, args.person_roles,
+        ))
+    return messages, total_bytes
+
+
+def build_config(args):
+    return Config(
+        environment='test',
+        preservica_base_url='https://bench_preservica_url',
+        input_stream_name='bench-input',
+        invalid_stream_name=INVALID_STREAM,
+        error_stream_name=ERROR_STREAM,
+        adaptor_aws_region=REGION,
+        organisation_buckets={
+            ORGANISATION_ID: 's3://{}/'.format(UPLOAD_BUCKET),
+        },
+        engine=args.engine,
+        record_workers=args.workers,
+        offload_workers=args.offload_workers,
+    )
+
+
+def run(args):
+    """ Run benchmark
+
+    :param argparse.Namespace args: benchmark arguments
+    :return: report
+    :rtype: dict
+    """
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as directory, local_aws() as source:
+        file_server = FileServer(directory)
+        try:
+            messages, total_bytes = build_corpus(
+                args, rng, directory, source, file_server,
+            )
+            records = [
+                BenchmarkRecord(message, str(i))
+                for i, message in enumerate(messages)
+            ]
+            processor = BenchmarkProcessor(build_config(args))
+            checkpointer = NullCheckpointer()
+
+            started = time.monotonic()
+            for i in range(0, len(records), args.batch_size):
+                processor.process_records(
+                    records[i:i + args.batch_size], checkpointer,
+                )
+            elapsed = time.monotonic() - started
+            processor.shutdown(checkpointer, 'ZOMBIE')
+        finally:
+            file_server.close()
+
+    latencies = processor.scheduler.latencies
+    return {
+        'engine': args.engine,
+        'workers': args.workers,
+        'messages': len(records),
+        'files': len(records) * args.files,
+        'bytes': total_bytes,
+        'failures': processor.failures,
+        'checkpoints': checkpointer.checkpoints,
+        'elapsed_seconds': elapsed,
+        'messages_per_second': len(records) / elapsed,
+        'mb_per_second': total_bytes / 1024.0 / 1024.0 / elapsed,
+        'latency_p50_seconds': percentile(latencies, 50),
+        'latency_p95_seconds': percentile(latencies, 95),
+        'latency_p99_seconds': percentile(latencies, 99),
+        'peak_rss_mb': peak_rss_mb(),
+        'peak_children_rss_mb': peak_rss_mb(resource.RUSAGE_CHILDREN),
+    }
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--messages', type=int, default=20)
+    parser.add_argument('--files', type=int, default=3, help='files per message')
+    parser.add_argument(
+        '--sizes', default='lognormal:1M:1.0',
+        help='file size distribution, fixed:SIZE, uniform:MIN:MAX or '
+             'lognormal:MEDIAN:SIGMA',
+    )
+    parser.add_argument(
+        '--http-fraction', type=float, default=0.0,
+        help='share of files served over HTTP instead of S3',
+    )
+    parser.add_argument(
+        '--random-content', action='store_true',
+        help='incompressible file content instead of text',
+    )
+    parser.add_argument(
+        '--declare-sizes', action='store_true',
+        help='set fileSize on objectFile entries',
+    )
+    parser.add_argument('--person-roles', type=int, default=1)
+    parser.add_argument('--engine', choices=ENGINES, default='threads')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--offload-workers', type=int, default=0)
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='also write report json here')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run(args)
+    text = json.dumps(report, indent=2, sort_keys=True)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    if report['failures']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+import hashlib
+import math
+import os
+import re
+import uuid
+
+SIZE_UNITS = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+
+
+def parse_size(text):
+    """ Parse byte size with optional k, M or G suffix
+
+    :param str text: e.g. 512, 64k, 10M
+    :rtype: int
+    """
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([kmg]?)b?\s*$', text.lower())
+    if not match:
+        raise ValueError('invalid size {}'.format(text))
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2)])
+
+
+def parse_size_distribution(spec):
+    """ Parse file size distribution
+
+    Supported forms are fixed:SIZE, uniform:MIN:MAX and
+    lognormal:MEDIAN:SIGMA, sizes as accepted by parse_size.
+
+    :param str spec: distribution spec
+    :return: function taking random.Random and returning a size
+    :rtype: callable
+    """
+    kind, _, params = spec.partition(':')
+    params = params.split(':') if params else []
+    if kind == 'fixed' and len(params) == 1:
+        size = parse_size(params[0])
+        return lambda rng: size
+    if kind == 'uniform' and len(params) == 2:
+        low, high = parse_size(params[0]), parse_size(params[1])
+        return lambda rng: rng.randint(low, high)
+    if kind == 'lognormal' and len(params) == 2:
+        mu, sigma = math.log(parse_size(params[0])), float(params[1])
+        return lambda rng: max(1, int(rng.lognormvariate(mu, sigma)))
+    raise ValueError('invalid size distribution {}'.format(spec))
+
+
+def write_file(path, size, rng, compressible=True, chunk_size=1024 * 1024):
+    """ Write synthetic file content
+
+    :param str path: file to write
+    :param int size: bytes to write
+    :param random.Random rng: source of randomness
+    :param bool compressible: text like content rather than random bytes
+    :return: md5 hex digest of content
+    :rtype: str
+    """
+    md5 = hashlib.md5()
+    if compressible:
+        words = [
+            '{:x}'.format(rng.getrandbits(24)).encode('ascii')
+            for _ in range(512)
+        ]
+        # longer than the deflate window, so repeating it still costs
+        # as much to compress as text
+        unit = b' '.join(rng.choice(words) for _ in range(16 * 1024))
+        block = (unit * (chunk_size // len(unit) + 1))[:chunk_size]
+    with open(path, 'wb') as f:
+        remaining = size
+        while remaining:
+            n = min(remaining, chunk_size)
+            data = block[:n] if compressible else os.urandom(n)
+            md5.update(data)
+            f.write(data)
+            remaining -= n
+    return md5.hexdigest()
+
+
+def object_file(location, name, size=None, md5=None, storage_type=1):
+    """ objectFile entry of a MetadataCreate message
+
+    :param str location: s3:// or http(s):// url of the file
+    :param str name: file name
+    :param int size: declared fileSize, None to leave out
+    :param str md5: md5 hex digest, None for no checksums
+    :param int storage_type: 1 for S3, 2 for HTTP
+    :rtype: dict
+    """
+    entry = {
+        'fileUuid': str(uuid.uuid4()),
+        'fileIdentifier': name,
+        'fileName': name,
+        'fileStorageLocation': location,
+        'fileStoragePlatform': {
+            'storagePlatformUuid': str(uuid.uuid4()),
+            'storagePlatformName': 'benchmark',
+            'storagePlatformType': storage_type,
+        },
+        'fileChecksum': [],
+    }
+    if size is not None:
+        entry['fileSize'] = size
+    if md5:
+        entry['fileChecksum'].append({
+            'checksumUuid': str(uuid.uuid4()),
+            'checksumType': 1,
+            'checksumValue': md5,
+        })
+    return entry
+
+
+def person_role(index, organisation_id):
+    return {
+        'person': {
+            'personUuid': str(uuid.uuid4()),
+            'personGivenName': 'Given{}'.format(index),
+            'personFamilyName': 'Family{}'.format(index),
+            'personOrganisationUnit': {
+                'organisationUnitUuid': str(uuid.uuid4()),
+                'organisationUnitName': 'Unit {}'.format(index),
+                'organisation': {
+                    'organisationJiscId': organisation_id,
+                    'organisationName': 'Benchmark',
+                    'organisationType': 1,
+                },
+            },
+        },
+        'role': 21,
+    }
+
+
+def metadata_create(object_files, organisation_id='bench-org', person_roles=1):
+    """ MetadataCreate message with realistic surrounding metadata
+
+    :param object_files: objectFile entries
+    :type object_files: list of dict
+    :param organisation_id: organisationJiscId of depositor
+    :param int person_roles: objectPersonRole entries to include
+    :rtype: dict
+    """
+    return {
+        'messageHeader': {
+            'messageId': str(uuid.uuid4()),
+            'messageClass': 'Command',
+            'messageType': 'MetadataCreate',
+            'messageTimings': {
+                'publishedTimestamp': '2017-09-06T11:08:12.000Z',
+            },
+            'messageSequence': {
+                'sequence': str(uuid.uuid4()),
+                'position': 1,
+                'total': 1,
+            },
+            'version': '2.0.0',
+        },
+        'messageBody': {
+            'objectUuid': str(uuid.uuid4()),
+            'objectTitle': 'Benchmark deposit',
+            'objectPersonRole': [
+                person_role(i, organisation_id) for i in range(person_roles)
+            ],
+            'objectDescription': 'Synthetic deposit ' * 20,
+            'objectRights': {
+                'rightsStatement': ['Benchmark only'],
+                'licence': [{'licenceName': 'CC-BY'}],
+            },
+            'objectDate': [{'dateValue': '2017-09-06', 'dateType': 1}],
+            'objectKeywords': ['benchmark', 'synthetic'],
+            'objectCategory': ['test'],
+            'objectResourceType': 1,
+            'objectValue': 1,
+            'objectOrganisationRole': [{
+                'organisation': {
+                    'organisationJiscId': organisation_id,
+                    'organisationName': 'Benchmark',
+                    'organisationType': 1,
+                },
+                'role': 5,
+            }],
+            'objectFile': object_files,
+        },
+    }
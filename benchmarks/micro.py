@@ -0,0 +1,282 @@
+"""
+Micro benchmarks of per record hot paths.
+
+Times parsing, metadata generation and bundling on small, large and
+pathological message bodies and compares against stored baselines.
+
+    python -m benchmarks.micro run --output benchmarks/baselines/micro.json
+    python -m benchmarks.micro compare --threshold 1.25
+"""
+import argparse
+import base64
+import collections
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from preservicaservice.bundle import BundleWriter
+from preservicaservice.config import Config
+from preservicaservice.meta import write_message_meta, write_object_meta
+from preservicaservice.remote_urls import S3RemoteUrl
+from preservicaservice.tasks import (
+    FileMetadata,
+    FileTask,
+    require_organisation_id,
+    require_organisation_role,
+)
+from preservicaservice.tasks_parser import create_supported_tasks, decode_record
+
+from .messages import metadata_create, object_file, parse_size, write_file
+
+BASELINE_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'baselines', 'micro.json',
+)
+DEFAULT_THRESHOLD = 1.25
+
+ORGANISATION_ID = 'bench-org'
+
+# objectFile and objectPersonRole entries per message body
+BODIES = collections.OrderedDict([
+    ('small', (1, 1)),
+    ('large', (50, 20)),
+    ('pathological', (3000, 500)),
+])
+
+FILE_SIZES = collections.OrderedDict([
+    ('small', '64k'),
+    ('large', '16M'),
+])
+
+
+class Record:
+    def __init__(self, message):
+        self.data = base64.b64encode(json.dumps(message).encode('utf-8'))
+
+
+def build_message(files, person_roles):
+    return metadata_create(
+        [
+            object_file(
+                's3://bench-source/file-{}'.format(i),
+                'file-{}'.format(i),
+                1024,
+                'd41d8cd98f00b204e9800998ecf8427e',
+            ) for i in range(files)
+        ],
+        ORGANISATION_ID,
+        person_roles,
+    )
+
+
+def build_config():
+    return Config(
+        environment='test',
+        preservica_base_url='https://bench_preservica_url',
+        input_stream_name='bench-input',
+        invalid_stream_name='bench-invalid',
+        error_stream_name='bench-error',
+        adaptor_aws_region='eu-west-1',
+        organisation_buckets={ORGANISATION_ID: 's3://bench-upload/'},
+        offload_workers=0,
+    )
+
+
+def build_bundle(path, members):
+    with open(path, 'wb') as output, BundleWriter(output) as bundle:
+        for i in range(members):
+            bundle.zip_file.writestr('object/file-{}'.format(i), 'x' * 1024)
+    return bundle
+
+
+def cases(directory):
+    """ Benchmark cases by name
+
+    :param str directory: scratch directory for files the cases use
+    :return: name and function to time
+    :rtype: generator of (str, callable)
+    """
+    config = build_config()
+    rng = random.Random(1)
+
+    for body, (files, person_roles) in BODIES.items():
+        message = build_message(files, person_roles)
+        record = Record(message)
+        meta_path = os.path.join(directory, 'message-{}.xml'.format(body))
+        task = create_supported_tasks(message, config)
+        bundle_path = os.path.join(directory, 'bundle-{}.zip'.format(body))
+        bundle = build_bundle(bundle_path, files * 2 + 1)
+
+        yield 'decode_record[{}]'.format(body), lambda r=record: decode_record(r)
+        yield 'create_supported_tasks[{}]'.format(body), (
+            lambda m=message: create_supported_tasks(m, config)
+        )
+        yield 'require_organisation_id[{}]'.format(body), (
+            lambda m=message: require_organisation_id(m)
+        )
+        yield 'require_organisation_role[{}]'.format(body), (
+            lambda m=message: require_organisation_role(m)
+        )
+        yield 'write_message_meta[{}]'.format(body), (
+            lambda p=meta_path, m=message: write_message_meta(p, m)
+        )
+        yield 'collect_meta[{}]'.format(body), (
+            lambda t=task, b=bundle: t.collect_meta(b)
+        )
+
+    object_meta_path = os.path.join(directory, 'object.xml')
+    metadata = FileMetadata(fileName='file name.pdf')
+    yield 'write_object_meta[small]', (
+        lambda: write_object_meta(object_meta_path, metadata.values())
+    )
+    many_values = [('fileName{}'.format(i), 'value') for i in range(1000)]
+    yield 'write_object_meta[pathological]', (
+        lambda: write_object_meta(object_meta_path, many_values)
+    )
+
+    for size_name, size in FILE_SIZES.items():
+        path = os.path.join(directory, 'data-{}'.format(size_name))
+        write_file(path, parse_size(size), rng)
+        zip_path = os.path.join(directory, 'zip-{}.zip'.format(size_name))
+        file_task = FileTask(
+            S3RemoteUrl('s3://bench-source/data-{}'.format(size_name)),
+            metadata,
+            'message',
+            'object',
+            [],
+        )
+        metadata.generate(object_meta_path)
+
+        def add_to_bundle(file_task=file_task, zip_path=zip_path, path=path):
+            with open(zip_path, 'wb') as output, BundleWriter(output) as bundle:
+                file_task.add_to_bundle(bundle.zip_file, path, object_meta_path)
+
+        yield 'FileTask.add_to_bundle[{}]'.format(size_name), add_to_bundle
+
+
+def measure(func, repeat=5, min_seconds=0.05):
+    """ Time function, calibrating loops per measurement
+
+    :param callable func: function to time
+    :param int repeat: measurements to take
+    :param float min_seconds: shortest measurement
+    :return: best and median seconds per call
+    :rtype: tuple of (float, float)
+    """
+    number = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_seconds:
+            break
+        number *= 2
+
+    timings = [elapsed / number]
+    for _ in range(repeat - 1):
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        timings.append((time.perf_counter() - started) / number)
+    return min(timings), statistics.median(timings)
+
+
+def run(name_filter=None, repeat=5):
+    """ Run every case, or those with name containing name_filter
+
+    :rtype: dict
+    """
+    results = collections.OrderedDict()
+    with tempfile.TemporaryDirectory() as directory:
+        for name, func in cases(directory):
+            if name_filter and name_filter not in name:
+                continue
+            best, median = measure(func, repeat)
+            results[name] = {'seconds': best, 'median_seconds': median}
+            sys.stderr.write('{:<45} {:>12.6f}s\n'.format(name, best))
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+
+
+def compare(current, baseline, threshold):
+    """ Compare best timings against baseline
+
+    :param dict current: results of run
+    :param dict baseline: stored results of run
+    :param float threshold: slowdown ratio counted as regression
+    :return: rows of name, baseline, current, ratio, regressed
+    :rtype: list of tuple
+    """
+    rows = []
+    for name, result in current['results'].items():
+        stored = baseline['results'].get(name)
+        if not stored:
+            continue
+        ratio = result['seconds'] / stored['seconds']
+        rows.append((
+            name, stored['seconds'], result['seconds'], ratio,
+            ratio > threshold,
+        ))
+    return rows
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    run_parser = commands.add_parser('run', help='run and print results')
+    run_parser.add_argument('--output', help='write results json here')
+
+    compare_parser = commands.add_parser(
+        'compare', help='run and compare against baseline',
+    )
+    compare_parser.add_argument('--baseline', default=BASELINE_PATH)
+    compare_parser.add_argument(
+        '--threshold', type=float, default=DEFAULT_THRESHOLD,
+        help='slowdown ratio reported as regression',
+    )
+
+    for sub in (run_parser, compare_parser):
+        sub.add_argument('--filter', help='only cases containing this')
+        sub.add_argument('--repeat', type=int, default=5)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    current = run(args.filter, args.repeat)
+
+    if args.command == 'run':
+        text = json.dumps(current, indent=2)
+        print(text)
+        if args.output:
+            os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+            with open(args.output, 'w') as f:
+                f.write(text + '\n')
+        return
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    rows = compare(current, baseline, args.threshold)
+    print('{:<45} {:>12} {:>12} {:>7}'.format(
+        'case', 'baseline', 'current', 'ratio',
+    ))
+    for name, stored, result, ratio, regressed in rows:
+        print('{:<45} {:>11.6f}s {:>11.6f}s {:>6.2f}x{}'.format(
+            name, stored, result, ratio, '  REGRESSION' if regressed else '',
+        ))
+    if any(row[4] for row in rows):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
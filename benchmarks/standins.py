@@ -0,0 +1,85 @@
+import contextlib
+import http.server
+import os
+import socketserver
+import threading
+import urllib.parse
+
+import boto3
+import moto
+
+SOURCE_BUCKET = 'bench-source'
+UPLOAD_BUCKET = 'bench-upload'
+INVALID_STREAM = 'bench-invalid'
+ERROR_STREAM = 'bench-error'
+REGION = 'eu-west-1'
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+def handler_for(directory):
+    class Handler(http.server.SimpleHTTPRequestHandler):
+        def translate_path(self, path):
+            name = os.path.basename(urllib.parse.urlparse(path).path)
+            return os.path.join(directory, urllib.parse.unquote(name))
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+class FileServer:
+    """
+    Serves files of a local directory over HTTP on a free port.
+    """
+
+    def __init__(self, directory):
+        """
+        :param str directory: directory to serve
+        """
+        self.server = ThreadingHTTPServer(
+            ('127.0.0.1', 0),
+            handler_for(directory),
+        )
+        self.thread = threading.Thread(
+            target=self.server.serve_forever,
+            daemon=True,
+        )
+        self.thread.start()
+
+    def url(self, name):
+        return 'http://127.0.0.1:{}/{}'.format(self.server.server_port, name)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@contextlib.contextmanager
+def local_aws():
+    """ In process S3 and Kinesis with benchmark buckets and streams
+
+    :return: source bucket
+    :rtype: boto3.S3.Bucket
+    """
+    # newer botocore sends uploads aws-chunked, which moto stores as is,
+    # so downloads would fail checksum verification
+    previous = os.environ.get('AWS_REQUEST_CHECKSUM_CALCULATION')
+    os.environ['AWS_REQUEST_CHECKSUM_CALCULATION'] = 'when_required'
+    try:
+        with moto.mock_s3(), moto.mock_kinesis():
+            s3 = boto3.resource('s3', region_name='us-east-1')
+            source = s3.create_bucket(Bucket=SOURCE_BUCKET)
+            s3.create_bucket(Bucket=UPLOAD_BUCKET)
+            kinesis = boto3.client('kinesis', REGION)
+            for name in (INVALID_STREAM, ERROR_STREAM):
+                kinesis.create_stream(StreamName=name, ShardCount=1)
+            yield source
+    finally:
+        if previous is None:
+            del os.environ['AWS_REQUEST_CHECKSUM_CALCULATION']
+        else:
+            os.environ['AWS_REQUEST_CHECKSUM_CALCULATION'] = previous
@@ -0,0 +1,29 @@
+import resource
+import sys
+
+
+def percentile(values, p):
+    """ Nearest rank percentile
+
+    :param values: numbers
+    :param float p: percentile between 0 and 100
+    :return: value or None if no values
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(p / 100.0 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    """ Peak resident set size in MB
+
+    :param int who: RUSAGE_SELF or RUSAGE_CHILDREN
+    :rtype: float
+    """
+    peak = resource.getrusage(who).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    if sys.platform == 'darwin':
+        return peak / 1024.0 / 1024.0
+    return peak / 1024.0
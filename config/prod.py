@@ -6,3 +6,6 @@ error_stream_name = 'message_error_prod'
 adaptor_aws_region = 'eu-west-2'
 
 organisation_buckets = {}
+
+record_workers = 4
+ledger_path = '/home/preservicaservice/ingest-ledger.sqlite3'
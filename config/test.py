@@ -8,3 +8,5 @@ adaptor_aws_region = 'eu-west-2'
 organisation_buckets = {
     '44': 's3://some_bucket',
 }
+
+record_workers = 4
@@ -146,6 +146,19 @@ data "aws_iam_policy_document" "upload_buckets_policy" {
 
     resources = "${formatlist("%s/*", var.upload_buckets_arns)}"
   }
+
+  # bundles larger than one part are staged under incomplete/ until
+  # published, see preservicaservice/multipart.py
+  statement {
+    effect = "Allow"
+
+    actions = [
+      "s3:DeleteObject",
+      "s3:AbortMultipartUpload",
+    ]
+
+    resources = "${formatlist("%s/incomplete/*", var.upload_buckets_arns)}"
+  }
 }
 
 resource "aws_iam_role_policy" "jisc-repository-bucket" {
@@ -0,0 +1,124 @@
+import contextlib
+import logging
+import os
+import shutil
+import threading
+
+from .errors import UnderlyingSystemError
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionController:
+    """
+    Limits bytes of records in flight by budget and free scratch disk.
+
+    Work reserves its expected bytes before starting, callers block while
+    the budget or disk is exhausted. A record bigger than the whole budget
+    is admitted once nothing else is in flight.
+    """
+
+    def __init__(
+        self, budget_bytes, scratch_dir, min_free_bytes, poll_interval=1.0,
+    ):
+        """
+        :param int budget_bytes: max reserved bytes at once
+        :param scratch_dir: directory downloads and bundles are written to,
+            or list of them when spread over several volumes
+        :type scratch_dir: str or list of str
+        :param int min_free_bytes: free disk to keep on top of reservations
+        :param float poll_interval: seconds between disk checks when waiting
+        """
+        self.budget_bytes = budget_bytes
+        if isinstance(scratch_dir, str):
+            scratch_dir = [scratch_dir]
+        self.scratch_dirs = list(scratch_dir)
+        self.min_free_bytes = min_free_bytes
+        self.poll_interval = poll_interval
+        self.in_flight_bytes = 0
+        self.in_flight_count = 0
+        self._cond = threading.Condition()
+
+    def free_disk_bytes(self):
+        devices = {}
+        for directory in self.scratch_dirs:
+            devices.setdefault(os.stat(directory).st_dev, directory)
+        return sum(
+            shutil.disk_usage(directory).free for directory in devices.values()
+        )
+
+    def _fits(self, nbytes):
+        # reservations in flight may not have been written yet
+        free = self.free_disk_bytes() - self.in_flight_bytes
+        if free - nbytes < self.min_free_bytes:
+            if not self.in_flight_count:
+                raise UnderlyingSystemError(
+                    'not enough scratch space for {} bytes, {} free'.format(
+                        nbytes, free,
+                    ),
+                )
+            return False
+        if not self.in_flight_count:
+            return True
+        return self.in_flight_bytes + nbytes <= self.budget_bytes
+
+    def try_reserve(self, nbytes):
+        """ Reserve bytes if possible without waiting
+
+        :param int nbytes: expected bytes on scratch disk
+        :raise: UnderlyingSystemError if it can never fit on disk
+        :return: True if reserved
+        :rtype: bool
+        """
+        with self._cond:
+            if not self._fits(nbytes):
+                return False
+            self.in_flight_bytes += nbytes
+            self.in_flight_count += 1
+            return True
+
+    def reserve(self, nbytes):
+        """ Reserve bytes, waiting until budget and disk allow
+
+        :param int nbytes: expected bytes on scratch disk
+        :raise: UnderlyingSystemError if it can never fit on disk
+        """
+        with self._cond:
+            waited = False
+            while not self._fits(nbytes):
+                if not waited:
+                    logger.info(
+                        'waiting to admit %d bytes, %d in flight',
+                        nbytes, self.in_flight_bytes,
+                    )
+                    waited = True
+                self._cond.wait(self.poll_interval)
+            self.in_flight_bytes += nbytes
+            self.in_flight_count += 1
+
+    def release(self, nbytes):
+        """ Return reserved bytes
+
+        :param int nbytes: bytes given to reserve
+        """
+        with self._cond:
+            self.in_flight_bytes -= nbytes
+            self.in_flight_count -= 1
+            self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def admitted(self, nbytes):
+        """ Hold reservation for the duration of the block
+
+        Nothing is reserved for work needing no scratch disk.
+
+        :param int nbytes: expected bytes on scratch disk
+        """
+        if not nbytes:
+            yield
+            return
+        self.reserve(nbytes)
+        try:
+            yield
+        finally:
+            self.release(nbytes)
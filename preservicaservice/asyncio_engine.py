@@ -0,0 +1,101 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from .config import ConfigError
+from .engines import BaseEngine
+from .tasks_parser import decode_record
+
+try:
+    import aiohttp
+except ImportError:  # optional, install with the asyncio extra
+    aiohttp = None
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncioEngine(BaseEngine):
+    """
+    Runs records as coroutines on one event loop.
+
+    HTTP transfers share one aiohttp session, so hundreds of files can be in
+    flight without a thread each. Work that only has a blocking client (S3,
+    Preservica bucket lookup, zip, upload) runs in a bounded executor.
+    """
+    NAME = 'asyncio'
+
+    def __init__(self, processor):
+        super().__init__(processor)
+        if aiohttp is None:
+            raise ConfigError('asyncio engine requires aiohttp')
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.config.async_blocking_workers,
+        )
+        self.loop = asyncio.new_event_loop()
+        self.loop.set_default_executor(self.executor)
+
+    def process_batch(self, records, on_complete):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(
+            self._process_batch(records, on_complete),
+        )
+
+    def shutdown(self):
+        self.loop.close()
+        self.executor.shutdown(wait=True)
+
+    async def _process_batch(self, records, on_complete):
+        record_slots = asyncio.Semaphore(self.config.record_workers)
+        transfer_slots = asyncio.Semaphore(self.config.async_max_transfers)
+        connector = aiohttp.TCPConnector(
+            limit=self.config.async_max_transfers,
+        )
+        async with aiohttp.ClientSession(connector=connector) as session:
+            coroutines = [
+                self._process_record(
+                    i, record, record_slots, transfer_slots, session,
+                ) for i, record in enumerate(records)
+            ]
+            for future in asyncio.as_completed(coroutines):
+                on_complete(await future)
+
+    async def _process_record(
+        self, index, record, record_slots, transfer_slots, session,
+    ):
+        """ Handle single record, never fails
+
+        :return: handled record
+        """
+        async with record_slots:
+            self.processor.scheduler.started(record)
+            try:
+                await self._run_record(index, record, transfer_slots, session)
+            except Exception as e:
+                try:
+                    await self._blocking(self.processor.handle_error, record, e)
+                except Exception:
+                    logger.exception('failed to report error of record %d', index)
+        return record
+
+    async def _run_record(self, index, record, transfer_slots, session):
+        logger.debug('processing record %d', index)
+        message = decode_record(record)
+        task = await self._blocking(self.processor.build_task, message)
+        if not task:
+            return
+        admission = self.processor.admission
+        nbytes = await self._blocking(self.processor.scratch_bytes, task)
+        # poll, executor threads are needed by records releasing space
+        while not admission.try_reserve(nbytes):
+            await asyncio.sleep(admission.poll_interval)
+        try:
+            await task.download_files_async(transfer_slots, session)
+            await self._blocking(task.build_bundle)
+            await self._blocking(task.upload)
+            await self._blocking(self.processor.task_succeeded, task)
+        finally:
+            task.cleanup()
+            admission.release(nbytes)
+
+    def _blocking(self, func, *args):
+        return self.loop.run_in_executor(None, func, *args)
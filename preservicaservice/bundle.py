@@ -0,0 +1,57 @@
+import zipfile
+
+from .hashing import HashingWriter
+
+
+class BundleWriter:
+    """
+    Zip bundle kept open from its first member to its last.
+
+    Message meta and file tasks write their members to zip_file, and the
+    central directory is written once on close. Bundle size and total size
+    of members are counted on the way, so S3 metadata needs no second pass
+    over the archive. A bundle left by an exception is discarded rather
+    than finished.
+    """
+
+    def __init__(self, output):
+        """
+        :param output: writable file object, need not be seekable
+        """
+        self.counter = HashingWriter(output, algorithms=())
+        self.zip_file = zipfile.ZipFile(
+            self.counter, 'w', compression=zipfile.ZIP_DEFLATED,
+        )
+        self.size_uncompressed = 0
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    @property
+    def size(self):
+        """ Bytes written so far, size of the bundle once closed """
+        return self.counter.size
+
+    def close(self):
+        """ Write central directory, totals are final after this """
+        if self.closed:
+            return
+        self.size_uncompressed = sum(
+            info.file_size for info in self.zip_file.infolist()
+        )
+        self.zip_file.close()
+        self.closed = True
+
+    def discard(self):
+        """ Drop unfinished bundle, nothing more is written to output """
+        # close() of a ZipFile without fp, such as on garbage collection,
+        # writes nothing
+        self.zip_file.fp = None
+        self.closed = True
@@ -0,0 +1,182 @@
+import collections
+import logging
+import threading
+import time
+
+from amazon_kclpy import kcl
+
+logger = logging.getLogger(__name__)
+
+
+class SequenceTracker:
+    """
+    Tracks in flight records by sequence number.
+
+    Records may complete in any order, only the highest sequence number
+    below which every started record has completed is safe to checkpoint.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight = collections.OrderedDict()
+        self.safe_sequence_number = None
+        self.completed_count = 0
+
+    def started(self, sequence_number):
+        """ Register record, must be called in stream order
+
+        :param str sequence_number: record sequence number
+        """
+        with self._lock:
+            self._in_flight[sequence_number] = False
+
+    def completed(self, sequence_number):
+        """ Mark record done and advance safe sequence number if possible
+
+        :param str sequence_number: record sequence number
+        """
+        with self._lock:
+            if sequence_number not in self._in_flight:
+                return
+            self._in_flight[sequence_number] = True
+            self.completed_count += 1
+            while self._in_flight:
+                first, done = next(iter(self._in_flight.items()))
+                if not done:
+                    break
+                self._in_flight.popitem(last=False)
+                self.safe_sequence_number = first
+
+    @property
+    def in_flight_count(self):
+        with self._lock:
+            return len(self._in_flight)
+
+
+class BatchCheckpointer:
+    """
+    Checkpoints the highest contiguous completed record every N records or
+    T seconds, whichever comes first.
+
+    Only call checkpoint methods from the thread KCL invoked the processor
+    on, the multi-language protocol is not thread safe.
+    """
+
+    def __init__(
+        self, every_records, every_seconds, number_of_tries=5,
+        retry_sleep=1.0,
+    ):
+        """
+        :param int every_records: completed records between checkpoints
+        :param int every_seconds: max seconds between checkpoints
+        :param int number_of_tries: tries on throttling before giving up
+        :param float retry_sleep: base sleep between tries, doubles each time
+        """
+        self.every_records = every_records
+        self.every_seconds = every_seconds
+        self.number_of_tries = number_of_tries
+        self.retry_sleep = retry_sleep
+        self.tracker = SequenceTracker()
+        self.last_sequence_number = None
+        self.last_completed_count = 0
+        self.last_time = time.monotonic()
+
+    def started(self, record):
+        """ Track record, records without sequence number are ignored
+
+        :param Record record: KCL record
+        """
+        sequence_number = getattr(record, 'sequence_number', None)
+        if sequence_number is not None:
+            self.tracker.started(sequence_number)
+
+    def completed(self, record):
+        """ Mark record as done
+
+        :param Record record: KCL record
+        """
+        sequence_number = getattr(record, 'sequence_number', None)
+        if sequence_number is not None:
+            self.tracker.completed(sequence_number)
+
+    def is_due(self):
+        """ Check if enough records or time passed since last checkpoint
+
+        :rtype: bool
+        """
+        completed = self.tracker.completed_count - self.last_completed_count
+        elapsed = time.monotonic() - self.last_time
+        return (
+            completed >= self.every_records or
+            (completed and elapsed >= self.every_seconds)
+        )
+
+    def maybe_checkpoint(self, checkpointer):
+        """ Checkpoint if due and there is progress to record
+
+        :param checkpointer: KCL checkpointer
+        """
+        if checkpointer is None or not self.is_due():
+            return
+        self.checkpoint_safe(checkpointer)
+
+    def checkpoint_safe(self, checkpointer):
+        """ Checkpoint highest contiguous completed record if not yet done
+
+        :param checkpointer: KCL checkpointer
+        """
+        sequence_number = self.tracker.safe_sequence_number
+        if sequence_number is None or \
+                sequence_number == self.last_sequence_number:
+            return
+        if self.checkpoint(checkpointer, sequence_number):
+            self.last_sequence_number = sequence_number
+        self.last_completed_count = self.tracker.completed_count
+        self.last_time = time.monotonic()
+
+    def checkpoint(self, checkpointer, sequence_number=None):
+        """ Checkpoint with retries on throttling
+
+        :param checkpointer: KCL checkpointer
+        :param str sequence_number: position to checkpoint, None for
+            everything delivered so far
+        :return: True if checkpoint stored
+        :rtype: bool
+        """
+        sleep = self.retry_sleep
+        for n in range(1, self.number_of_tries + 1):
+            try:
+                checkpointer.checkpoint(sequence_number)
+                logger.debug('checkpointed at %s', sequence_number)
+                return True
+            except kcl.CheckpointError as e:
+                if 'ShutdownException' == e.value:
+                    logger.info(
+                        'shutting down, not checkpointing %s',
+                        sequence_number,
+                    )
+                    return False
+                elif 'ThrottlingException' == e.value:
+                    if n == self.number_of_tries:
+                        break
+                    logger.info(
+                        'checkpoint throttled, sleeping for %s seconds',
+                        sleep,
+                    )
+                elif 'InvalidStateException' == e.value:
+                    logger.error(
+                        'invalid state for checkpoint %s', sequence_number,
+                    )
+                    return False
+                else:
+                    logger.error(
+                        'checkpoint %s failed, %s', sequence_number, e,
+                    )
+            time.sleep(sleep)
+            sleep *= 2
+        logger.error(
+            'gave up checkpointing %s after %d tries',
+            sequence_number,
+            self.number_of_tries,
+        )
+        return False
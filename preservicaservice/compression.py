@@ -0,0 +1,227 @@
+import collections
+import os
+import time
+import zipfile
+import zlib
+
+from . import metrics
+from .ziputil import DeflatedMemberWriter, write_member
+
+DEFAULT_LEVEL = 6
+FAST_LEVEL = 1
+# bytes of a member compressed to judge types neither name nor content tell
+TRIAL_BYTES = 64 * 1024
+# trial compressed to at least this share of its size, deflate is not worth it
+STORE_RATIO = 0.95
+# below this share the default level pays, above it the fast level gets most
+FAST_RATIO = 0.8
+# deflate cost before any trial measured it, about 30 MiB/s
+DEFAULT_SECONDS_PER_BYTE = 1.0 / (30 * 1024 * 1024)
+# weight of the latest trial in the running deflate cost
+COST_WEIGHT = 0.1
+
+# formats compressed already, deflate gains nothing on them
+COMPRESSED_EXTENSIONS = frozenset((
+    '.7z', '.aac', '.avi', '.bz2', '.docx', '.epub', '.flac', '.gif', '.gz',
+    '.heic', '.jar', '.jp2', '.jpeg', '.jpg', '.m4a', '.m4v', '.mkv', '.mov',
+    '.mp3', '.mp4', '.odp', '.ods', '.odt', '.ogg', '.png', '.pptx', '.rar',
+    '.tgz', '.webm', '.webp', '.xlsx', '.xz', '.zip', '.zst',
+))
+# formats known to deflate well
+TEXT_EXTENSIONS = frozenset((
+    '.csv', '.htm', '.html', '.json', '.metadata', '.tsv', '.txt', '.xml',
+))
+# leading bytes of compressed formats, for files named without extension
+COMPRESSED_MAGIC = (
+    b'PK\x03\x04',  # zip and office documents
+    b'\xff\xd8\xff',  # jpeg
+    b'\x89PNG\r\n\x1a\n',
+    b'GIF87a',
+    b'GIF89a',
+    b'\x1f\x8b',  # gzip
+    b'BZh',
+    b'\xfd7zXZ\x00',
+    b"7z\xbc\xaf'\x1c",
+    b'Rar!\x1a\x07',
+    b'\x28\xb5\x2f\xfd',  # zstd
+    b'\x00\x00\x00\x0cjP  \r\n\x87\n',  # jpeg 2000
+    b'OggS',
+    b'fLaC',
+    b'ID3',  # mp3
+    b'\x1a\x45\xdf\xa3',  # matroska and webm
+)
+# ISO media files (mp4, mov, heic) have their type at offset 4
+ISO_MEDIA_TYPE = b'ftyp'
+
+
+class Decision(collections.namedtuple(
+    'Decision', ['compress_type', 'level', 'policy'],
+)):
+    """ How to write one member, and which rule of the policy chose it """
+    __slots__ = ()
+
+    @property
+    def stored(self):
+        return self.compress_type == zipfile.ZIP_STORED
+
+    def open(self, zip_file, zinfo, force_zip64=False):
+        """ Open member to stream data of unknown size into
+
+        Streamed members are followed by a data descriptor, which common
+        readers only accept after deflated data. Stored ones are written
+        as deflate level 0, which copies the data.
+
+        :param zipfile.ZipFile zip_file: archive open for writing
+        :param zipfile.ZipInfo zinfo: member info
+        :param bool force_zip64: use Zip64 sizes whatever the expected size
+        :rtype: preservicaservice.ziputil.DeflatedMemberWriter
+        """
+        level = 0 if self.stored else self.level
+        return DeflatedMemberWriter(zip_file, zinfo, level, force_zip64)
+
+    def write(self, zip_file, zinfo, data):
+        """ Add member with data in memory
+
+        :param zipfile.ZipFile zip_file: archive open for writing
+        :param zipfile.ZipInfo zinfo: member info
+        :param bytes data: member data
+        """
+        write_member(zip_file, zinfo, data, self.compress_type, self.level)
+
+
+class DeflatePolicy:
+    """ Deflates every member with the default level """
+    NAME = 'deflate'
+
+    def choose(self, name, head):
+        """ Pick compression of a member
+
+        :param str name: member name
+        :param bytes head: first bytes of member data
+        :rtype: Decision
+        """
+        return Decision(zipfile.ZIP_DEFLATED, DEFAULT_LEVEL, self.NAME)
+
+    def choose_file(self, name, path):
+        """ Pick compression of a member from a local file
+
+        :param str name: member name
+        :param str path: file with member data
+        :rtype: Decision
+        """
+        with open(path, 'rb') as f:
+            return self.choose(name, f.read(TRIAL_BYTES))
+
+    def record(self, decision, file_size, compress_size):
+        """ Count what the decision on a written member saved
+
+        Deflated members save the bytes they shrank by. Stored members save
+        the CPU deflating them would have taken, estimated from the trials.
+
+        :param Decision decision: how member was written
+        :param int file_size: member bytes
+        :param int compress_size: member bytes in archive
+        """
+        if decision.stored:
+            metrics.increment(
+                'compression_stored_bytes', file_size, policy=decision.policy,
+            )
+            metrics.increment(
+                'compression_cpu_saved_seconds',
+                file_size * self.seconds_per_byte(),
+                policy=decision.policy,
+            )
+        else:
+            metrics.increment(
+                'compression_saved_bytes', file_size - compress_size,
+                policy=decision.policy,
+            )
+
+    def seconds_per_byte(self):
+        return DEFAULT_SECONDS_PER_BYTE
+
+
+class ContentPolicy(DeflatePolicy):
+    """
+    Stores members deflate would not shrink, picks a level for the rest.
+
+    Decides by file extension first, then by leading magic bytes, then by
+    deflating a sample of the member.
+    """
+    NAME = 'content'
+
+    def __init__(
+        self, trial_bytes=TRIAL_BYTES, store_ratio=STORE_RATIO,
+        fast_ratio=FAST_RATIO,
+    ):
+        """
+        :param int trial_bytes: bytes of unknown members compressed as trial
+        :param float store_ratio: store when trial shrinks to at least this
+        :param float fast_ratio: use fast level when trial shrinks to at
+            least this
+        """
+        self.trial_bytes = trial_bytes
+        self.store_ratio = store_ratio
+        self.fast_ratio = fast_ratio
+        self._seconds_per_byte = DEFAULT_SECONDS_PER_BYTE
+
+    def choose(self, name, head):
+        extension = os.path.splitext(name)[1].lower()
+        if extension in COMPRESSED_EXTENSIONS:
+            return Decision(zipfile.ZIP_STORED, 0, 'extension')
+        if extension in TEXT_EXTENSIONS:
+            return Decision(zipfile.ZIP_DEFLATED, DEFAULT_LEVEL, 'extension')
+        if self.is_compressed(head):
+            return Decision(zipfile.ZIP_STORED, 0, 'magic')
+        return self.trial(head[:self.trial_bytes])
+
+    @staticmethod
+    def is_compressed(head):
+        return (
+            head.startswith(COMPRESSED_MAGIC) or
+            head[4:8] == ISO_MEDIA_TYPE
+        )
+
+    def trial(self, sample):
+        """ Decide by deflating a sample with the default level
+
+        :param bytes sample: start of member data
+        :rtype: Decision
+        """
+        if not sample:
+            return Decision(zipfile.ZIP_DEFLATED, DEFAULT_LEVEL, 'trial')
+        started = time.perf_counter()
+        compressor = zlib.compressobj(DEFAULT_LEVEL, zlib.DEFLATED, -15)
+        size = len(compressor.compress(sample)) + len(compressor.flush())
+        self._seconds_per_byte += COST_WEIGHT * (
+            (time.perf_counter() - started) / len(sample) -
+            self._seconds_per_byte
+        )
+
+        ratio = size / len(sample)
+        if ratio >= self.store_ratio:
+            return Decision(zipfile.ZIP_STORED, 0, 'trial')
+        if ratio >= self.fast_ratio:
+            return Decision(zipfile.ZIP_DEFLATED, FAST_LEVEL, 'trial')
+        return Decision(zipfile.ZIP_DEFLATED, DEFAULT_LEVEL, 'trial')
+
+    def seconds_per_byte(self):
+        return self._seconds_per_byte
+
+
+DEFLATE = DeflatePolicy()
+CONTENT = ContentPolicy()
+
+POLICIES = {
+    DEFLATE.NAME: DEFLATE,
+    CONTENT.NAME: CONTENT,
+}
+
+
+def get_policy(name):
+    """ Shared policy by config name
+
+    :param str name: content or deflate
+    :rtype: DeflatePolicy
+    """
+    return POLICIES[name]
@@ -55,6 +55,93 @@ REGIONS = (
     'us-west-2',
 )
 
+ENGINES = ('threads', 'pipeline', 'asyncio')
+RECORD_ORDERS = ('fair_share', 'largest_first', 'arrival')
+METRICS_SINKS = ('null', 'emf', 'prometheus')
+PROFILE_SIGNALS = ('SIGUSR1', 'SIGUSR2')
+COMPRESSION_POLICIES = ('content', 'deflate')
+
+DEFAULT_ENGINE = 'threads'
+DEFAULT_RECORD_WORKERS = 4
+DEFAULT_RECORD_ORDER = 'fair_share'
+DEFAULT_CHECKPOINT_EVERY_RECORDS = 100
+DEFAULT_CHECKPOINT_EVERY_SECONDS = 60
+DEFAULT_PIPELINE_QUEUE_SIZE = 2
+DEFAULT_PIPELINE_BUILD_WORKERS = 2
+DEFAULT_PIPELINE_DOWNLOAD_WORKERS = 4
+DEFAULT_PIPELINE_BUNDLE_WORKERS = os.cpu_count() or 1
+DEFAULT_PIPELINE_UPLOAD_WORKERS = 2
+DEFAULT_ASYNC_MAX_TRANSFERS = 100
+DEFAULT_ASYNC_BLOCKING_WORKERS = 8
+DEFAULT_OFFLOAD_WORKERS = os.cpu_count() or 1
+DEFAULT_OFFLOAD_MIN_BYTES = 8 * 1024 * 1024
+DEFAULT_PARALLEL_DEFLATE_THREADS = os.cpu_count() or 1
+DEFAULT_PARALLEL_DEFLATE_MIN_BYTES = 64 * 1024 * 1024
+DEFAULT_DOWNLOAD_WORKERS = 16
+DEFAULT_MESSAGE_DOWNLOAD_WORKERS = 4
+DEFAULT_COMPRESSION_POLICY = 'content'
+DEFAULT_FILE_SIZE_LIMIT = None
+DEFAULT_SCRATCH_DIRS = None
+DEFAULT_SCRATCH_SMALL_DIR = None
+DEFAULT_SCRATCH_SMALL_FILE_BYTES = 8 * 1024 * 1024
+DEFAULT_MEMORY_BUNDLE_BYTES = 16 * 1024 * 1024
+DEFAULT_LEDGER_PATH = None
+DEFAULT_DRY_DESTINATION_DIR = None
+DEFAULT_ADMISSION_BUDGET_BYTES = 20 * 1024 * 1024 * 1024
+DEFAULT_ADMISSION_MIN_FREE_BYTES = 1024 * 1024 * 1024
+DEFAULT_ADMISSION_DEFAULT_FILE_BYTES = 100 * 1024 * 1024
+DEFAULT_METRICS_SINK = 'null'
+DEFAULT_METRICS_PATH = None
+DEFAULT_METRICS_NAMESPACE = 'PreservicaAdaptor'
+DEFAULT_METRICS_FLUSH_SECONDS = 60
+DEFAULT_PROFILE_DIR = None
+DEFAULT_PROFILE_SIGNAL = 'SIGUSR2'
+DEFAULT_PROFILE_SENTINEL_PATH = None
+DEFAULT_PROFILE_RECORD_FRACTION = 0
+DEFAULT_PROFILE_SLOW_RECORD_SECONDS = 60
+
+# settings which may be omitted from environment config files
+OPTIONAL_SETTINGS = {
+    'engine': DEFAULT_ENGINE,
+    'record_workers': DEFAULT_RECORD_WORKERS,
+    'record_order': DEFAULT_RECORD_ORDER,
+    'checkpoint_every_records': DEFAULT_CHECKPOINT_EVERY_RECORDS,
+    'checkpoint_every_seconds': DEFAULT_CHECKPOINT_EVERY_SECONDS,
+    'pipeline_queue_size': DEFAULT_PIPELINE_QUEUE_SIZE,
+    'pipeline_build_workers': DEFAULT_PIPELINE_BUILD_WORKERS,
+    'pipeline_download_workers': DEFAULT_PIPELINE_DOWNLOAD_WORKERS,
+    'pipeline_bundle_workers': DEFAULT_PIPELINE_BUNDLE_WORKERS,
+    'pipeline_upload_workers': DEFAULT_PIPELINE_UPLOAD_WORKERS,
+    'async_max_transfers': DEFAULT_ASYNC_MAX_TRANSFERS,
+    'async_blocking_workers': DEFAULT_ASYNC_BLOCKING_WORKERS,
+    'offload_workers': DEFAULT_OFFLOAD_WORKERS,
+    'offload_min_bytes': DEFAULT_OFFLOAD_MIN_BYTES,
+    'parallel_deflate_threads': DEFAULT_PARALLEL_DEFLATE_THREADS,
+    'parallel_deflate_min_bytes': DEFAULT_PARALLEL_DEFLATE_MIN_BYTES,
+    'download_workers': DEFAULT_DOWNLOAD_WORKERS,
+    'message_download_workers': DEFAULT_MESSAGE_DOWNLOAD_WORKERS,
+    'compression_policy': DEFAULT_COMPRESSION_POLICY,
+    'file_size_limit': DEFAULT_FILE_SIZE_LIMIT,
+    'scratch_dirs': DEFAULT_SCRATCH_DIRS,
+    'scratch_small_dir': DEFAULT_SCRATCH_SMALL_DIR,
+    'scratch_small_file_bytes': DEFAULT_SCRATCH_SMALL_FILE_BYTES,
+    'memory_bundle_bytes': DEFAULT_MEMORY_BUNDLE_BYTES,
+    'ledger_path': DEFAULT_LEDGER_PATH,
+    'dry_destination_dir': DEFAULT_DRY_DESTINATION_DIR,
+    'admission_budget_bytes': DEFAULT_ADMISSION_BUDGET_BYTES,
+    'admission_min_free_bytes': DEFAULT_ADMISSION_MIN_FREE_BYTES,
+    'admission_default_file_bytes': DEFAULT_ADMISSION_DEFAULT_FILE_BYTES,
+    'metrics_sink': DEFAULT_METRICS_SINK,
+    'metrics_path': DEFAULT_METRICS_PATH,
+    'metrics_namespace': DEFAULT_METRICS_NAMESPACE,
+    'metrics_flush_seconds': DEFAULT_METRICS_FLUSH_SECONDS,
+    'profile_dir': DEFAULT_PROFILE_DIR,
+    'profile_signal': DEFAULT_PROFILE_SIGNAL,
+    'profile_sentinel_path': DEFAULT_PROFILE_SENTINEL_PATH,
+    'profile_record_fraction': DEFAULT_PROFILE_RECORD_FRACTION,
+    'profile_slow_record_seconds': DEFAULT_PROFILE_SLOW_RECORD_SECONDS,
+}
+
 
 class Config:
     """
@@ -70,6 +157,44 @@ class Config:
         error_stream_name,
         adaptor_aws_region,
         organisation_buckets,
+        engine=DEFAULT_ENGINE,
+        record_workers=DEFAULT_RECORD_WORKERS,
+        record_order=DEFAULT_RECORD_ORDER,
+        checkpoint_every_records=DEFAULT_CHECKPOINT_EVERY_RECORDS,
+        checkpoint_every_seconds=DEFAULT_CHECKPOINT_EVERY_SECONDS,
+        pipeline_queue_size=DEFAULT_PIPELINE_QUEUE_SIZE,
+        pipeline_build_workers=DEFAULT_PIPELINE_BUILD_WORKERS,
+        pipeline_download_workers=DEFAULT_PIPELINE_DOWNLOAD_WORKERS,
+        pipeline_bundle_workers=DEFAULT_PIPELINE_BUNDLE_WORKERS,
+        pipeline_upload_workers=DEFAULT_PIPELINE_UPLOAD_WORKERS,
+        async_max_transfers=DEFAULT_ASYNC_MAX_TRANSFERS,
+        async_blocking_workers=DEFAULT_ASYNC_BLOCKING_WORKERS,
+        offload_workers=DEFAULT_OFFLOAD_WORKERS,
+        offload_min_bytes=DEFAULT_OFFLOAD_MIN_BYTES,
+        parallel_deflate_threads=DEFAULT_PARALLEL_DEFLATE_THREADS,
+        parallel_deflate_min_bytes=DEFAULT_PARALLEL_DEFLATE_MIN_BYTES,
+        download_workers=DEFAULT_DOWNLOAD_WORKERS,
+        message_download_workers=DEFAULT_MESSAGE_DOWNLOAD_WORKERS,
+        compression_policy=DEFAULT_COMPRESSION_POLICY,
+        file_size_limit=DEFAULT_FILE_SIZE_LIMIT,
+        scratch_dirs=DEFAULT_SCRATCH_DIRS,
+        scratch_small_dir=DEFAULT_SCRATCH_SMALL_DIR,
+        scratch_small_file_bytes=DEFAULT_SCRATCH_SMALL_FILE_BYTES,
+        memory_bundle_bytes=DEFAULT_MEMORY_BUNDLE_BYTES,
+        ledger_path=DEFAULT_LEDGER_PATH,
+        dry_destination_dir=DEFAULT_DRY_DESTINATION_DIR,
+        admission_budget_bytes=DEFAULT_ADMISSION_BUDGET_BYTES,
+        admission_min_free_bytes=DEFAULT_ADMISSION_MIN_FREE_BYTES,
+        admission_default_file_bytes=DEFAULT_ADMISSION_DEFAULT_FILE_BYTES,
+        metrics_sink=DEFAULT_METRICS_SINK,
+        metrics_path=DEFAULT_METRICS_PATH,
+        metrics_namespace=DEFAULT_METRICS_NAMESPACE,
+        metrics_flush_seconds=DEFAULT_METRICS_FLUSH_SECONDS,
+        profile_dir=DEFAULT_PROFILE_DIR,
+        profile_signal=DEFAULT_PROFILE_SIGNAL,
+        profile_sentinel_path=DEFAULT_PROFILE_SENTINEL_PATH,
+        profile_record_fraction=DEFAULT_PROFILE_RECORD_FRACTION,
+        profile_slow_record_seconds=DEFAULT_PROFILE_SLOW_RECORD_SECONDS,
     ):
         """
         :param str environment: name of the environment (dev/uat/prod)
@@ -78,6 +203,74 @@ class Config:
         :param str adaptor_aws_region: kinesis error stream region
         :param organisation_buckets: mapping of S3 buckets
         :type organisation_buckets: dict of (str => str)
+        :param str engine: how records are run, one of ENGINES
+        :param int record_workers: number of records processed at once
+        :param str record_order: order records of a batch are started in,
+            one of RECORD_ORDERS
+        :param int checkpoint_every_records: completed records between
+            checkpoints
+        :param int checkpoint_every_seconds: max seconds between checkpoints
+        :param int pipeline_queue_size: max records waiting for each
+            pipeline stage
+        :param int pipeline_build_workers: pipeline task build threads
+        :param int pipeline_download_workers: pipeline download threads
+        :param int pipeline_bundle_workers: pipeline zip threads
+        :param int pipeline_upload_workers: pipeline upload threads
+        :param int async_max_transfers: asyncio engine concurrent downloads
+        :param int async_blocking_workers: asyncio engine threads for
+            blocking calls (S3, zip, upload)
+        :param int offload_workers: processes compressing large files, 0 to
+            do it in the worker itself
+        :param int offload_min_bytes: smallest file sent to offload processes
+        :param int parallel_deflate_threads: threads deflating one large file
+            in blocks, 0 or 1 to deflate it in one piece
+        :param int parallel_deflate_min_bytes: smallest file deflated in
+            blocks, takes precedence over offload processes
+        :param int download_workers: threads downloading files of all
+            messages ahead of their bundle, 0 to download one at a time
+        :param int message_download_workers: max files of one message
+            downloading at once
+        :param str compression_policy: content to store already compressed
+            files and pick deflate levels, deflate to deflate everything
+        :param int file_size_limit: bytes from which files are rejected,
+            before download when their size is known, None for no limit
+        :param scratch_dirs: directories downloads and bundles are written
+            to, the one with most free disk is picked for each file, None for
+            the temp dir
+        :type scratch_dirs: list of str
+        :param str scratch_small_dir: directory for small files, such as a
+            tmpfs, None to keep them with the rest
+        :param int scratch_small_file_bytes: largest file put in
+            scratch_small_dir
+        :param int memory_bundle_bytes: messages whose files total at most
+            this, by declared or remote size, are bundled in memory, 0 to
+            always use scratch disk
+        :param str ledger_path: sqlite file recording ingested bundles,
+            None to disable
+        :param str dry_destination_dir: write bundles under this local
+            directory instead of uploading, None to upload
+        :param int admission_budget_bytes: max scratch bytes reserved by
+            records in flight
+        :param int admission_min_free_bytes: free scratch disk kept on top of
+            reservations
+        :param int admission_default_file_bytes: size reserved for files with
+            no fileSize and no size from the remote
+        :param str metrics_sink: where stage metrics go, one of METRICS_SINKS
+        :param str metrics_path: file metrics are written to, required by
+            prometheus, emf logs them when not set
+        :param str metrics_namespace: CloudWatch namespace, prefix of
+            Prometheus metric names
+        :param int metrics_flush_seconds: min seconds between metric writes
+        :param str profile_dir: where stack samples and record profiles are
+            written, None for the temp directory
+        :param str profile_signal: signal toggling stack sampling, one of
+            PROFILE_SIGNALS or None to disable
+        :param str profile_sentinel_path: stack sampling is on while this
+            file exists, None to disable
+        :param float profile_record_fraction: share of records run under
+            cProfile, 0 to disable
+        :param int profile_slow_record_seconds: keep profiles of records at
+            least this slow
         """
         self.environment = environment
         self.preservica_base_url = preservica_base_url
@@ -112,6 +305,149 @@ class Config:
         self.organisation_buckets = dict(
             map(prepare_bucket_pair, organisation_buckets.items()),
         )
+        self.engine = self.validate_choice(
+            'engine',
+            engine,
+            ENGINES,
+        )
+        self.record_workers = self.validate_positive_int(
+            'record_workers',
+            record_workers,
+        )
+        self.record_order = self.validate_choice(
+            'record_order',
+            record_order,
+            RECORD_ORDERS,
+        )
+        self.checkpoint_every_records = self.validate_positive_int(
+            'checkpoint_every_records',
+            checkpoint_every_records,
+        )
+        self.checkpoint_every_seconds = self.validate_positive_int(
+            'checkpoint_every_seconds',
+            checkpoint_every_seconds,
+        )
+        self.pipeline_queue_size = self.validate_positive_int(
+            'pipeline_queue_size',
+            pipeline_queue_size,
+        )
+        self.pipeline_build_workers = self.validate_positive_int(
+            'pipeline_build_workers',
+            pipeline_build_workers,
+        )
+        self.pipeline_download_workers = self.validate_positive_int(
+            'pipeline_download_workers',
+            pipeline_download_workers,
+        )
+        self.pipeline_bundle_workers = self.validate_positive_int(
+            'pipeline_bundle_workers',
+            pipeline_bundle_workers,
+        )
+        self.pipeline_upload_workers = self.validate_positive_int(
+            'pipeline_upload_workers',
+            pipeline_upload_workers,
+        )
+        self.async_max_transfers = self.validate_positive_int(
+            'async_max_transfers',
+            async_max_transfers,
+        )
+        self.async_blocking_workers = self.validate_positive_int(
+            'async_blocking_workers',
+            async_blocking_workers,
+        )
+        self.offload_workers = self.validate_non_negative_int(
+            'offload_workers',
+            offload_workers,
+        )
+        self.offload_min_bytes = self.validate_non_negative_int(
+            'offload_min_bytes',
+            offload_min_bytes,
+        )
+        self.parallel_deflate_threads = self.validate_non_negative_int(
+            'parallel_deflate_threads',
+            parallel_deflate_threads,
+        )
+        self.parallel_deflate_min_bytes = self.validate_non_negative_int(
+            'parallel_deflate_min_bytes',
+            parallel_deflate_min_bytes,
+        )
+        self.download_workers = self.validate_non_negative_int(
+            'download_workers',
+            download_workers,
+        )
+        self.message_download_workers = self.validate_positive_int(
+            'message_download_workers',
+            message_download_workers,
+        )
+        self.compression_policy = self.validate_choice(
+            'compression_policy',
+            compression_policy,
+            COMPRESSION_POLICIES,
+        )
+        if file_size_limit is not None:
+            self.validate_positive_int('file_size_limit', file_size_limit)
+        self.file_size_limit = file_size_limit
+        if scratch_dirs is not None and (
+            not isinstance(scratch_dirs, list) or not scratch_dirs or
+            not all(isinstance(d, str) and d for d in scratch_dirs)
+        ):
+            raise ConfigValidationError(
+                'scratch_dirs',
+                '{} should be a list of directories'.format(scratch_dirs),
+            )
+        self.scratch_dirs = scratch_dirs
+        self.scratch_small_dir = scratch_small_dir
+        self.scratch_small_file_bytes = self.validate_non_negative_int(
+            'scratch_small_file_bytes',
+            scratch_small_file_bytes,
+        )
+        self.memory_bundle_bytes = self.validate_non_negative_int(
+            'memory_bundle_bytes',
+            memory_bundle_bytes,
+        )
+        self.ledger_path = ledger_path
+        self.dry_destination_dir = dry_destination_dir
+        self.admission_budget_bytes = self.validate_positive_int(
+            'admission_budget_bytes',
+            admission_budget_bytes,
+        )
+        self.admission_min_free_bytes = self.validate_non_negative_int(
+            'admission_min_free_bytes',
+            admission_min_free_bytes,
+        )
+        self.admission_default_file_bytes = self.validate_non_negative_int(
+            'admission_default_file_bytes',
+            admission_default_file_bytes,
+        )
+        self.metrics_sink = self.validate_choice(
+            'metrics_sink',
+            metrics_sink,
+            METRICS_SINKS,
+        )
+        if metrics_sink == 'prometheus' and not metrics_path:
+            raise ConfigValidationError(
+                'metrics_path',
+                'metrics_path is required by prometheus sink',
+            )
+        self.metrics_path = metrics_path
+        self.metrics_namespace = metrics_namespace
+        self.metrics_flush_seconds = self.validate_positive_int(
+            'metrics_flush_seconds',
+            metrics_flush_seconds,
+        )
+        self.profile_dir = profile_dir
+        if profile_signal is not None:
+            self.validate_choice('profile_signal', profile_signal, PROFILE_SIGNALS)
+        self.profile_signal = profile_signal
+        self.profile_sentinel_path = profile_sentinel_path
+        self.profile_record_fraction = self.validate_fraction(
+            'profile_record_fraction',
+            profile_record_fraction,
+        )
+        self.profile_slow_record_seconds = self.validate_non_negative_int(
+            'profile_slow_record_seconds',
+            profile_slow_record_seconds,
+        )
 
     @staticmethod
     def validate_region(field, value):
@@ -145,6 +481,74 @@ class Config:
             )
         return value
 
+    @staticmethod
+    def validate_positive_int(field, value):
+        """ Make sure value is a positive integer
+
+        :param str field: field name
+        :param value: raw value
+        :raise: ConfigValidationError if invalid
+        :return: value
+        """
+        if isinstance(value, bool) or not isinstance(value, int) or value < 1:
+            raise ConfigValidationError(
+                field,
+                '{} should be a positive integer'.format(value),
+            )
+        return value
+
+    @staticmethod
+    def validate_non_negative_int(field, value):
+        """ Make sure value is zero or a positive integer
+
+        :param str field: field name
+        :param value: raw value
+        :raise: ConfigValidationError if invalid
+        :return: value
+        """
+        if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+            raise ConfigValidationError(
+                field,
+                '{} should be zero or a positive integer'.format(value),
+            )
+        return value
+
+    @staticmethod
+    def validate_fraction(field, value):
+        """ Make sure value is a number from 0 to 1
+
+        :param str field: field name
+        :param value: raw value
+        :raise: ConfigValidationError if invalid
+        :return: value
+        """
+        if (
+            isinstance(value, bool) or not isinstance(value, (int, float)) or
+            not 0 <= value <= 1
+        ):
+            raise ConfigValidationError(
+                field,
+                '{} should be a number from 0 to 1'.format(value),
+            )
+        return value
+
+    @staticmethod
+    def validate_choice(field, value, choices):
+        """ Make sure value is one of allowed choices
+
+        :param str field: field name
+        :param value: raw value
+        :param choices: allowed values
+        :raise: ConfigValidationError if invalid
+        :return: value
+        """
+        if value not in choices:
+            raise ConfigValidationError(
+                field,
+                '{} not one of {}'.format(value, ', '.join(choices)),
+            )
+        return value
+
     @classmethod
     def build(cls, raw):
         """ Build config from python object
@@ -160,6 +564,10 @@ class Config:
             raw.error_stream_name,
             raw.adaptor_aws_region,
             raw.organisation_buckets,
+            **{
+                name: getattr(raw, name, default)
+                for name, default in OPTIONAL_SETTINGS.items()
+            }
         )
 
 
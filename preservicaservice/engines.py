@@ -0,0 +1,68 @@
+import abc
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+logger = logging.getLogger(__name__)
+
+
+class BaseEngine(abc.ABC):
+    """
+    Runs a batch of records on behalf of a record processor.
+    """
+    NAME = None
+
+    def __init__(self, processor):
+        """
+        :param processor: processor owning the engine, used to turn records
+            into tasks and to report failures
+        :type processor: preservicaservice.processor.RecordProcessor
+        """
+        self.processor = processor
+        self.config = processor.config
+
+    @abc.abstractmethod
+    def process_batch(self, records, on_complete):
+        """ Handle every record, return once all of them are done.
+
+        Must never fail because of a single record.
+
+        :param records: input records
+        :param on_complete: called with each record once it is done, always
+            from the calling thread
+        """
+
+    def shutdown(self):
+        """ Release workers """
+
+
+class ThreadPoolEngine(BaseEngine):
+    """
+    Runs whole records on a bounded pool of threads.
+    """
+    NAME = 'threads'
+
+    def __init__(self, processor):
+        super().__init__(processor)
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.config.record_workers,
+        )
+
+    def process_batch(self, records, on_complete):
+        futures = {
+            self.executor.submit(self.processor.process_record, i, record):
+            record for i, record in enumerate(records)
+        }
+        for future in as_completed(futures):
+            record = futures[future]
+            try:
+                future.result()
+            except Exception:
+                # process_record handles errors, this is a bug in it
+                logger.exception(
+                    'record %s failed unhandled',
+                    getattr(record, 'sequence_number', None),
+                )
+            on_complete(record)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,48 @@
+import base64
+import hashlib
+
+
+class HashingWriter:
+    """
+    Writable stream hashing and counting everything written through it.
+
+    Passes data on to target if given. Has no tell or seek, zipfile writes
+    archives to it as to any unseekable stream.
+    """
+
+    def __init__(self, target=None, algorithms=('md5',)):
+        """
+        :param target: file object to write to, None to only hash
+        :param algorithms: hashlib names
+        :type algorithms: tuple of str
+        """
+        self.target = target
+        self.hashes = {name: hashlib.new(name) for name in algorithms}
+        self.size = 0
+
+    def write(self, data):
+        for h in self.hashes.values():
+            h.update(data)
+        self.size += len(data)
+        if self.target is not None:
+            self.target.write(data)
+        return len(data)
+
+    def flush(self):
+        if self.target is not None:
+            self.target.flush()
+
+    def digest(self, algorithm='md5'):
+        """
+        :param str algorithm: hashlib name
+        :rtype: bytes
+        """
+        return self.hashes[algorithm].digest()
+
+    @property
+    def md5_checksum(self):
+        """ Base64 MD5 of everything written, as S3 ContentMD5
+
+        :rtype: str
+        """
+        return base64.b64encode(self.digest('md5')).decode('utf-8')
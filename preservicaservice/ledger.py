@@ -0,0 +1,95 @@
+import datetime
+import logging
+import os
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class IngestLedger:
+    """
+    Local record of bundles already uploaded.
+
+    Lets replayed records be acknowledged without downloading, zipping or
+    listing the destination bucket again.
+    """
+
+    def __init__(self, path):
+        """
+        :param str path: sqlite database file, created if missing
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS ingested ('
+                ' message_id TEXT NOT NULL,'
+                ' bundle_name TEXT NOT NULL,'
+                ' ingested_at TEXT NOT NULL,'
+                ' PRIMARY KEY (message_id, bundle_name)'
+                ')',
+            )
+
+    def contains(self, message_id, bundle_name):
+        """ Check if bundle for message was already uploaded
+
+        :param str message_id: environment prefixed message id
+        :param str bundle_name: uploaded object key
+        :rtype: bool
+        """
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT 1 FROM ingested WHERE message_id = ? AND bundle_name = ?',
+                (message_id, bundle_name),
+            ).fetchone()
+        return row is not None
+
+    def record(self, message_id, bundle_name):
+        """ Store bundle for message as uploaded
+
+        :param str message_id: environment prefixed message id
+        :param str bundle_name: uploaded object key
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO ingested VALUES (?, ?, ?)',
+                (
+                    message_id,
+                    bundle_name,
+                    datetime.datetime.now().isoformat(),
+                ),
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class NullLedger:
+    """ Ledger which remembers nothing, used when none configured """
+
+    def contains(self, message_id, bundle_name):
+        return False
+
+    def record(self, message_id, bundle_name):
+        pass
+
+    def close(self):
+        pass
+
+
+def open_ledger(path):
+    """ Open ledger at given path or a null one if path is empty
+
+    :param str path: sqlite database file or None
+    :rtype: IngestLedger or NullLedger
+    """
+    if not path:
+        return NullLedger()
+    logger.info('using ingest ledger %s', path)
+    return IngestLedger(path)
@@ -0,0 +1,106 @@
+import json
+import os
+import shutil
+import tempfile
+
+from .hashing import HashingWriter
+
+
+class LocalObjects:
+    def __init__(self, bucket):
+        self.bucket = bucket
+
+    def filter(self, Prefix=''):
+        """ Keys starting with given prefix
+
+        :param str Prefix: key prefix
+        :rtype: list of str
+        """
+        if not os.path.isdir(self.bucket.path):
+            return []
+        return [
+            name for name in sorted(os.listdir(self.bucket.path))
+            if name.startswith(Prefix)
+        ]
+
+
+class LocalUpload(HashingWriter):
+    """
+    Writable stream to a LocalBucket object, as multipart.StreamingUpload.
+
+    Written to a hidden file, moved to its key when published.
+    """
+
+    def __init__(self, bucket, key):
+        """
+        :param LocalBucket bucket: destination bucket
+        :param str key: key the upload is published to
+        """
+        os.makedirs(bucket.path, exist_ok=True)
+        fd, self.tmp_path = tempfile.mkstemp(dir=bucket.path, prefix='.upload-')
+        self.file = os.fdopen(fd, 'wb')
+        super().__init__(self.file)
+        self.bucket = bucket
+        self.key = key
+
+    def publish(self, metadata):
+        """ Move object to its key and write its metadata
+
+        :param dict metadata: object metadata
+        """
+        self.file.close()
+        path = self.bucket.object_path(self.key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(self.tmp_path, path)
+        self.bucket.write_metadata(self.key, metadata)
+
+    def abort(self):
+        self.file.close()
+        if os.path.exists(self.tmp_path):
+            os.unlink(self.tmp_path)
+
+
+class LocalBucket:
+    """
+    Local directory standing in for a destination S3 bucket.
+
+    Used for dry runs, objects are written as files and their metadata
+    next to them as json.
+    """
+    METADATA_SUFFIX = '.metadata.json'
+
+    def __init__(self, path):
+        """
+        :param str path: directory objects are written to
+        """
+        self.path = path
+        self.name = path
+        self.objects = LocalObjects(self)
+
+    def object_path(self, key):
+        return os.path.join(self.path, key)
+
+    def put_object(self, Body, Key, Metadata=None, **kwargs):
+        """ Write object and its metadata
+
+        :param Body: file object to copy
+        :param str Key: object key
+        :param dict Metadata: object metadata
+        """
+        path = self.object_path(Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            shutil.copyfileobj(Body, f)
+        self.write_metadata(Key, Metadata)
+
+    def write_metadata(self, key, metadata):
+        with open(self.object_path(key) + self.METADATA_SUFFIX, 'w') as f:
+            json.dump(metadata or {}, f, indent=2, sort_keys=True)
+
+    def open_upload(self, key, **kwargs):
+        """ Writable stream to object
+
+        :param str key: object key
+        :rtype: LocalUpload
+        """
+        return LocalUpload(self, key)
@@ -19,13 +19,12 @@ ATTRIB = {
 CONTAINER_ELEMENT = '{http://www.openarchives.org/OAI/2.0/oai_dc/}dc'
 
 
-def write_object_meta(file_path, data):
+def object_meta(data):
     """ Generate meta xml from inputs
 
-    :param str file_path: path to write
     :param data: contents
     :type data: Generator of (str, str)
-    :return:
+    :rtype: bytes
     """
 
     root = etree.Element(CONTAINER_ELEMENT, nsmap=NSMAP, attrib=ATTRIB)
@@ -35,21 +34,40 @@ def write_object_meta(file_path, data):
         elem.text = value
         root.append(elem)
 
-    contents = etree.tostring(root, pretty_print=True).decode('utf-8')
-    with open(file_path, 'w') as f:
-        f.write(contents)
+    return etree.tostring(root, pretty_print=True)
 
 
-def write_message_meta(file_path, data):
-    """ Generate root meta data file
+def write_object_meta(file_path, data):
+    """ Generate meta xml file from inputs
 
     :param str file_path: path to write
-    :param dict data: contents to generate xml
+    :param data: contents
+    :type data: Generator of (str, str)
     :return:
     """
+    with open(file_path, 'wb') as f:
+        f.write(object_meta(data))
+
+
+def message_meta(data):
+    """ Generate root meta data xml
+
+    :param dict data: contents to generate xml
+    :rtype: bytes
+    """
     contents = dicttoxml(data).decode('utf-8')
     contents = contents.replace(
         '<root>', '<root xmlns="http://jisc.ac.uk/#rdss/schema">',
     )
-    with open(file_path, 'w') as f:
-        f.write(contents)
+    return contents.encode('utf-8')
+
+
+def write_message_meta(file_path, data):
+    """ Generate root meta data file
+
+    :param str file_path: path to write
+    :param dict data: contents to generate xml
+    :return:
+    """
+    with open(file_path, 'wb') as f:
+        f.write(message_meta(data))
@@ -0,0 +1,434 @@
+import bisect
+import collections
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# seconds, from in process work up to large transfers
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1, 2.5, 5, 10, 30, 60, 120, 300, 600,
+)
+# CloudWatch takes at most 100 values of a metric per EMF line
+EMF_MAX_VALUES = 100
+# label value when it could not be determined
+UNKNOWN = 'unknown'
+
+
+class Histogram:
+    """ Observations of one metric with one set of labels """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, keep_values=False):
+        """
+        :param buckets: upper bounds of buckets, ascending
+        :type buckets: tuple of float
+        :param bool keep_values: keep raw values until drained
+        """
+        self.buckets = buckets
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.keep_values = keep_values
+        self.values = []
+
+    def observe(self, value):
+        self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.keep_values:
+            self.values.append(value)
+
+    def drain(self):
+        """ Raw values observed since last drain
+
+        :rtype: list of float
+        """
+        values, self.values = self.values, []
+        return values
+
+
+class Counter:
+    """ Running total of one metric with one set of labels """
+
+    def __init__(self):
+        self.total = 0
+        self.flushed = 0
+
+    def increment(self, value):
+        self.total += value
+
+    def drain(self):
+        """ Amount added since last drain
+
+        :rtype: int
+        """
+        delta = self.total - self.flushed
+        self.flushed = self.total
+        return delta
+
+
+class Gauge:
+    """ Latest value of one metric with one set of labels """
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+
+class Timer:
+    """
+    Context manager observing seconds spent in its block.
+
+    Labels may be added inside the block, when they are only known once
+    the work is done.
+    """
+
+    def __init__(self, registry, name, labels):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.registry.observe(
+            self.name, time.monotonic() - self.started, **self.labels
+        )
+
+
+class NullSink:
+    """ Drops metrics, nothing is collected """
+    KEEP_VALUES = False
+
+    def write(self, histograms, counters, gauges=()):
+        pass
+
+
+class EmfSink:
+    """
+    Writes CloudWatch Embedded Metric Format lines.
+
+    One JSON line per metric and set of labels, labels become dimensions.
+    Lines go to given file, or to the log when no file is given. Never to
+    stdout, which is the KCL protocol channel.
+    """
+    KEEP_VALUES = True
+
+    def __init__(self, namespace, path=None):
+        """
+        :param str namespace: CloudWatch namespace
+        :param str path: file to append lines to, None to log them
+        """
+        self.namespace = namespace
+        self.path = path
+
+    def write(self, histograms, counters, gauges=()):
+        timestamp = int(time.time() * 1000)
+        lines = []
+        for (name, labels), histogram in histograms:
+            values = histogram.drain()
+            for i in range(0, len(values), EMF_MAX_VALUES):
+                lines.append(self.line(
+                    timestamp, name, labels, values[i:i + EMF_MAX_VALUES],
+                ))
+        for (name, labels), counter in counters:
+            delta = counter.drain()
+            if delta:
+                lines.append(self.line(timestamp, name, labels, delta))
+        for (name, labels), gauge in gauges:
+            lines.append(self.line(timestamp, name, labels, gauge.value))
+        if not lines:
+            return
+        if self.path:
+            with open(self.path, 'a') as f:
+                f.write(''.join(line + '\n' for line in lines))
+        else:
+            for line in lines:
+                logger.info(line)
+
+    def line(self, timestamp, name, labels, value):
+        document = dict(labels)
+        document['_aws'] = {
+            'Timestamp': timestamp,
+            'CloudWatchMetrics': [{
+                'Namespace': self.namespace,
+                'Dimensions': [[key for key, _ in labels]],
+                'Metrics': [{'Name': name, 'Unit': unit_of(name)}],
+            }],
+        }
+        document[name] = value
+        return json.dumps(document, sort_keys=True)
+
+
+class PrometheusSink:
+    """
+    Writes Prometheus text format file, for the node exporter textfile
+    collector.
+
+    KCL runs a process per shard, so each process writes its own file, with
+    its pid in the file name and as a label of every sample. The file is
+    replaced as a whole so it is never read half written.
+    """
+    KEEP_VALUES = False
+
+    def __init__(self, namespace, path):
+        """
+        :param str namespace: prefix of metric names
+        :param str path: file to write, pid is added before its extension
+        """
+        self.prefix = prometheus_name(namespace)
+        self.pid = str(os.getpid())
+        root, ext = os.path.splitext(path)
+        self.path = '{}.{}{}'.format(root, self.pid, ext)
+
+    def write(self, histograms, counters, gauges=()):
+        lines = []
+        typed = set()
+        # samples of a metric have to be together
+        histograms = sorted(histograms, key=lambda item: item[0])
+        counters = sorted(counters, key=lambda item: item[0])
+        gauges = sorted(gauges, key=lambda item: item[0])
+        process = (('pid', self.pid),)
+        for (name, labels), histogram in histograms:
+            labels = labels + process
+            full_name = '{}_{}'.format(self.prefix, name)
+            if full_name not in typed:
+                typed.add(full_name)
+                lines.append('# TYPE {} histogram'.format(full_name))
+            cumulative = 0
+            bounds = [repr(float(b)) for b in histogram.buckets] + ['+Inf']
+            for bound, count in zip(bounds, histogram.bucket_counts):
+                cumulative += count
+                lines.append('{}_bucket{} {}'.format(
+                    full_name,
+                    format_labels(labels + (('le', bound),)),
+                    cumulative,
+                ))
+            lines.append('{}_sum{} {!r}'.format(
+                full_name, format_labels(labels), histogram.sum,
+            ))
+            lines.append('{}_count{} {}'.format(
+                full_name, format_labels(labels), histogram.count,
+            ))
+        for (name, labels), counter in counters:
+            labels = labels + process
+            full_name = '{}_{}_total'.format(self.prefix, name)
+            if full_name not in typed:
+                typed.add(full_name)
+                lines.append('# TYPE {} counter'.format(full_name))
+            lines.append('{}{} {}'.format(
+                full_name, format_labels(labels), counter.total,
+            ))
+        for (name, labels), gauge in gauges:
+            labels = labels + process
+            full_name = '{}_{}'.format(self.prefix, name)
+            if full_name not in typed:
+                typed.add(full_name)
+                lines.append('# TYPE {} gauge'.format(full_name))
+            lines.append('{}{} {!r}'.format(
+                full_name, format_labels(labels), gauge.value,
+            ))
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(''.join(line + '\n' for line in lines))
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, self.path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+
+def unit_of(name):
+    if name.endswith('_seconds'):
+        return 'Seconds'
+    if name.endswith('_bytes'):
+        return 'Bytes'
+    return 'Count'
+
+
+def prometheus_name(value):
+    return ''.join(c if c.isalnum() else '_' for c in value).lower()
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{{{}}}'.format(','.join(
+        '{}="{}"'.format(
+            key,
+            str(value).replace('\\', '\\\\').replace('"', '\\"'),
+        ) for key, value in labels
+    ))
+
+
+class Registry:
+    """
+    Histograms, counters and gauges of the process, written to a sink.
+
+    With NullSink nothing is recorded.
+    """
+
+    def __init__(self, sink=None, flush_seconds=60):
+        """
+        :param sink: where metrics are written
+        :param int flush_seconds: min seconds between writes of maybe_flush
+        """
+        self.sink = sink or NullSink()
+        self.enabled = not isinstance(self.sink, NullSink)
+        self.flush_seconds = flush_seconds
+        self.last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        self.histograms = collections.OrderedDict()
+        self.counters = collections.OrderedDict()
+        self.gauges = collections.OrderedDict()
+
+    @staticmethod
+    def key(name, labels):
+        return name, tuple(sorted(
+            (key, UNKNOWN if value is None else str(value))
+            for key, value in labels.items()
+        ))
+
+    def observe(self, name, value, **labels):
+        """ Add value to histogram
+
+        :param str name: metric name, unit as suffix (_seconds, _bytes)
+        :param float value: observed value
+        """
+        if not self.enabled:
+            return
+        key = self.key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(
+                    keep_values=self.sink.KEEP_VALUES,
+                )
+            histogram.observe(value)
+
+    def increment(self, name, value=1, **labels):
+        """ Add value to counter
+
+        :param str name: metric name, unit as suffix (_bytes)
+        :param int value: amount to add
+        """
+        if not self.enabled:
+            return
+        key = self.key(name, labels)
+        with self._lock:
+            counter = self.counters.get(key)
+            if counter is None:
+                counter = self.counters[key] = Counter()
+            counter.increment(value)
+
+    def gauge(self, name, value, **labels):
+        """ Set current value of gauge
+
+        :param str name: metric name, unit as suffix (_bytes)
+        :param value: current value
+        """
+        if not self.enabled:
+            return
+        key = self.key(name, labels)
+        with self._lock:
+            gauge = self.gauges.get(key)
+            if gauge is None:
+                gauge = self.gauges[key] = Gauge()
+            gauge.set(value)
+
+    def timer(self, name, **labels):
+        """ Observe seconds spent in with block
+
+        :param str name: metric name, ending in _seconds
+        :rtype: Timer
+        """
+        return Timer(self, name, labels)
+
+    def maybe_flush(self):
+        """ Write metrics if flush_seconds passed since last write """
+        if time.monotonic() - self.last_flush >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        """ Write metrics to sink, failures are logged """
+        self.last_flush = time.monotonic()
+        if not self.enabled:
+            return
+        with self._lock:
+            try:
+                self.sink.write(
+                    list(self.histograms.items()),
+                    list(self.counters.items()),
+                    list(self.gauges.items()),
+                )
+            except Exception:
+                logger.exception('failed to write metrics')
+
+
+def build_sink(name, namespace, path=None):
+    """ Sink by config name
+
+    :param str name: null, emf or prometheus
+    :param str namespace: CloudWatch namespace or Prometheus prefix
+    :param str path: file to write, required by prometheus
+    """
+    if name == 'emf':
+        return EmfSink(namespace, path)
+    if name == 'prometheus':
+        return PrometheusSink(namespace, path)
+    return NullSink()
+
+
+_registry = Registry()
+
+
+def configure(sink, flush_seconds=60):
+    """ Replace process registry, metrics so far are dropped
+
+    :param sink: where metrics are written
+    :param int flush_seconds: min seconds between writes of maybe_flush
+    """
+    global _registry
+    _registry = Registry(sink, flush_seconds)
+    return _registry
+
+
+def get_registry():
+    return _registry
+
+
+def observe(name, value, **labels):
+    _registry.observe(name, value, **labels)
+
+
+def increment(name, value=1, **labels):
+    _registry.increment(name, value, **labels)
+
+
+def gauge(name, value, **labels):
+    _registry.gauge(name, value, **labels)
+
+
+def timer(name, **labels):
+    return _registry.timer(name, **labels)
+
+
+def maybe_flush():
+    _registry.maybe_flush()
+
+
+def flush():
+    _registry.flush()
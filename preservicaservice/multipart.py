@@ -0,0 +1,182 @@
+import base64
+import hashlib
+import io
+import logging
+
+from . import metrics
+from .errors import UnderlyingSystemError
+from .hashing import HashingWriter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PART_SIZE = 16 * 1024 * 1024
+# part size doubles every PART_SIZE_STEP parts, so S3's part count limit
+# allows bundles up to S3's object size limit
+PART_SIZE_STEP = 1000
+MAX_PARTS = 10000
+# largest S3 object
+MAX_OBJECT_BYTES = 5 * 1024 ** 4
+# where bundles are assembled before they are copied to their key
+STAGING_PREFIX = 'incomplete/'
+
+
+def content_md5(data):
+    """ Base64 MD5 as expected by S3 ContentMD5
+
+    :param bytes data: data to hash
+    :rtype: str
+    """
+    return base64.b64encode(hashlib.md5(data).digest()).decode('utf-8')
+
+
+class StreamingUpload(HashingWriter):
+    """
+    Writable stream uploading to an S3 bucket while it is written.
+
+    Each time a part fills up it is sent as a multipart upload part to a
+    staging key. Publishing completes the upload and copies it, server side,
+    to its key with its metadata, which S3 only takes when an upload starts.
+    Uploads fitting one part are put straight to their key. Besides put
+    and get, staging needs s3:DeleteObject and s3:AbortMultipartUpload on
+    STAGING_PREFIX.
+
+    MD5 and size of everything written are kept on the way. zipfile writes
+    to it as to any unseekable file.
+    """
+
+    def __init__(self, bucket, key, part_size=DEFAULT_PART_SIZE, labels=None):
+        """
+        :param bucket: destination bucket
+        :type bucket: boto3.S3.Bucket
+        :param str key: key the upload is published to
+        :param int part_size: size of first parts, at least 5 MiB
+        :param dict labels: labels of upload metrics
+        """
+        super().__init__()
+        self.bucket = bucket
+        self.client = bucket.meta.client
+        self.key = key
+        self.staging_key = STAGING_PREFIX + key
+        self.part_size = part_size
+        self.labels = labels or {}
+        self.buffer = bytearray()
+        self.upload_id = None
+        self.parts = []
+        self.staged = False
+
+    def write(self, data):
+        super().write(data)
+        self.buffer += data
+        if len(self.buffer) >= self.next_part_size():
+            part, self.buffer = bytes(self.buffer), bytearray()
+            self.upload_part(part)
+        return len(data)
+
+    def next_part_size(self):
+        return self.part_size * 2 ** (len(self.parts) // PART_SIZE_STEP)
+
+    def upload_part(self, data):
+        """ Send data as next part, starting multipart upload if needed
+
+        :param bytes data: part contents
+        :raise: UnderlyingSystemError if out of parts
+        """
+        if len(self.parts) >= MAX_PARTS:
+            raise UnderlyingSystemError(
+                'bundle {} needs more than {} parts'.format(self.key, MAX_PARTS),
+            )
+        if self.upload_id is None:
+            self.upload_id = self.client.create_multipart_upload(
+                Bucket=self.bucket.name,
+                Key=self.staging_key,
+                Metadata={'status': 'uploading'},
+            )['UploadId']
+
+        number = len(self.parts) + 1
+        with metrics.timer('upload_part_seconds', **self.labels):
+            response = self.client.upload_part(
+                Bucket=self.bucket.name,
+                Key=self.staging_key,
+                UploadId=self.upload_id,
+                PartNumber=number,
+                Body=data,
+                ContentMD5=content_md5(data),
+            )
+        self.parts.append({'ETag': response['ETag'], 'PartNumber': number})
+        metrics.increment('upload_bytes', len(data), **self.labels)
+
+    def publish(self, metadata):
+        """ Finish upload, making it visible at its key with given metadata
+
+        :param dict metadata: metadata to set on s3 object
+        """
+        data, self.buffer = bytes(self.buffer), bytearray()
+        if self.upload_id is None:
+            with metrics.timer('put_object_seconds', **self.labels):
+                self.bucket.put_object(
+                    Body=io.BytesIO(data),
+                    Key=self.key,
+                    ContentMD5=self.md5_checksum,
+                    Metadata=metadata,
+                )
+            metrics.increment('upload_bytes', len(data), **self.labels)
+            return
+
+        if data:
+            self.upload_part(data)
+        with metrics.timer('publish_seconds', **self.labels):
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket.name,
+                Key=self.staging_key,
+                UploadId=self.upload_id,
+                MultipartUpload={'Parts': self.parts},
+            )
+            self.upload_id = None
+            self.staged = True
+            self.bucket.copy(
+                {'Bucket': self.bucket.name, 'Key': self.staging_key},
+                self.key,
+                ExtraArgs={
+                    'Metadata': metadata,
+                    'MetadataDirective': 'REPLACE',
+                },
+            )
+        self.remove_staged()
+
+    def remove_staged(self):
+        """ Delete staged copy of a published upload, never fails
+
+        The bundle is already at its key, so a copy left behind is only
+        logged.
+        """
+        try:
+            self.client.delete_object(
+                Bucket=self.bucket.name, Key=self.staging_key,
+            )
+        except Exception:
+            logger.warning(
+                'failed to remove %s staged for %s',
+                self.staging_key, self.key, exc_info=True,
+            )
+        self.staged = False
+
+    def abort(self):
+        """ Drop whatever was uploaded, never fails """
+        try:
+            if self.upload_id is not None:
+                self.client.abort_multipart_upload(
+                    Bucket=self.bucket.name,
+                    Key=self.staging_key,
+                    UploadId=self.upload_id,
+                )
+                self.upload_id = None
+            if self.staged:
+                self.client.delete_object(
+                    Bucket=self.bucket.name, Key=self.staging_key,
+                )
+                self.staged = False
+        except Exception:
+            logger.warning(
+                'failed to abort upload of %s staged at %s',
+                self.key, self.staging_key, exc_info=True,
+            )
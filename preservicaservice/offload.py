@@ -0,0 +1,173 @@
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import zipfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+from .pdeflate import DISABLED, ParallelDeflater
+from .ziputil import (
+    DeflatedMemberWriter, store_file, write_raw_member, zipinfo_for_file,
+)
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def deflate_file(src_path, dst_path, level, chunk_size=CHUNK_SIZE):
+    """ Write raw deflate stream of given file as used in zip archives
+
+    :param str src_path: file to compress
+    :param str dst_path: where to write compressed data
+    :param int level: zlib compression level
+    :return: crc, compressed size, uncompressed size
+    :rtype: tuple of (int, int, int)
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    crc = 0
+    file_size = 0
+    compress_size = 0
+    with open(src_path, 'rb') as src, open(dst_path, 'wb') as dst:
+        for chunk in iter(lambda: src.read(chunk_size), b''):
+            crc = zlib.crc32(chunk, crc)
+            file_size += len(chunk)
+            data = compressor.compress(chunk)
+            compress_size += len(data)
+            dst.write(data)
+        data = compressor.flush()
+        compress_size += len(data)
+        dst.write(data)
+    return crc, compress_size, file_size
+
+
+class OffloadBackend:
+    """
+    Runs deflate of large files in worker processes, so it doesn't
+    compete for the GIL with the rest of the worker.
+
+    Files below min_bytes are handled inline, IPC costs more than it saves.
+    Files the parallel deflater takes are deflated in blocks on threads.
+    """
+
+    def __init__(self, workers=0, min_bytes=0, parallel=DISABLED):
+        """
+        :param int workers: worker processes, 0 to handle everything inline
+        :param int min_bytes: smallest file sent to workers
+        :param ParallelDeflater parallel: deflates largest files in blocks
+        """
+        self.workers = workers
+        self.min_bytes = min_bytes
+        self.parallel = parallel
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def should_offload(self, path):
+        """ Check if file is worth sending to a worker process
+
+        :param str path: local file
+        :rtype: bool
+        """
+        return self.workers > 0 and os.path.getsize(path) >= self.min_bytes
+
+    def takes(self, size):
+        """ Check if a file of given size is deflated off the calling thread
+
+        Such files are only deflated in blocks or by a worker once on disk,
+        streaming them into an archive deflates them inline.
+
+        :param int size: file size in bytes
+        :rtype: bool
+        """
+        return (
+            self.parallel.takes(size) or
+            self.workers > 0 and size >= self.min_bytes
+        )
+
+    def write(
+        self, zip_file, path, arcname, compress_type=zipfile.ZIP_DEFLATED,
+        level=zlib.Z_DEFAULT_COMPRESSION,
+    ):
+        """ Add file to archive, compressing in a worker if large
+
+        :param zipfile.ZipFile zip_file: archive open for writing
+        :param str path: file to add
+        :param str arcname: name inside archive
+        :param int compress_type: ZIP_DEFLATED or ZIP_STORED
+        :param int level: zlib compression level of deflated members
+        """
+        if compress_type == zipfile.ZIP_STORED:
+            store_file(zip_file, path, arcname)
+            return
+
+        zinfo = zipinfo_for_file(path, arcname, zipfile.ZIP_DEFLATED)
+        if self.parallel.should_deflate(path):
+            deflate = self.parallel.deflate_file
+        elif self.should_offload(path):
+            def deflate(*args):
+                return self.executor.submit(deflate_file, *args).result()
+        else:
+            with open(path, 'rb') as src, DeflatedMemberWriter(
+                zip_file, zinfo, level,
+            ) as dst:
+                shutil.copyfileobj(src, dst, CHUNK_SIZE)
+            return
+
+        # next to the file, in the scratch area of its record
+        fd, raw_path = tempfile.mkstemp(dir=os.path.dirname(path) or None)
+        os.close(fd)
+        try:
+            crc, compress_size, file_size = deflate(path, raw_path, level)
+            zinfo.CRC = crc
+            zinfo.compress_size = compress_size
+            zinfo.file_size = file_size
+            with open(raw_path, 'rb') as raw:
+                write_raw_member(zip_file, zinfo, raw)
+        finally:
+            os.unlink(raw_path)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+        self.parallel.shutdown()
+
+
+INLINE = OffloadBackend()
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend(
+    workers, min_bytes, parallel_threads=0, parallel_min_bytes=0,
+):
+    """ Shared backend for given settings, one process pool per settings
+
+    :param int workers: worker processes, 0 to handle everything inline
+    :param int min_bytes: smallest file sent to workers
+    :param int parallel_threads: threads deflating a file in blocks, 0 or
+        1 to disable
+    :param int parallel_min_bytes: smallest file deflated in blocks
+    :rtype: OffloadBackend
+    """
+    if not workers and parallel_threads < 2:
+        return INLINE
+    with _backends_lock:
+        key = (workers, min_bytes, parallel_threads, parallel_min_bytes)
+        if key not in _backends:
+            _backends[key] = OffloadBackend(
+                workers, min_bytes,
+                ParallelDeflater(parallel_threads, parallel_min_bytes),
+            )
+        return _backends[key]
@@ -0,0 +1,136 @@
+import collections
+import concurrent.futures
+import os
+import threading
+import zlib
+
+from .ziputil import crc32_combine
+
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+# deflate window, blocks are primed with this much of the data before them
+DICTIONARY_SIZE = 32 * 1024
+
+
+def deflate_block(block, dictionary, level, last):
+    """ Raw deflate of one block, as pigz does
+
+    Blocks but the last end with a sync flush, on a byte boundary and
+    without the final bit, so their output joins into one deflate stream.
+
+    :param bytes block: data to compress
+    :param bytes dictionary: data preceding block, empty for first block
+    :param int level: zlib compression level
+    :param bool last: block ends the stream
+    :return: compressed data and CRC-32 of block
+    :rtype: tuple of (bytes, int)
+    """
+    if dictionary:
+        compressor = zlib.compressobj(
+            level, zlib.DEFLATED, -15, zdict=dictionary,
+        )
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    data = compressor.compress(block) + compressor.flush(
+        zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH,
+    )
+    return data, zlib.crc32(block)
+
+
+class ParallelDeflater:
+    """
+    Deflates large files in blocks on several cores.
+
+    zlib releases the GIL while compressing, so threads use as many cores
+    as there are threads without copying blocks to other processes. Output
+    is a single deflate stream any zip reader takes.
+    """
+
+    def __init__(self, threads=0, min_bytes=0, block_size=DEFAULT_BLOCK_SIZE):
+        """
+        :param int threads: compressing threads, 0 to disable
+        :param int min_bytes: smallest file deflated in blocks
+        :param int block_size: bytes compressed by one thread at a time
+        """
+        self.threads = threads
+        self.min_bytes = min_bytes
+        self.block_size = block_size
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.threads, thread_name_prefix='deflate',
+                )
+            return self._executor
+
+    def should_deflate(self, path):
+        """ Check if file is worth deflating in blocks
+
+        :param str path: local file
+        :rtype: bool
+        """
+        return self.takes(os.path.getsize(path))
+
+    def takes(self, size):
+        """ Check if a file of given size is deflated in blocks
+
+        :param int size: file size in bytes
+        :rtype: bool
+        """
+        return self.threads > 1 and size >= self.min_bytes
+
+    def deflate_file(self, src_path, dst_path, level):
+        """ Write raw deflate stream of given file as used in zip archives
+
+        :param str src_path: file to compress
+        :param str dst_path: where to write compressed data
+        :param int level: zlib compression level
+        :return: crc, compressed size, uncompressed size
+        :rtype: tuple of (int, int, int)
+        """
+        crc = 0
+        file_size = 0
+        compress_size = 0
+        pending = collections.deque()
+        with open(src_path, 'rb') as src, open(dst_path, 'wb') as dst:
+
+            def write_next():
+                nonlocal crc, file_size, compress_size
+                length, future = pending.popleft()
+                data, block_crc = future.result()
+                dst.write(data)
+                crc = crc32_combine(crc, block_crc, length)
+                file_size += length
+                compress_size += len(data)
+
+            dictionary = b''
+            block = src.read(self.block_size)
+            while True:
+                following = src.read(self.block_size)
+                last = not following
+                pending.append((len(block), self.executor.submit(
+                    deflate_block, block, dictionary, level, last,
+                )))
+                # keep blocks in memory bounded, two per thread
+                while len(pending) >= self.threads * 2:
+                    write_next()
+                if last:
+                    break
+                dictionary = block[-DICTIONARY_SIZE:]
+                block = following
+
+            while pending:
+                write_next()
+        return crc, compress_size, file_size
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+
+DISABLED = ParallelDeflater()
@@ -0,0 +1,241 @@
+import logging
+import queue
+import threading
+
+from .engines import BaseEngine
+from .tasks_parser import decode_record
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class Job:
+    """ Record travelling through the pipeline """
+
+    def __init__(self, index, record):
+        """
+        :param int index: which item in given batch it is
+        :param Record record: source record
+        """
+        self.index = index
+        self.record = record
+        self.value = record
+        self.task = None
+        self.reserved_bytes = 0
+
+
+class Stage:
+    """
+    Pipeline step with its own workers and bounded input queue.
+    """
+
+    def __init__(self, name, func, workers, queue_size):
+        """
+        :param str name: stage name for stats and logs
+        :param func: turns job value into next stage value, returning None
+            finishes the job early
+        :param int workers: number of threads running func
+        :param int queue_size: max jobs waiting for the stage
+        """
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.next_stage = None
+        self.threads = []
+        self._lock = threading.Lock()
+        self.processed = 0
+        self.busy = 0
+        self.max_depth = 0
+
+    def put(self, job):
+        """ Add job, blocks while the stage is full """
+        self.queue.put(job)
+        depth = self.queue.qsize()
+        with self._lock:
+            self.max_depth = max(self.max_depth, depth)
+
+    def stats(self):
+        """ Current queue and worker usage
+
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                'depth': self.queue.qsize(),
+                'max_depth': self.max_depth,
+                'capacity': self.queue.maxsize,
+                'busy': self.busy,
+                'workers': self.workers,
+                'processed': self.processed,
+            }
+
+
+class Pipeline:
+    """
+    Chain of stages joined by bounded queues.
+
+    A full queue blocks the stage in front of it so the slowest stage sets
+    the pace without piling up downloaded data.
+    """
+
+    def __init__(self, stages, on_error, on_finish):
+        """
+        :param stages: stages in execution order
+        :type stages: list of Stage
+        :param on_error: called with (job, exception) when a stage fails
+        :param on_finish: called with job once it leaves the pipeline
+        """
+        self.stages = stages
+        self.on_error = on_error
+        self.on_finish = on_finish
+        for stage, next_stage in zip(stages, stages[1:]):
+            stage.next_stage = next_stage
+
+    def start(self):
+        for stage in self.stages:
+            for i in range(stage.workers):
+                thread = threading.Thread(
+                    target=self._work,
+                    args=(stage,),
+                    name='{}-{}'.format(stage.name, i),
+                    daemon=True,
+                )
+                thread.start()
+                stage.threads.append(thread)
+
+    def submit(self, job):
+        """ Feed job to the first stage, blocks while it is full """
+        self.stages[0].put(job)
+
+    def stop(self):
+        for stage in self.stages:
+            for _ in stage.threads:
+                stage.queue.put(_STOP)
+            for thread in stage.threads:
+                thread.join()
+            stage.threads = []
+
+    def stats(self):
+        """ Stats of every stage by name
+
+        :rtype: dict of (str => dict)
+        """
+        return {stage.name: stage.stats() for stage in self.stages}
+
+    def _work(self, stage):
+        while True:
+            job = stage.queue.get()
+            if job is _STOP:
+                return
+            with stage._lock:
+                stage.busy += 1
+            try:
+                job.value = stage.func(job)
+            except Exception as e:
+                job.value = None
+                try:
+                    self.on_error(job, e)
+                except Exception:
+                    # the job must still finish or its batch never does
+                    logger.exception('failed to report error of job %d', job.index)
+            finally:
+                with stage._lock:
+                    stage.busy -= 1
+                    stage.processed += 1
+
+            if job.value is None or stage.next_stage is None:
+                self.on_finish(job)
+            else:
+                stage.next_stage.put(job)
+
+
+class PipelineEngine(BaseEngine):
+    """
+    Runs records as decode -> build -> download -> bundle -> upload stages.
+
+    Network bound and CPU bound stages have separate workers, so downloads
+    of one message overlap zipping and uploading of others.
+    """
+    NAME = 'pipeline'
+
+    def __init__(self, processor):
+        super().__init__(processor)
+        size = self.config.pipeline_queue_size
+        self.pipeline = Pipeline(
+            [
+                Stage('decode', self.decode, 1, size),
+                Stage('build', self.build, self.config.pipeline_build_workers, size),
+                Stage(
+                    'download', self.download,
+                    self.config.pipeline_download_workers, size,
+                ),
+                Stage('bundle', self.bundle, self.config.pipeline_bundle_workers, size),
+                Stage('upload', self.upload, self.config.pipeline_upload_workers, size),
+            ],
+            self.on_error,
+            self.on_finish,
+        )
+        self.done = queue.Queue()
+        self.pipeline.start()
+
+    def process_batch(self, records, on_complete):
+        jobs = [Job(i, record) for i, record in enumerate(records)]
+        # feed from another thread so completions are reported while
+        # the first stage is full
+        feeder = threading.Thread(
+            target=self._feed,
+            args=(jobs,),
+            daemon=True,
+        )
+        feeder.start()
+        for _ in jobs:
+            on_complete(self.done.get().record)
+        feeder.join()
+        logger.debug('pipeline stats %s', self.pipeline.stats())
+
+    def shutdown(self):
+        self.pipeline.stop()
+
+    def _feed(self, jobs):
+        for job in jobs:
+            self.pipeline.submit(job)
+
+    def decode(self, job):
+        self.processor.scheduler.started(job.record)
+        logger.debug('processing record %d', job.index)
+        return decode_record(job.record)
+
+    def build(self, job):
+        job.task = self.processor.build_task(job.value)
+        return job.task
+
+    def download(self, job):
+        # blocks this stage while scratch space is exhausted
+        nbytes = self.processor.scratch_bytes(job.task)
+        # nothing is reserved, nor released, for tasks without scratch files
+        if nbytes:
+            self.processor.admission.reserve(nbytes)
+            job.reserved_bytes = nbytes
+        job.task.download_files()
+        return job.task
+
+    def bundle(self, job):
+        job.task.build_bundle()
+        return job.task
+
+    def upload(self, job):
+        job.task.upload()
+        self.processor.task_succeeded(job.task)
+        return job.task
+
+    def on_error(self, job, error):
+        self.processor.handle_error(job.record, error)
+
+    def on_finish(self, job):
+        if job.task:
+            job.task.cleanup()
+        if job.reserved_bytes:
+            self.processor.admission.release(job.reserved_bytes)
+        self.done.put(job)
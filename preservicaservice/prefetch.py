@@ -0,0 +1,133 @@
+import collections
+import concurrent.futures
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class Prefetcher:
+    """
+    Downloads files of a message ahead of the bundle writer.
+
+    Threads of one pool fetch files of every message, the pool size bounds
+    downloads of the whole process. Each message keeps at most per_message
+    of its files downloading, and gets them back in declared order.
+    """
+
+    def __init__(self, workers=0, per_message=1):
+        """
+        :param int workers: download threads shared by all messages, 0 to
+            download files one after another in the caller
+        :param int per_message: max files of one message downloading at once
+        """
+        self.workers = workers
+        self.per_message = per_message
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.workers > 0 and self.per_message > 1
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix='prefetch',
+                )
+            return self._executor
+
+    def map(self, func, items):
+        """ Apply func to every item on the pool
+
+        For short calls, such as HEAD requests sizing files.
+
+        :param callable func: called with each item
+        :param list items: arguments
+        :return: results in order of items
+        :rtype: list
+        """
+        if not self.enabled or len(items) < 2:
+            return [func(item) for item in items]
+        return list(self.executor.map(func, items))
+
+    def ordered(self, file_tasks, stream_head=True, in_memory=False):
+        """ Yield file tasks in order, fetching later ones in the background
+
+        Yields each task with whether it was fetched to temporary files, or
+        loaded into memory, the rest are left to the caller. When stream_head is set the first
+        task is yielded at once for the caller to stream while the next
+        ones download. Close the generator when done, files of tasks not
+        yielded yet are removed.
+
+        :param file_tasks: tasks of one message, in bundle order
+        :type file_tasks: list of preservicaservice.tasks.FileTask
+        :param bool stream_head: yield first task unfetched
+        :param bool in_memory: load files into memory instead of temporary
+            files
+        :raise: whatever fetching a yielded task raised
+        """
+        if not self.enabled:
+            for task in file_tasks:
+                yield task, False
+            return
+
+        pending = collections.deque()
+        submitted = 0
+
+        def fill(limit):
+            nonlocal submitted
+            while submitted < len(file_tasks) and len(pending) < limit:
+                task = file_tasks[submitted]
+                fetch = task.load if in_memory else task.fetch
+                pending.append((task, self.executor.submit(fetch)))
+                submitted += 1
+
+        try:
+            if stream_head and file_tasks:
+                submitted = 1
+                # streamed head counts against the message's limit
+                fill(self.per_message - 1)
+                yield file_tasks[0], False
+            fill(self.per_message)
+            while pending:
+                task, future = pending.popleft()
+                try:
+                    future.result()
+                except Exception:
+                    task.cleanup()
+                    raise
+                fill(self.per_message)
+                yield task, True
+        finally:
+            for _, future in pending:
+                future.cancel()
+            for task, future in pending:
+                if not future.cancelled():
+                    # never leave a download writing after its cleanup
+                    concurrent.futures.wait([future])
+                task.cleanup()
+
+
+SERIAL = Prefetcher()
+
+_prefetchers = {}
+_prefetchers_lock = threading.Lock()
+
+
+def get_prefetcher(workers, per_message):
+    """ Shared prefetcher for given settings, one thread pool per settings
+
+    :param int workers: download threads shared by all messages
+    :param int per_message: max files of one message downloading at once
+    :rtype: Prefetcher
+    """
+    if not workers or per_message < 2:
+        return SERIAL
+    with _prefetchers_lock:
+        key = (workers, per_message)
+        if key not in _prefetchers:
+            _prefetchers[key] = Prefetcher(workers, per_message)
+        return _prefetchers[key]
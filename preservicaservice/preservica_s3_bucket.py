@@ -7,6 +7,8 @@ from base64 import b64decode
 from lxml import etree
 from Crypto.Cipher import AES
 
+from . import metrics
+
 logger = logging.getLogger(__name__)
 
 
@@ -84,7 +86,8 @@ class PreservicaS3BucketBuilder(object):
 
     def __init__(self, preservica_url, environment, region):
         self.environment = environment
-        self.ssm_client = boto3.client('ssm', region_name=region)
+        # default session is not thread safe, records run concurrently
+        self.ssm_client = boto3.Session().client('ssm', region_name=region)
 
         decryption_key = self._get_ssm_value(
             self.environment, 'api-decryption-key',
@@ -133,17 +136,18 @@ class PreservicaS3BucketBuilder(object):
             return
 
     def get_bucket(self, jisc_id, bucket_name=None):
-        credentials = self._fetch_preservica_credentials(jisc_id)
-        bucket_details = self.preservica_bucket_api.get_bucket_details(
-            *credentials
-        )
+        with metrics.timer('destination_resolve_seconds', organisation=jisc_id):
+            credentials = self._fetch_preservica_credentials(jisc_id)
+            bucket_details = self.preservica_bucket_api.get_bucket_details(
+                *credentials
+            )
         bucket_name = self._select_adaptor_bucket(
             bucket_details.pop('bucket_names', []),
             jisc_id,
             bucket_name,
         )
         if bucket_name:
-            client = boto3.resource('s3', **bucket_details)
+            client = boto3.Session().resource('s3', **bucket_details)
             return client.Bucket(bucket_name)
         else:
             return None
@@ -1,7 +1,13 @@
 import logging
+import tempfile
 
 from amazon_kclpy import kcl
 
+from . import metrics, scratch
+from .admission import AdmissionController
+from .asyncio_engine import AsyncioEngine
+from .checkpoint import BatchCheckpointer
+from .engines import ThreadPoolEngine
 from .errors import (
     BaseError,
     ExpiredMessageError,
@@ -11,11 +17,24 @@ from .errors import (
     UnsupportedMessageTypeError,
     InvalidChecksumError,
 )
+from .ledger import open_ledger
+from .pipeline import PipelineEngine
+from .profiling import ProfilingHook, RecordProfiler
 from .put_stream import PutStream
-from .tasks_parser import record_to_task
+from .scheduling import RecordScheduler
+from .tasks_parser import decode_record, ledger_key, message_to_task
 
 logger = logging.getLogger(__name__)
 
+ENGINES = {
+    x.NAME: x for x in (ThreadPoolEngine, PipelineEngine, AsyncioEngine)
+}
+
+INVALID_MESSAGE_ERRORS = (
+    MalformedBodyError, UnsupportedMessageTypeError,
+    ExpiredMessageError, MalformedHeaderError, InvalidChecksumError,
+)
+
 
 class RecordProcessor(kcl.RecordProcessorBase):
     """ Records processor which can report failures to specific
@@ -28,35 +47,114 @@ class RecordProcessor(kcl.RecordProcessorBase):
         :type config: preservicaservice.config.Config
         """
         self.config = config
-        self.invalid_stream = PutStream(
-            config.invalid_stream_name,
-            config.adaptor_aws_region,
+        metrics.configure(
+            metrics.build_sink(
+                config.metrics_sink,
+                config.metrics_namespace,
+                config.metrics_path,
+            ),
+            config.metrics_flush_seconds,
+        )
+        self.invalid_stream, self.error_stream = self.open_streams(config)
+        self.ledger = open_ledger(config.ledger_path)
+        self.scratch = scratch.get_space(
+            config.scratch_dirs,
+            config.scratch_small_dir,
+            config.scratch_small_file_bytes,
+        )
+        self.scratch.sweep()
+        self.admission = AdmissionController(
+            config.admission_budget_bytes,
+            self.scratch.roots,
+            config.admission_min_free_bytes,
+        )
+        self.scheduler = RecordScheduler(
+            config.admission_default_file_bytes,
+            config.record_order,
         )
-        self.error_stream = PutStream(
-            config.error_stream_name,
-            config.adaptor_aws_region,
+        self.engine = ENGINES[config.engine](self)
+        self.checkpoints = BatchCheckpointer(
+            config.checkpoint_every_records,
+            config.checkpoint_every_seconds,
+        )
+        profile_dir = config.profile_dir or tempfile.gettempdir()
+        self.profiling = ProfilingHook(
+            profile_dir,
+            config.profile_sentinel_path,
+            config.profile_signal,
+        )
+        self.record_profiler = RecordProfiler(
+            config.profile_record_fraction,
+            config.profile_slow_record_seconds,
+            profile_dir,
+        )
+
+    def open_streams(self, config):
+        """ Streams failed records are reported to
+
+        :param config: job config object
+        :type config: preservicaservice.config.Config
+        :return: invalid stream, error stream
+        :rtype: tuple of (PutStream, PutStream)
+        """
+        return (
+            PutStream(config.invalid_stream_name, config.adaptor_aws_region),
+            PutStream(config.error_stream_name, config.adaptor_aws_region),
         )
 
     def initialize(self, shard_id):
-        pass
+        """ Start listening for profiling requests
+
+        :param str shard_id: shard the worker processes
+        """
+        self.profiling.install()
 
     def process_records(self, records, checkpointer):
         """ Handle list of records
 
+        Records are handled by the configured engine in the configured
+        order, returns once every record in the batch is done. Checkpoints
+        are taken as records complete.
+
         :param records: input records
         :param checkpointer: checkpoint object
         :return:
         """
         logger.debug('received %d records', len(records))
-        for i, record in enumerate(records):
-            self.process_record(i, record)
+        for record in records:
+            self.checkpoints.started(record)
+
+        def on_complete(record):
+            self.scheduler.completed(record)
+            logger.debug('organisation load %s', self.scheduler.stats())
+            self.checkpoints.completed(record)
+            self.checkpoints.maybe_checkpoint(checkpointer)
+
+        scheduled = self.scheduler.schedule(records)
+        self.engine.process_batch(scheduled, on_complete)
+        self.scratch.report()
+        metrics.maybe_flush()
         logger.debug('complete')
 
     def shutdown_requested(self, checkpointer):
-        pass
+        """ Store progress before graceful shutdown
+
+        :param checkpointer: checkpoint object
+        """
+        self.checkpoints.checkpoint_safe(checkpointer)
 
     def shutdown(self, checkpointer, reason):
-        pass
+        """ Stop workers, checkpoint shard end if required
+
+        :param checkpointer: checkpoint object
+        :param str reason: TERMINATE if shard ended, ZOMBIE if lease lost
+        """
+        self.engine.shutdown()
+        self.ledger.close()
+        metrics.flush()
+        self.profiling.close()
+        if 'TERMINATE' == reason:
+            self.checkpoints.checkpoint(checkpointer)
 
     def process_record(self, index, record):
         """ Handle single record.
@@ -66,22 +164,83 @@ class RecordProcessor(kcl.RecordProcessorBase):
         :param int index: which item in given batch it is
         :param Record record: data to handle
         """
+        self.scheduler.started(record)
+        name = getattr(record, 'sequence_number', None) or index
         try:
-            logger.debug('processing record %d', index)
-            task = record_to_task(record, self.config)
-            if task:
-                task.run()
-            else:
-                logger.warning('no task out of message')
-        except (
-            MalformedBodyError, UnsupportedMessageTypeError,
-            ExpiredMessageError, MalformedHeaderError, InvalidChecksumError,
-        ) as e:
-            logger.exception('invalid message')
-            self.invalid_stream.put(e.export(record))
-        except BaseError as e:
-            logger.exception('error handling record')
-            self.error_stream.put(e.export(record))
+            with self.record_profiler.profile(name):
+                logger.debug('processing record %d', index)
+                message = decode_record(record)
+                logger.debug('received message %s', message)
+                task = self.build_task(message)
+                if task:
+                    # streams to the destination, only files downloading
+                    # ahead of the bundle touch scratch disk
+                    with self.admission.admitted(self.run_scratch_bytes(task)):
+                        task.run()
+                    self.task_succeeded(task)
         except Exception as e:
-            logger.exception('unexpected error handling error')
-            self.error_stream.put(UnknownErrorError(str(e)).export(record))
+            self.handle_error(record, e)
+
+    def build_task(self, message):
+        """ Build task for decoded message unless already ingested.
+
+        :param dict message: decoded message
+        :return: task or None if nothing to do
+        :rtype: preservicaservice.tasks.BaseTask
+        """
+        key = ledger_key(message, self.config)
+        if key and self.ledger.contains(*key):
+            logger.info('message %s already ingested as %s, skipping', *key)
+            return None
+        with metrics.timer('task_build_seconds') as timer:
+            task = message_to_task(message, self.config)
+            timer.labels['organisation'] = getattr(task, 'organisation_id', None)
+        if not task:
+            logger.warning('no task out of message')
+        return task
+
+    def scratch_bytes(self, task):
+        """ Bytes to reserve with admission control before running task
+        in stages
+
+        :param preservicaservice.tasks.BaseTask task: task to run
+        :rtype: int
+        """
+        return task.estimate_scratch_bytes(
+            self.config.admission_default_file_bytes,
+        )
+
+    def run_scratch_bytes(self, task):
+        """ Bytes to reserve with admission control before running task
+        whole
+
+        :param preservicaservice.tasks.BaseTask task: task to run
+        :rtype: int
+        """
+        return task.estimate_run_scratch_bytes(
+            self.config.admission_default_file_bytes,
+        )
+
+    def task_succeeded(self, task):
+        """ Remember uploaded bundle so replays can skip it.
+
+        :param preservicaservice.tasks.BaseTask task: completed task
+        """
+        self.ledger.record(task.message_id, task.bundle_name)
+
+    def handle_error(self, record, error):
+        """ Report failure of given record to invalid or error stream.
+
+        :param Record record: failed record
+        :param Exception error: failure reason
+        """
+        metrics.increment('record_errors', error=type(error).__name__)
+        if isinstance(error, INVALID_MESSAGE_ERRORS):
+            logger.error('invalid message', exc_info=error)
+            self.invalid_stream.put(error.export(record))
+        elif isinstance(error, BaseError):
+            logger.error('error handling record', exc_info=error)
+            self.error_stream.put(error.export(record))
+        else:
+            logger.error('unexpected error handling error', exc_info=error)
+            self.error_stream.put(UnknownErrorError(str(error)).export(record))
@@ -0,0 +1,283 @@
+import collections
+import contextlib
+import cProfile
+import io
+import logging
+import os
+import pstats
+import random
+import re
+import signal
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SAMPLE_INTERVAL = 0.01
+DEFAULT_POLL_INTERVAL = 1.0
+DEFAULT_TOP_FUNCTIONS = 30
+
+
+def output_name(prefix, name, suffix):
+    """ File name unique to this process and moment
+
+    :param str prefix: what the file holds
+    :param str name: extra identifier, e.g. record sequence number
+    :param str suffix: file extension
+    :rtype: str
+    """
+    parts = [prefix, time.strftime('%Y%m%d-%H%M%S'), str(os.getpid())]
+    if name is not None:
+        parts.append(re.sub(r'[^A-Za-z0-9_.-]', '_', str(name)))
+    return '{}{}'.format('-'.join(parts), suffix)
+
+
+def describe_frame(frame):
+    code = frame.f_code
+    return '{} ({}:{})'.format(
+        code.co_name, os.path.basename(code.co_filename), code.co_firstlineno,
+    )
+
+
+class StackSampler:
+    """
+    Samples stacks of every thread from a background thread.
+
+    Writes collapsed stacks, one line of root first frames and their sample
+    count, as read by flamegraph.pl and speedscope. Costs one walk of the
+    thread stacks per interval and nothing once stopped.
+    """
+
+    def __init__(self, output_dir, interval=DEFAULT_SAMPLE_INTERVAL):
+        """
+        :param str output_dir: directory stacks file is written to
+        :param float interval: seconds between samples
+        """
+        self.output_dir = output_dir
+        self.interval = interval
+        self.counts = collections.Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        if self.running:
+            return
+        self.counts.clear()
+        self.samples = 0
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name='stack-sampler', daemon=True,
+        )
+        self._thread.start()
+        logger.info('stack sampling started')
+
+    def stop(self):
+        """ Stop sampling and write stacks
+
+        :return: written file, None if not running
+        :rtype: str
+        """
+        if not self.running:
+            return None
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        path = os.path.join(
+            self.output_dir, output_name('stacks', None, '.collapsed'),
+        )
+        self.write(path)
+        logger.info('stack sampling stopped, %d samples in %s', self.samples, path)
+        return path
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            self.sample(own_id)
+
+    def sample(self, skip_thread_id=None):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == skip_thread_id:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(describe_frame(frame))
+                frame = frame.f_back
+            stack.append(names.get(thread_id, str(thread_id)))
+            self.counts[';'.join(reversed(stack))] += 1
+        self.samples += 1
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.counts.most_common():
+                f.write('{} {}\n'.format(stack, count))
+
+
+class ProfilingHook:
+    """
+    Starts and stops a StackSampler of the running worker.
+
+    A signal toggles sampling. While the sentinel file exists sampling is on,
+    removing it stops sampling and writes the stacks file.
+    """
+
+    def __init__(
+        self, output_dir, sentinel_path=None, signal_name=None,
+        poll_interval=DEFAULT_POLL_INTERVAL,
+        sample_interval=DEFAULT_SAMPLE_INTERVAL,
+    ):
+        """
+        :param str output_dir: directory stacks files are written to
+        :param str sentinel_path: file turning sampling on, None to disable
+        :param str signal_name: e.g. SIGUSR2 to toggle sampling, None to
+            disable
+        :param float poll_interval: seconds between sentinel checks
+        :param float sample_interval: seconds between samples
+        """
+        self.sampler = StackSampler(output_dir, sample_interval)
+        self.sentinel_path = sentinel_path
+        self.signal_name = signal_name
+        self.poll_interval = poll_interval
+        self._toggle = threading.Event()
+        self._closed = threading.Event()
+        self._sentinel_seen = False
+        self._thread = None
+
+    def install(self):
+        """ Register signal handler and start watching for requests
+
+        Signals can only be registered from the main thread, elsewhere
+        only the sentinel file works.
+        """
+        if not self.signal_name and not self.sentinel_path:
+            return
+        if self.signal_name:
+            if threading.current_thread() is threading.main_thread():
+                signal.signal(
+                    getattr(signal, self.signal_name), self._on_signal,
+                )
+            else:
+                logger.warning(
+                    'not in main thread, %s does not toggle profiling',
+                    self.signal_name,
+                )
+        self._thread = threading.Thread(
+            target=self._watch, name='profiling-hook', daemon=True,
+        )
+        self._thread.start()
+
+    def _on_signal(self, signum, frame):
+        # sampler is started from the watcher, never inside the handler
+        self._toggle.set()
+
+    def _watch(self):
+        while not self._closed.is_set():
+            self._toggle.wait(self.poll_interval)
+            if self._closed.is_set():
+                break
+            self.poll()
+
+    def poll(self):
+        """ Apply pending signal and sentinel file changes """
+        if self._toggle.is_set():
+            self._toggle.clear()
+            if self.sampler.running:
+                self.sampler.stop()
+            else:
+                self.sampler.start()
+        if self.sentinel_path:
+            exists = os.path.exists(self.sentinel_path)
+            if exists and not self._sentinel_seen:
+                self.sampler.start()
+            elif self._sentinel_seen and not exists:
+                self.sampler.stop()
+            self._sentinel_seen = exists
+
+    def close(self):
+        """ Stop watching, writing stacks if sampling """
+        self._closed.set()
+        self._toggle.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self.sampler.stop()
+
+
+class RecordProfiler:
+    """
+    Runs a sampled fraction of records under cProfile.
+
+    Profiles of records slower than the threshold are kept, as a pstats
+    dump and the top functions by cumulative time.
+    """
+
+    def __init__(
+        self, fraction, slow_seconds, output_dir,
+        top=DEFAULT_TOP_FUNCTIONS, sample=random.random,
+    ):
+        """
+        :param float fraction: share of records profiled, 0 to disable
+        :param int slow_seconds: keep profiles of records at least this slow
+        :param str output_dir: directory profiles are written to
+        :param int top: functions listed in text summary
+        :param callable sample: returns float in [0, 1)
+        """
+        self.fraction = fraction
+        self.slow_seconds = slow_seconds
+        self.output_dir = output_dir
+        self.top = top
+        self.sample = sample
+
+    @contextlib.contextmanager
+    def profile(self, name):
+        """ Profile with block if sampled
+
+        :param name: identifies record in file names
+        """
+        if not self.fraction or self.sample() >= self.fraction:
+            yield
+            return
+
+        profiler = cProfile.Profile()
+        started = time.monotonic()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            elapsed = time.monotonic() - started
+            if elapsed >= self.slow_seconds:
+                try:
+                    self.dump(profiler, name, elapsed)
+                except Exception:
+                    logger.exception('failed to write profile of %s', name)
+
+    def dump(self, profiler, name, elapsed):
+        """ Write profile and its top functions
+
+        :param cProfile.Profile profiler: finished profile
+        :param name: identifies record in file names
+        :param float elapsed: seconds record took
+        :return: text summary file
+        :rtype: str
+        """
+        base = os.path.join(self.output_dir, output_name('record', name, ''))
+        profiler.dump_stats(base + '.prof')
+
+        summary = io.StringIO()
+        stats = pstats.Stats(profiler, stream=summary)
+        stats.sort_stats('cumulative').print_stats(self.top)
+        with open(base + '.txt', 'w') as f:
+            f.write('record {} took {:.3f}s\n'.format(name, elapsed))
+            f.write(summary.getvalue())
+
+        logger.warning(
+            'record %s took %.1fs, profile in %s.txt', name, elapsed, base,
+        )
+        return base + '.txt'
@@ -4,6 +4,7 @@ import time
 
 import boto3
 
+from . import metrics
 from .errors import (
     MaxConnectionTriesError,
     MaxMessageSendTriesError,
@@ -98,7 +99,8 @@ class PutStream:
         :param string partition_key: partition to use
         """
         try:
-            self.put_or_fail(data, partition_key)
+            with metrics.timer('stream_put_seconds', stream=self.stream_name):
+                self.put_or_fail(data, partition_key)
         except Exception:
             logger.exception('failed to write data to stream, continue')
 
@@ -1,15 +1,26 @@
 import abc
+import asyncio
+import contextlib
 from urllib.parse import urlparse
 
 import boto3
 import botocore.exceptions
 import requests
 
+try:
+    import aiohttp
+except ImportError:  # optional, only required by the asyncio engine
+    aiohttp = None
+
 from .errors import UnderlyingSystemError, ResourceNotFoundError
 
+ASYNC_CHUNK_SIZE = 64 * 1024
+
 
 class BaseRemoteUrl(abc.ABC):
     """ Wrapper for remote files."""
+    # storage platform label of metrics
+    PLATFORM = None
 
     def __init__(self, url, file_name=None):
         self.url = url
@@ -45,16 +56,52 @@ class BaseRemoteUrl(abc.ABC):
         """
 
     @abc.abstractmethod
-    def download(self, download_path):
-        """ Download remote file to provided path.
-        :param download_path: path on local filesystem to download file to.
-        :type download_path: string
+    def download(self, target):
+        """ Download remote file to provided file object.
+
+        Data is written in order, target need not be seekable.
+
+        :param target: writable file object
         :raise: ResourceNotFoundError if any error
         """
 
+    @abc.abstractmethod
+    def open_stream(self):
+        """ Open remote file for reading without storing it locally.
+
+        Use as context manager, the reader is closed on exit.
+
+        :return: file like object with read(size)
+        :raise: ResourceNotFoundError if missing
+        :raise: UnderlyingSystemError if any other error
+        """
+
+    @abc.abstractmethod
+    def get_size(self):
+        """ Size of remote file without downloading it.
+
+        :return: size in bytes or None if remote does not tell
+        :rtype: int
+        :raise: ResourceNotFoundError if missing
+        """
+
+    async def download_async(self, target, http_session=None):
+        """ Coroutine downloading remote file to provided file object.
+
+        Runs blocking download in the loop executor unless overridden.
+
+        :param target: writable file object
+        :param http_session: shared session for HTTP transfers
+        :type http_session: aiohttp.ClientSession
+        :raise: ResourceNotFoundError if any error
+        """
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, self.download, target)
+
 
 class S3RemoteUrl(BaseRemoteUrl):
     """ Wrapper for remote S3 files."""
+    PLATFORM = 's3'
 
     @classmethod
     def parse(cls, url, file_name=None):
@@ -75,25 +122,50 @@ class S3RemoteUrl(BaseRemoteUrl):
         s3 = session.resource('s3')
         return s3.Bucket(bucket_name)
 
-    def download(self, download_path):
-        """ Download remote file from S3 to the provided download path."""
+    def _raise_client_error(self, e):
+        error_code = int(e.response['ResponseMetadata']['HTTPStatusCode'])
+        if error_code == 404:
+            raise ResourceNotFoundError(
+                'resource not found in S3: {}'.format(e),
+            )
+        else:
+            raise UnderlyingSystemError(
+                'unable to download resource from S3: {}'.format(e),
+            )
+
+    def download(self, target):
+        """ Download remote file from S3 to the provided file object."""
         bucket = self._get_bucket(self.host)
         try:
-            bucket.download_file(self.path, download_path)
+            bucket.download_fileobj(self.path, target)
         except botocore.exceptions.ClientError as e:
-            error_code = int(e.response['ResponseMetadata']['HTTPStatusCode'])
-            if error_code == 404:
-                raise ResourceNotFoundError(
-                    'resource not found in S3: {}'.format(e),
-                )
-            else:
-                raise UnderlyingSystemError(
-                    'unable to download resource from S3: {}'.format(e),
-                )
+            self._raise_client_error(e)
+
+    @contextlib.contextmanager
+    def open_stream(self):
+        """ Stream S3 object body."""
+        bucket = self._get_bucket(self.host)
+        try:
+            body = bucket.Object(self.path).get()['Body']
+        except botocore.exceptions.ClientError as e:
+            self._raise_client_error(e)
+        try:
+            yield body
+        finally:
+            body.close()
+
+    def get_size(self):
+        """ Size of S3 object from its metadata."""
+        bucket = self._get_bucket(self.host)
+        try:
+            return bucket.Object(self.path).content_length
+        except botocore.exceptions.ClientError as e:
+            self._raise_client_error(e)
 
 
 class HTTPRemoteUrl(BaseRemoteUrl):
     """ Wrapper for remote HTTP files."""
+    PLATFORM = 'http'
 
     @classmethod
     def parse(cls, url, file_name=None):
@@ -107,15 +179,80 @@ class HTTPRemoteUrl(BaseRemoteUrl):
             raise ValueError('Invalid HTTP URL {}'.format(url))
         return cls(url, file_name)
 
-    def download(self, download_path):
-        """ Download remote file via HTTP to the provided download path."""
+    def download(self, target):
+        """ Download remote file via HTTP to the provided file object."""
         try:
             r = requests.get(self.url, stream=True)
-            with open(download_path, 'wb') as f:
-                for chunk in r.iter_content(chunk_size=1024):
-                    if chunk:
-                        f.write(chunk)
+            if r.status_code == 404:
+                raise ResourceNotFoundError(
+                    'resource not found via HTTP: {}'.format(self.url),
+                )
+            r.raise_for_status()
+            for chunk in r.iter_content(chunk_size=1024):
+                if chunk:
+                    target.write(chunk)
         except requests.RequestException as re:
             raise UnderlyingSystemError(
                 'unable to download resource via HTTP: {}'.format(re),
             )
+
+    @contextlib.contextmanager
+    def open_stream(self):
+        """ Stream response body, decoded as download does."""
+        try:
+            r = requests.get(self.url, stream=True)
+            if r.status_code == 404:
+                raise ResourceNotFoundError(
+                    'resource not found via HTTP: {}'.format(self.url),
+                )
+            r.raise_for_status()
+        except requests.RequestException as re:
+            raise UnderlyingSystemError(
+                'unable to download resource via HTTP: {}'.format(re),
+            )
+        try:
+            r.raw.decode_content = True
+            yield r.raw
+        finally:
+            r.close()
+
+    def get_size(self):
+        """ Size of remote file from HEAD response Content-Length."""
+        try:
+            r = requests.head(self.url, allow_redirects=True)
+        except requests.RequestException as re:
+            raise UnderlyingSystemError(
+                'unable to get resource size via HTTP: {}'.format(re),
+            )
+        if r.status_code == 404:
+            raise ResourceNotFoundError(
+                'resource not found via HTTP: {}'.format(self.url),
+            )
+        if not r.ok:
+            raise UnderlyingSystemError(
+                'unable to get resource size via HTTP: {} {}'.format(
+                    r.status_code, r.reason,
+                ),
+            )
+        length = r.headers.get('Content-Length')
+        if not length or not length.isdigit():
+            return None
+        return int(length)
+
+    async def download_async(self, target, http_session=None):
+        """ Download remote file via HTTP on the event loop."""
+        if http_session is None:
+            return await super().download_async(target)
+        try:
+            async with http_session.get(self.url) as r:
+                if r.status == 404:
+                    raise ResourceNotFoundError(
+                        'resource not found via HTTP: {}'.format(self.url),
+                    )
+                r.raise_for_status()
+                async for chunk in r.content.iter_chunked(ASYNC_CHUNK_SIZE):
+                    target.write(chunk)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise UnderlyingSystemError(
+                'unable to download resource via HTTP: {}'.format(e),
+            )
@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+import argparse
+import base64
+import collections
+import json
+import logging
+import os
+import sys
+import time
+
+from . import metrics
+from .config import ENGINES, Config, load_config, load_logger
+from .processor import INVALID_MESSAGE_ERRORS, RecordProcessor
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 100
+
+
+class ReplayRecord:
+    """
+    Message read from a file, shaped like a KCL record.
+
+    Has no sequence number, so it is never checkpointed.
+    """
+
+    def __init__(self, source, line):
+        """
+        :param str source: file and line number message came from
+        :param bytes line: raw json message
+        """
+        self.source = source
+        self.data = base64.b64encode(line)
+        self.sequence_number = None
+        self.outcome = 'ok'
+        self.error = None
+        self.seconds = None
+
+    @property
+    def message_id(self):
+        try:
+            message = json.loads(base64.b64decode(self.data).decode('utf-8'))
+            return message['messageHeader']['messageId']
+        except (TypeError, ValueError, KeyError):
+            return None
+
+    def report(self):
+        return {
+            'source': self.source,
+            'message_id': self.message_id,
+            'outcome': self.outcome,
+            'error': self.error,
+            'seconds': self.seconds,
+        }
+
+
+def iter_files(paths):
+    """ Expand directories to the jsonl files in them
+
+    :param paths: files or directories
+    :type paths: list of str
+    :rtype: generator of str
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith('.jsonl'):
+                    yield os.path.join(path, name)
+        else:
+            yield path
+
+
+def restore_message_type(line, message_type):
+    """ Turn message exported to error stream back into a command
+
+    :param bytes line: raw json message
+    :param str message_type: type to give Error messages
+    :rtype: bytes
+    """
+    try:
+        message = json.loads(line.decode('utf-8'))
+    except ValueError:
+        return line
+    header = message.get('messageHeader') if isinstance(message, dict) else None
+    if not isinstance(header, dict) or header.get('messageType') != 'Error':
+        return line
+    header['messageType'] = message_type
+    header.pop('errorCode', None)
+    header.pop('errorDescription', None)
+    return json.dumps(message).encode('utf-8')
+
+
+def read_records(paths, error_message_type=None):
+    """ Read one record per non blank line of jsonl files
+
+    Lines are passed on as they are, invalid json fails like it would
+    on the stream.
+
+    :param paths: files or directories
+    :type paths: list of str
+    :param str error_message_type: type to give Error messages, None to
+        keep them as they are
+    :rtype: generator of ReplayRecord
+    """
+    for path in iter_files(paths):
+        with open(path, 'rb') as f:
+            for number, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                if error_message_type:
+                    line = restore_message_type(line, error_message_type)
+                yield ReplayRecord('{}:{}'.format(path, number), line)
+
+
+def batches(records, size):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class ReplayProcessor(RecordProcessor):
+    """
+    Record processor reporting outcomes on records instead of streams.
+    """
+
+    def open_streams(self, config):
+        return None, None
+
+    def process_records(self, records, checkpointer=None):
+        """ Handle batch, setting outcome and timing on each record
+
+        :param records: input records
+        :type records: list of ReplayRecord
+        :param checkpointer: unused, replays are never checkpointed
+        """
+        def on_complete(record):
+            record.seconds = self.scheduler.completed(record)
+
+        self.engine.process_batch(self.scheduler.schedule(records), on_complete)
+
+    def handle_error(self, record, error):
+        if isinstance(error, INVALID_MESSAGE_ERRORS):
+            record.outcome = 'invalid'
+        else:
+            record.outcome = 'error'
+        record.error = '{}: {}'.format(type(error).__name__, error)
+        logger.warning('%s failed', record.source, exc_info=error)
+
+    def close(self):
+        self.engine.shutdown()
+        self.ledger.close()
+        metrics.flush()
+
+
+def summarise(records, elapsed):
+    """ Totals and throughput of replayed records
+
+    :param records: replayed records
+    :type records: list of ReplayRecord
+    :param float elapsed: wall clock seconds
+    :rtype: dict
+    """
+    outcomes = collections.Counter(record.outcome for record in records)
+    seconds = sorted(r.seconds for r in records if r.seconds is not None)
+
+    def percentile(p):
+        if not seconds:
+            return None
+        return seconds[min(len(seconds) - 1, int(len(seconds) * p))]
+
+    return {
+        'records': len(records),
+        'outcomes': dict(outcomes),
+        'elapsed_seconds': elapsed,
+        'records_per_second': len(records) / elapsed if elapsed else None,
+        'p50_seconds': percentile(0.5),
+        'p95_seconds': percentile(0.95),
+        'max_seconds': seconds[-1] if seconds else None,
+    }
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description='Replay RDSS messages from jsonl files without KCL.',
+    )
+    parser.add_argument(
+        'paths', nargs='+',
+        help='jsonl files, or directories of them, one message per line',
+    )
+    parser.add_argument(
+        '--environment', default=os.environ.get('ENVIRONMENT'),
+        help='config to load, defaults to ENVIRONMENT variable',
+    )
+    parser.add_argument('--engine', choices=ENGINES, help='task engine')
+    parser.add_argument(
+        '--workers', type=int, help='records processed at once',
+    )
+    parser.add_argument(
+        '--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+        help='records scheduled together',
+    )
+    parser.add_argument(
+        '--dry-destination', metavar='DIR',
+        help='write bundles under DIR instead of uploading, disables ledger',
+    )
+    parser.add_argument(
+        '--error-message-type', metavar='TYPE',
+        help='replay exported Error messages as TYPE, e.g. MetadataCreate',
+    )
+    parser.add_argument(
+        '--report', default='-',
+        help='jsonl file for per message outcomes, - for stdout',
+    )
+    parser.add_argument(
+        '--debug', action='store_true',
+        help='log everything to stderr instead of environment logging',
+    )
+    return parser.parse_args(argv)
+
+
+def build_config(args):
+    """ Load environment config with command line overrides
+
+    :param argparse.Namespace args: parsed arguments
+    :rtype: preservicaservice.config.Config
+    :raise: ConfigError if invalid
+    """
+    conf = load_config(args.environment)
+    if args.engine:
+        conf.engine = args.engine
+    if args.workers is not None:
+        conf.record_workers = Config.validate_positive_int(
+            'record_workers', args.workers,
+        )
+    Config.validate_positive_int('batch_size', args.batch_size)
+    if args.dry_destination:
+        conf.dry_destination_dir = args.dry_destination
+        conf.ledger_path = None
+    return conf
+
+
+def replay(processor, records, batch_size, report):
+    """ Run records through processor, writing outcomes as they finish
+
+    :param ReplayProcessor processor: processor to run records with
+    :param records: records to replay
+    :param int batch_size: records scheduled together
+    :param report: text file for jsonl outcomes
+    :return: replayed records
+    :rtype: list of ReplayRecord
+    """
+    done = []
+    for batch in batches(records, batch_size):
+        processor.process_records(batch)
+        for record in batch:
+            report.write(json.dumps(record.report()) + '\n')
+        report.flush()
+        done.extend(batch)
+    return done
+
+
+def main(argv=None):
+    """ Replay entry point.
+
+    Exits 1 if any message failed, 2 if it could not start.
+    """
+    args = parse_args(argv)
+    if not args.environment:
+        sys.stderr.write('--environment or ENVIRONMENT is required\n')
+        sys.exit(2)
+
+    try:
+        conf = build_config(args)
+        load_logger(args.environment, simple=args.debug)
+    except Exception as e:
+        sys.stderr.write('{}\n'.format(e))
+        sys.exit(2)
+
+    processor = ReplayProcessor(conf)
+    report = sys.stdout if args.report == '-' else open(args.report, 'w')
+    started = time.monotonic()
+    try:
+        records = read_records(args.paths, args.error_message_type)
+        done = replay(processor, records, args.batch_size, report)
+    finally:
+        processor.close()
+        if report is not sys.stdout:
+            report.close()
+
+    summary = summarise(done, time.monotonic() - started)
+    logger.info('replay summary %s', summary)
+    sys.stderr.write(json.dumps(summary, indent=2) + '\n')
+    if summary['outcomes'].get('error') or summary['outcomes'].get('invalid'):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
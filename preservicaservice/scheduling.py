@@ -0,0 +1,231 @@
+import collections
+import logging
+import threading
+import time
+
+from . import metrics
+from .tasks import require_organisation_id
+from .tasks_parser import decode_record
+
+logger = logging.getLogger(__name__)
+
+# fixed cost of a file on top of its bytes, lookups and request round trips
+FILE_OVERHEAD_BYTES = 1024 * 1024
+# fixed cost of any record, so metadata only records still take turns
+RECORD_OVERHEAD_BYTES = 64 * 1024
+
+UNKNOWN_ORGANISATION = 'unknown'
+
+
+def estimate_message_cost(message, default_file_bytes):
+    """ Estimate work needed for message
+
+    Uses objectFile count and their declared fileSize, nothing is fetched.
+    Messages without files are cheap.
+
+    :param dict message: decoded message
+    :param int default_file_bytes: size assumed for files without fileSize
+    :return: cost in bytes
+    :rtype: int
+    """
+    try:
+        objects = message['messageBody']['objectFile']
+    except (TypeError, KeyError):
+        return 0
+    if not isinstance(objects, list):
+        return 0
+
+    cost = 0
+    for object_file in objects:
+        size = None
+        if isinstance(object_file, dict):
+            size = object_file.get('fileSize')
+        if not isinstance(size, int) or isinstance(size, bool):
+            size = default_file_bytes
+        cost += size + FILE_OVERHEAD_BYTES
+    return cost
+
+
+def describe_record(record, default_file_bytes):
+    """ Organisation and estimated cost of record from the message alone
+
+    Records which fail to decode are cheap and of UNKNOWN_ORGANISATION,
+    they fail fast once run.
+
+    :param record: input record
+    :type record: amazon_kclpy.messages.Record
+    :param int default_file_bytes: size assumed for files without fileSize
+    :return: organisation, cost in bytes
+    :rtype: tuple of (str, int)
+    """
+    try:
+        message = decode_record(record)
+    except Exception:
+        return UNKNOWN_ORGANISATION, 0
+    try:
+        organisation = require_organisation_id(message)
+    except Exception:
+        organisation = UNKNOWN_ORGANISATION
+    return organisation, estimate_message_cost(message, default_file_bytes)
+
+
+def largest_first_order(entries):
+    """ Start the longest records while other workers pick up cheap ones
+
+    The batch then ends close to its longest record instead of behind it.
+    Records of equal cost keep their arrival order.
+
+    :param entries: (organisation, cost, record) in arrival order
+    :type entries: list of tuple
+    :rtype: list of tuple
+    """
+    return sorted(entries, key=lambda entry: -entry[1])
+
+
+def fair_share_order(entries):
+    """ Interleave organisations so each starts an equal share of bytes
+
+    Each organisation keeps its own order, the next record always comes
+    from the organisation which has started the fewest bytes so far (start
+    time fair queuing). A bulk deposit is spread over the batch instead of
+    holding every worker until it is done.
+
+    :param entries: (organisation, cost, record) in preferred order
+    :type entries: list of tuple
+    :rtype: list of tuple
+    """
+    queues = collections.OrderedDict()
+    for entry in entries:
+        queues.setdefault(entry[0], collections.deque()).append(entry)
+
+    started = {organisation: 0 for organisation in queues}
+    ordered = []
+    while queues:
+        # ties go to the organisation seen first in the batch
+        organisation = min(queues, key=lambda org: started[org])
+        entry = queues[organisation].popleft()
+        started[organisation] += entry[1] + RECORD_OVERHEAD_BYTES
+        if not queues[organisation]:
+            del queues[organisation]
+        ordered.append(entry)
+    return ordered
+
+
+class RecordScheduler:
+    """
+    Orders batches and tracks load of each organisation.
+
+    Queue depth counts records of a batch which have not started yet, in
+    flight bytes the estimated cost of started records not yet complete.
+    Both are published as gauges of each organisation as they change.
+    """
+
+    def __init__(self, default_file_bytes, order='fair_share'):
+        """
+        :param int default_file_bytes: size assumed for files without fileSize
+        :param str order: fair_share, largest_first or arrival
+        """
+        self.default_file_bytes = default_file_bytes
+        self.order = order
+        self._lock = threading.Lock()
+        self._entries = {}
+        self.queued = collections.Counter()
+        self.in_flight = collections.Counter()
+        self.in_flight_bytes = collections.Counter()
+
+    def schedule(self, records):
+        """ Order batch and start tracking its records
+
+        :param records: batch from KCL
+        :type records: list of amazon_kclpy.messages.Record
+        :rtype: list of amazon_kclpy.messages.Record
+        """
+        entries = [
+            describe_record(record, self.default_file_bytes) + (record,)
+            for record in records
+        ]
+        if self.order != 'arrival':
+            entries = largest_first_order(entries)
+        if self.order == 'fair_share':
+            entries = fair_share_order(entries)
+        logger.debug(
+            'scheduled records %s',
+            [(organisation, cost) for organisation, cost, _ in entries],
+        )
+
+        with self._lock:
+            for organisation, cost, record in entries:
+                self._entries[id(record)] = [organisation, cost, None]
+                self.queued[organisation] += 1
+            for organisation in {entry[0] for entry in entries}:
+                self._report(organisation)
+        return [record for _, _, record in entries]
+
+    def started(self, record):
+        """ Mark record as picked up by a worker
+
+        :param record: scheduled record
+        """
+        with self._lock:
+            entry = self._entries.get(id(record))
+            if entry is None or entry[2] is not None:
+                return
+            entry[2] = time.monotonic()
+            organisation, cost, _ = entry
+            self.queued[organisation] -= 1
+            self.in_flight[organisation] += 1
+            self.in_flight_bytes[organisation] += cost
+            self._report(organisation)
+
+    def completed(self, record):
+        """ Stop tracking record, started or not
+
+        :param record: scheduled record
+        :return: seconds since record started, None if it never did
+        :rtype: float
+        """
+        with self._lock:
+            entry = self._entries.pop(id(record), None)
+            if entry is None:
+                return None
+            organisation, cost, started_at = entry
+            if started_at is None:
+                self.queued[organisation] -= 1
+                seconds = None
+            else:
+                self.in_flight[organisation] -= 1
+                self.in_flight_bytes[organisation] -= cost
+                seconds = time.monotonic() - started_at
+            self._report(organisation)
+            self._prune(organisation)
+            return seconds
+
+    def _report(self, organisation):
+        metrics.gauge(
+            'queued_records', self.queued[organisation],
+            organisation=organisation,
+        )
+        metrics.gauge(
+            'in_flight_bytes', self.in_flight_bytes[organisation],
+            organisation=organisation,
+        )
+
+    def _prune(self, organisation):
+        if not self.queued[organisation] and not self.in_flight[organisation]:
+            del self.queued[organisation]
+            del self.in_flight[organisation]
+            del self.in_flight_bytes[organisation]
+
+    def stats(self):
+        """ Load of each organisation with records not yet complete
+
+        :rtype: dict of (str => dict)
+        """
+        with self._lock:
+            return {
+                organisation: {
+                    'queued': self.queued[organisation],
+                    'in_flight': self.in_flight[organisation],
+                    'in_flight_bytes': self.in_flight_bytes[organisation],
+                } for organisation in set(self.queued) | set(self.in_flight)
+            }
@@ -0,0 +1,255 @@
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import uuid
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# directory under each root holding scratch files of the service
+SCRATCH_DIR_NAME = 'preservica-scratch'
+DEFAULT_SMALL_FILE_BYTES = 8 * 1024 * 1024
+# longest part of a record name kept in its directory name
+MAX_NAME_LENGTH = 64
+
+
+def process_alive(pid):
+    """ Check if a process with given pid is running
+
+    :param int pid: process id
+    :rtype: bool
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # running as another user
+        return True
+    return True
+
+
+def tree_bytes(path):
+    """ Size of files under directory, 0 if it does not exist
+
+    :param str path: directory
+    :rtype: int
+    """
+    total = 0
+    for directory, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.lstat(os.path.join(directory, name)).st_size
+            except OSError:
+                # removed while walking
+                pass
+    return total
+
+
+class ScratchSpace:
+    """
+    Temporary files of records, under one directory per process and record.
+
+    Files go to the root with most free disk, or to small_root, such as a
+    tmpfs, when known to be small. Each process keeps its files under a
+    directory named by its pid, so files of a worker killed mid record are
+    found and removed by the sweep of the next one.
+    """
+
+    def __init__(
+        self, roots=None, small_root=None,
+        small_file_bytes=DEFAULT_SMALL_FILE_BYTES,
+    ):
+        """
+        :param roots: directories for files, temp dir by default
+        :type roots: list of str
+        :param str small_root: directory for small files, None to keep them
+            with the rest
+        :param int small_file_bytes: largest file put in small_root
+        """
+        self.roots = list(roots or [tempfile.gettempdir()])
+        self.small_root = small_root
+        self.small_file_bytes = small_file_bytes
+
+    @property
+    def all_roots(self):
+        roots = list(self.roots)
+        if self.small_root and self.small_root not in roots:
+            roots.append(self.small_root)
+        return roots
+
+    @staticmethod
+    def process_dir(root, pid=None):
+        """ Directory holding files of a process under root
+
+        :param str root: scratch root
+        :param int pid: process id, current process by default
+        :rtype: str
+        """
+        return os.path.join(root, SCRATCH_DIR_NAME, str(pid or os.getpid()))
+
+    def area(self, name):
+        """ Scratch area of one record
+
+        :param str name: record name, such as message id
+        :rtype: ScratchArea
+        """
+        return ScratchArea(self, name)
+
+    def pick_root(self, expected_size=None):
+        """ Root a new file goes to
+
+        :param int expected_size: bytes the file will take, None if unknown
+        :rtype: str
+        """
+        if (
+            self.small_root and expected_size is not None and
+            expected_size <= self.small_file_bytes
+        ):
+            return self.small_root
+        if len(self.roots) == 1:
+            return self.roots[0]
+        return max(self.roots, key=lambda root: shutil.disk_usage(root).free)
+
+    def sweep(self):
+        """ Remove files left by processes no longer running
+
+        Call on startup. A directory named by the current pid is also
+        removed, restarted containers often reuse pids.
+
+        :return: bytes removed
+        :rtype: int
+        """
+        removed = 0
+        for root in self.all_roots:
+            base = os.path.join(root, SCRATCH_DIR_NAME)
+            try:
+                entries = os.listdir(base)
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                if not entry.isdigit():
+                    continue
+                pid = int(entry)
+                if pid != os.getpid() and process_alive(pid):
+                    continue
+                path = os.path.join(base, entry)
+                size = tree_bytes(path)
+                shutil.rmtree(path, ignore_errors=True)
+                logger.warning(
+                    'removed %d bytes of scratch left by process %d in %s',
+                    size, pid, root,
+                )
+                removed += size
+        if removed:
+            metrics.increment('scratch_swept_bytes', removed)
+        return removed
+
+    def in_use_bytes(self):
+        """ Bytes of files the current process keeps in scratch
+
+        :rtype: int
+        """
+        return sum(tree_bytes(self.process_dir(root)) for root in self.all_roots)
+
+    def report(self):
+        """ Set scratch_bytes gauge of every root """
+        if not metrics.get_registry().enabled:
+            return
+        for root in self.all_roots:
+            metrics.gauge(
+                'scratch_bytes', tree_bytes(self.process_dir(root)), root=root,
+            )
+
+
+class ScratchArea:
+    """
+    Temporary files of one record.
+
+    Directories are made on each root as files are placed there, and
+    removed once their last file is.
+    """
+
+    def __init__(self, space, name):
+        """
+        :param ScratchSpace space: where files are placed
+        :param str name: record name, such as message id
+        """
+        self.space = space
+        self.name = '{}-{}'.format(
+            re.sub(r'[^A-Za-z0-9._-]', '_', name or 'record')[:MAX_NAME_LENGTH],
+            uuid.uuid4().hex[:8],
+        )
+        self.directories = set()
+        self._lock = threading.Lock()
+
+    def new_file(self, expected_size=None):
+        """ Create an empty file
+
+        :param int expected_size: bytes the file will take, None if unknown
+        :return: file path
+        :rtype: str
+        """
+        directory = os.path.join(
+            self.space.process_dir(self.space.pick_root(expected_size)),
+            self.name,
+        )
+        with self._lock:
+            os.makedirs(directory, exist_ok=True)
+            self.directories.add(directory)
+            fd, path = tempfile.mkstemp(dir=directory)
+        os.close(fd)
+        return path
+
+    def remove_file(self, path):
+        """ Remove file, and its directory if it was the last one
+
+        :param str path: file made by new_file
+        """
+        directory = os.path.dirname(path)
+        with self._lock:
+            if os.path.exists(path):
+                os.unlink(path)
+            if directory not in self.directories:
+                return
+            try:
+                os.rmdir(directory)
+            except OSError:
+                # other files left
+                return
+            self.directories.discard(directory)
+
+    def remove(self):
+        """ Remove every file of the area """
+        with self._lock:
+            for directory in self.directories:
+                shutil.rmtree(directory, ignore_errors=True)
+            self.directories.clear()
+
+
+DEFAULT = ScratchSpace()
+
+_spaces = {}
+_spaces_lock = threading.Lock()
+
+
+def get_space(roots=None, small_root=None, small_file_bytes=DEFAULT_SMALL_FILE_BYTES):
+    """ Shared scratch space for given settings
+
+    :param roots: directories for files, temp dir by default
+    :type roots: list of str
+    :param str small_root: directory for small files, None to disable
+    :param int small_file_bytes: largest file put in small_root
+    :rtype: ScratchSpace
+    """
+    if not roots and not small_root:
+        return DEFAULT
+    with _spaces_lock:
+        key = (tuple(roots or ()), small_root, small_file_bytes)
+        if key not in _spaces:
+            _spaces[key] = ScratchSpace(roots, small_root, small_file_bytes)
+        return _spaces[key]
@@ -1,28 +1,52 @@
 import abc
+import asyncio
+import contextlib
 import datetime
-import hashlib
-import base64
+import io
 import logging
 import os
-import tempfile
+import shutil
+import time
 import zipfile
 import boto3
 
+from . import metrics
+from .bundle import BundleWriter
+from .compression import CONTENT, TRIAL_BYTES, get_policy
 from .errors import (
     MalformedBodyError,
     ResourceAlreadyExistsError,
     UnderlyingSystemError,
     InvalidChecksumError,
 )
-from .meta import write_object_meta, write_message_meta
+from .hashing import HashingWriter
+from .local_bucket import LocalBucket
+from .meta import message_meta, object_meta, write_object_meta
+from .multipart import MAX_OBJECT_BYTES, StreamingUpload
+from .offload import INLINE, get_backend
+from .prefetch import SERIAL, get_prefetcher
 from .remote_urls import S3RemoteUrl, HTTPRemoteUrl
 from .preservica_s3_bucket import PreservicaS3BucketBuilder
+from .scratch import DEFAULT as DEFAULT_SCRATCH, get_space
+from .ziputil import needs_zip64
 
 logger = logging.getLogger(__name__)
 
+STREAM_CHUNK_SIZE = 1024 * 1024
+# permissions of archive members, as of the temp files they were made from
+MEMBER_ATTRIBUTES = 0o600 << 16
 
-def get_tmp_file():
-    return tempfile.NamedTemporaryFile(delete=False).name
+
+def member_info(arcname):
+    """ Info of deflated archive member dated now
+
+    :param str arcname: name inside archive
+    :rtype: zipfile.ZipInfo
+    """
+    zinfo = zipfile.ZipInfo(arcname, time.localtime()[0:6])
+    zinfo.compress_type = zipfile.ZIP_DEFLATED
+    zinfo.external_attr = MEMBER_ATTRIBUTES
+    return zinfo
 
 
 class BaseTask(abc.ABC):
@@ -54,6 +78,19 @@ class BaseTask(abc.ABC):
         :rtype: bool
         """
 
+    @classmethod
+    def ledger_key(cls, message, config):
+        """ Key identifying message output in the ingest ledger.
+
+        :param dict message: raw message
+        :param config: job environment config
+        :type config: preservicaservice.config.Config
+        :raise: preservicaservice.errors.MalformedBodyError if key missing
+        :return: (message id, bundle name) or None if not tracked
+        :rtype: tuple of (str, str)
+        """
+        return None
+
 
 def require_non_empty_key(message, key1, key2):
     """ Require message to have given non empty key
@@ -180,6 +217,16 @@ def require_organisation_role(message):
     )
 
 
+# Map from RDSS checksumType, which is an integer designed to not change, to a
+# string type that is used internally here. The string values here do need to
+# match the names in hashlib, but are independent of anything in the messsage
+# API spec
+CHECKSUM_TYPES = {
+    1: 'md5',
+    2: 'sha256',
+}
+
+
 class FileMetadata(object):
     """ File object Metadata, not related to AWS metadata. """
 
@@ -204,22 +251,41 @@ class FileMetadata(object):
         """
         write_object_meta(meta_path, self.values())
 
+    def render(self):
+        """ Meta xml
+
+        :rtype: bytes
+        """
+        return object_meta(self.values())
+
     def values(self):
         """ Get values for tags """
         return self.__dict__.items()
 
 
 class FileTask(object):
-    DEFAULT_FILE_SIZE_LIMIT = 5 * 1024 * 1024 * 1024 + 1
+    # bundles are uploaded in parts, S3 puts no practical limit on files
+    DEFAULT_FILE_SIZE_LIMIT = None
 
     def __init__(
         self, remote_file, metadata, message_id, object_id, file_checksum,
-        file_size_limit=DEFAULT_FILE_SIZE_LIMIT,
+        file_size_limit=DEFAULT_FILE_SIZE_LIMIT, offload=INLINE,
+        declared_size=None, organisation_id=None, compression=CONTENT,
+        scratch=None,
     ):
         """
         :param remote_file: remote_file.BaseRemoteFile
         :param FileMetadata metadata: file related metadata
         :param int file_size_limit: max file size limit
+        :param int declared_size: fileSize from message if any
+        :param offload: backend compressing large files
+        :type offload: preservicaservice.offload.OffloadBackend
+        :param str organisation_id: depositing organisation, labels metrics
+        :param compression: picks compression of the file's member
+        :type compression: preservicaservice.compression.DeflatePolicy
+        :param scratch: where temporary files go, shared by files of the
+            message, an area of its own by default
+        :type scratch: preservicaservice.scratch.ScratchArea
         """
         self.remote_file = remote_file
         self.metadata = metadata
@@ -227,73 +293,154 @@ class FileTask(object):
         self.message_id = message_id
         self.archive_base_path = object_id
         self.file_checksum = file_checksum
+        self.offload = offload
+        self.declared_size = declared_size
+        self.organisation_id = organisation_id
+        self.compression = compression
+        self.scratch = scratch or DEFAULT_SCRATCH.area(message_id)
+        self.remote_size = None
+        self.remote_sized = False
+        self.download_path = None
+        self.meta_path = None
+        self.data = None
 
     def download(self, download_path):
-        """ Download given path from s3 to temp destination.
+        """ Download file to given path, verifying it on the way
+
+        Checksums are calculated from the data as it is written, the file
+        is never read back.
+
+        :param str download_path: where to download to
+        :raise: UnderlyingSystemError if file too big
+        :raise: InvalidChecksumError if file does not match its checksums
+        """
+        labels = self.metric_labels()
+        with open(download_path, 'wb') as f:
+            hasher = self.checksum_hasher(f)
+            with metrics.timer('download_seconds', **labels):
+                self.remote_file.download(hasher)
+        metrics.increment('download_bytes', hasher.size, **labels)
+        self.verify_download(hasher)
+
+    def metric_labels(self):
+        return {
+            'organisation': self.organisation_id,
+            'storage_platform': self.remote_file.PLATFORM,
+        }
 
-        :param str download_path: what to download
+    def expected_size(self):
+        """ Size from message, or from the remote if not declared
+
+        :return: size in bytes or None if unknown
+        :rtype: int
+        """
+        if self.declared_size is not None:
+            return self.declared_size
+        if not self.remote_sized:
+            self.remote_size = self.remote_file.get_size()
+            self.remote_sized = True
+        return self.remote_size
+
+    def known_size(self):
+        """ Size from message or an earlier preflight, never asks the remote
+
+        :return: size in bytes or None if unknown
+        :rtype: int
         """
-        self.remote_file.download(download_path)
+        if self.declared_size is not None:
+            return self.declared_size
+        return self.remote_size
 
-    def verify_file_size(self, path):
-        """ Check given path file size limit and raise if not valid.
+    def preflight(self):
+        """ Size file before any of it is downloaded
 
-        :param str path: file to check
+        :return: size in bytes or None if unknown
+        :rtype: int
         :raise: UnderlyingSystemError if file too big
+        :raise: ResourceNotFoundError if file missing
         """
-        size = os.path.getsize(path)
-        if size >= self.file_size_limit:
-            raise UnderlyingSystemError('')
+        size = self.expected_size()
+        if size is not None:
+            self.check_size(size)
+        return size
 
-    def verify_checksums(self, path):
-        """ Check given path checksums and raise if not valid.
+    def verify_download(self, hasher):
+        """ Check size limit and checksums of a whole downloaded file
 
-        :param str path: file to check
-        :raise: InvalidChecksumError if file too big
+        :param HashingWriter hasher: from checksum_hasher, fed whole file
+        :raise: UnderlyingSystemError if file too big
+        :raise: InvalidChecksumError if file does not match its checksums
         """
+        self.check_size(hasher.size)
+        self.verify_hasher(hasher)
 
-        # Map from RDSS checksumType, which is an integer designed to not change, to a
-        # string type that is used internally here. The string values here do need to
-        # match the names in hashlib, but are independent of anything in the messsage
-        # API spec
-        CHECKSUM_TYPES = {
-            1: 'md5',
-            2: 'sha256',
-        }
-        checksums = [
+    def check_size(self, size):
+        """ Raise if size reaches file size limit
+
+        :param int size: bytes of file, or read so far
+        :raise: UnderlyingSystemError if file too big
+        """
+        if self.file_size_limit is not None and size >= self.file_size_limit:
+            raise UnderlyingSystemError(
+                '{} exceeds file size limit of {} bytes'.format(
+                    self.remote_file.url, self.file_size_limit,
+                ),
+            )
+
+    def expected_checksums(self):
+        """ Checksums from message, by hashlib name
+
+        :rtype: list of dict
+        """
+        return [
             {
                 'type': CHECKSUM_TYPES[checksum_rdss['checksumType']],
                 'expected': checksum_rdss['checksumValue'],
-                'calculated': getattr(hashlib, CHECKSUM_TYPES[checksum_rdss['checksumType']])(),
             } for checksum_rdss in self.file_checksum
         ]
 
-        if not checksums:
-            logger.debug('No checksums received. Skipping verification')
-            return
+    def checksum_hasher(self, target=None):
+        """ Writer hashing data with every algorithm checksums use
 
-        # We avoid reading the file into memory at once, and we only
-        # iterate through the file contents once, even if multiple checkums
-        # received
-        def read_chunks(file):
-            while True:
-                chunk = file.read(2048)
-                if not chunk:
-                    break
-                yield chunk
+        :param target: file object to pass data on to
+        :rtype: HashingWriter
+        """
+        return HashingWriter(target, algorithms={
+            checksum['type'] for checksum in self.expected_checksums()
+        })
 
-        logger.debug('Opening %s to find its checksums', path)
+    def verify_hasher(self, hasher):
+        """ Check checksums against data written to hasher
 
-        with open(path, 'rb') as file:
-            for chunk in read_chunks(file):
-                for checksum in checksums:
-                    checksum['calculated'].update(chunk)
+        :param HashingWriter hasher: from checksum_hasher, fed whole file
+        :raise: InvalidChecksumError if not matching
+        """
+        checksums = self.expected_checksums()
+        if not checksums:
+            logger.debug('No checksums received. Skipping verification')
+            return
+        self.compare_checksums(checksums, {
+            checksum['type']: hasher.digest(checksum['type'])
+            for checksum in checksums
+        })
+
+    def compare_checksums(self, checksums, digests):
+        """ Raise unless calculated digests match expected checksums
+
+        :param checksums: from expected_checksums
+        :type checksums: list of dict
+        :param digests: calculated digest by hashlib name
+        :type digests: dict of (str => bytes)
+        :raise: InvalidChecksumError if not matching
+        """
+        for checksum in checksums:
+            checksum['calculated'] = digests[checksum['type']].hex()
 
         logger.debug('Calculated checksums %s', checksums)
 
         non_matching_checksums = [
             checksum for checksum in checksums
-            if checksum['expected'] != checksum['calculated'].hexdigest()
+            if checksum['expected'] != checksum['calculated']
         ]
 
         if non_matching_checksums:
@@ -307,55 +454,222 @@ class FileTask(object):
                 ),
             )
 
-    def zip_bundle(self, zip_path, download_path, meta_path):
-        """ Zip bundle of file and meta to given file
+    def add_to_bundle(self, zip_file, download_path, meta_path):
+        """ Add file and meta to archive
 
-        :param str zip_path: target zip file
+        :param zipfile.ZipFile zip_file: archive open for writing
         :param str download_path: original file
         :param str meta_path: meta file
         """
-        contents = (
-            (
-                download_path,
-                os.path.join(
-                    self.archive_base_path,
-                    os.path.basename(self.remote_file.name),
-                ),
-            ),
-            (
-                meta_path,
-                os.path.join(
-                    self.archive_base_path,
-                    '{}.metadata'.format(os.path.basename(
-                        self.remote_file.name,
-                    )),
-                ),
-            ),
+        decision = self.compression.choose_file(
+            self.archive_name, download_path,
         )
 
-        with zipfile.ZipFile(
-            zip_path, 'a', compression=zipfile.ZIP_DEFLATED,
-        ) as f:
-            for src, dst in contents:
-                f.write(src, dst)
+        labels = self.metric_labels()
+        with metrics.timer('zip_seconds', **labels):
+            self.offload.write(
+                zip_file, download_path, self.archive_name,
+                decision.compress_type, decision.level,
+            )
+            self.offload.write(zip_file, meta_path, self.meta_archive_name)
+        zinfo = zip_file.getinfo(self.archive_name)
+        self.compression.record(decision, zinfo.file_size, zinfo.compress_size)
+        metrics.increment(
+            'zip_bytes', os.path.getsize(download_path), **labels
+        )
 
-    def run(self, zip_path):
-        """ Prepare and append files to zip bundle
-        :param str zip_path: which archive to append data to
+    def add_data_to_bundle(self, zip_file):
+        """ Add file loaded into memory and its meta to archive
+
+        :param zipfile.ZipFile zip_file: archive open for writing
         """
-        download_path = get_tmp_file()
-        meta_path = get_tmp_file()
-        try:
-            self.metadata.generate(meta_path)
-            self.download(download_path)
-            # TODO Remove to re-enable checksum and fsize validation
-            # self.verify_file_size(download_path)
-            # self.verify_checksums(download_path)
-            self.zip_bundle(zip_path, download_path, meta_path)
-        finally:
-            for path in (download_path, meta_path):
-                if os.path.exists(path):
-                    os.unlink(path)
+        decision = self.compression.choose(
+            self.archive_name, self.data[:TRIAL_BYTES],
+        )
+        zinfo = member_info(self.archive_name)
+
+        labels = self.metric_labels()
+        with metrics.timer('zip_seconds', **labels):
+            decision.write(zip_file, zinfo, self.data)
+            zip_file.writestr(
+                member_info(self.meta_archive_name), self.metadata.render(),
+            )
+        self.compression.record(decision, zinfo.file_size, zinfo.compress_size)
+        metrics.increment('zip_bytes', zinfo.file_size, **labels)
+
+    def add_fetched_to_bundle(self, zip_file):
+        """ Add file fetched to memory or temporary files to archive
+
+        :param zipfile.ZipFile zip_file: archive open for writing
+        """
+        if self.data is not None:
+            self.add_data_to_bundle(zip_file)
+        else:
+            self.add_to_bundle(zip_file, self.download_path, self.meta_path)
+
+    @property
+    def archive_name(self):
+        return os.path.join(
+            self.archive_base_path,
+            os.path.basename(self.remote_file.name),
+        )
+
+    @property
+    def meta_archive_name(self):
+        return '{}.metadata'.format(self.archive_name)
+
+    def stream_bundle(self, zip_file):
+        """ Download file straight into archive, followed by its meta
+
+        Nothing but the archive is written to disk. Member is Zip64 unless
+        the declared size shows it is not needed. Compression is picked
+        from the first chunk. Size limit and checksums are checked on the
+        chunks as they pass.
+
+        :param zipfile.ZipFile zip_file: archive open for writing
+        :raise: UnderlyingSystemError once file exceeds size limit
+        :raise: InvalidChecksumError if file does not match its checksums
+        """
+        zinfo = member_info(self.archive_name)
+        if self.declared_size is not None:
+            zinfo.file_size = self.declared_size
+        zip64 = needs_zip64(self.declared_size)
+
+        hasher = self.checksum_hasher()
+        read_seconds = 0.0
+        write_seconds = 0.0
+        with self.remote_file.open_stream() as reader:
+            started = time.monotonic()
+            chunk = reader.read(STREAM_CHUNK_SIZE)
+            read_seconds += time.monotonic() - started
+            decision = self.compression.choose(self.archive_name, chunk)
+            with decision.open(zip_file, zinfo, force_zip64=zip64) as member:
+                while chunk:
+                    hasher.write(chunk)
+                    self.check_size(hasher.size)
+                    if not zip64 and hasher.size > zipfile.ZIP64_LIMIT:
+                        raise UnderlyingSystemError(
+                            '{} is larger than its fileSize {}'.format(
+                                self.remote_file.url, self.declared_size,
+                            ),
+                        )
+                    started = time.monotonic()
+                    member.write(chunk)
+                    write_seconds += time.monotonic() - started
+                    started = time.monotonic()
+                    chunk = reader.read(STREAM_CHUNK_SIZE)
+                    read_seconds += time.monotonic() - started
+        self.verify_hasher(hasher)
+        self.compression.record(decision, zinfo.file_size, zinfo.compress_size)
+
+        zip_file.writestr(
+            member_info(self.meta_archive_name), self.metadata.render(),
+        )
+
+        labels = self.metric_labels()
+        metrics.observe('download_seconds', read_seconds, **labels)
+        metrics.observe('zip_seconds', write_seconds, **labels)
+        metrics.increment('download_bytes', zinfo.file_size, **labels)
+        metrics.increment('zip_bytes', zinfo.file_size, **labels)
+
+    def should_stream(self):
+        """ Check if file is better streamed into the archive than fetched
+
+        Files the offload backend takes are fetched first, so they are
+        deflated in blocks or by a worker rather than inline. Files of
+        unknown size stream.
+
+        :rtype: bool
+        """
+        size = self.known_size()
+        return size is None or not self.offload.takes(size)
+
+    def new_files(self):
+        """ Create scratch files for download and metadata """
+        self.download_path = self.scratch.new_file(self.known_size())
+        self.meta_path = self.scratch.new_file(0)
+
+    def prepare(self):
+        """ Download file and generate its metadata to temporary files """
+        self.new_files()
+        self.metadata.generate(self.meta_path)
+        self.download(self.download_path)
+
+    def fetch(self):
+        """ Stream file to a temporary file, verifying it on the way
+
+        :raise: UnderlyingSystemError once file exceeds size limit
+        :raise: InvalidChecksumError if file does not match its checksums
+        """
+        self.new_files()
+        self.metadata.generate(self.meta_path)
+        with open(self.download_path, 'wb') as f:
+            self.download_stream(f)
+
+    def load(self):
+        """ Download file into memory, verifying it on the way
+
+        For files of known size, a file growing past it is rejected so it
+        never takes more memory than planned.
+
+        :raise: UnderlyingSystemError once file exceeds size limit or its
+            known size
+        :raise: InvalidChecksumError if file does not match its checksums
+        """
+        buffer = io.BytesIO()
+        self.download_stream(buffer, self.known_size())
+        self.data = buffer.getvalue()
+
+    def download_stream(self, target, max_size=None):
+        """ Stream file to writable target, verifying it on the way
+
+        :param target: writable file object
+        :param int max_size: bytes from which file is rejected, None for
+            file size limit only
+        :raise: UnderlyingSystemError once file exceeds a limit
+        :raise: InvalidChecksumError if file does not match its checksums
+        """
+        labels = self.metric_labels()
+        with metrics.timer('download_seconds', **labels):
+            with self.remote_file.open_stream() as reader:
+                hasher = self.checksum_hasher(target)
+                for chunk in iter(lambda: reader.read(STREAM_CHUNK_SIZE), b''):
+                    hasher.write(chunk)
+                    self.check_size(hasher.size)
+                    if max_size is not None and hasher.size > max_size:
+                        raise UnderlyingSystemError(
+                            '{} is larger than its size {}'.format(
+                                self.remote_file.url, max_size,
+                            ),
+                        )
+        metrics.increment('download_bytes', hasher.size, **labels)
+        self.verify_hasher(hasher)
+
+    async def prepare_async(self, transfer_slots, http_session=None):
+        """ Coroutine version of prepare
+
+        :param asyncio.Semaphore transfer_slots: limits concurrent transfers
+        :param aiohttp.ClientSession http_session: shared HTTP session
+        """
+        self.new_files()
+        self.metadata.generate(self.meta_path)
+        labels = self.metric_labels()
+        with open(self.download_path, 'wb') as f:
+            hasher = self.checksum_hasher(f)
+            async with transfer_slots:
+                with metrics.timer('download_seconds', **labels):
+                    await self.remote_file.download_async(hasher, http_session)
+        metrics.increment('download_bytes', hasher.size, **labels)
+        self.verify_download(hasher)
+
+    def cleanup(self):
+        """ Remove temporary files created by prepare, drop loaded data """
+        for path in (self.download_path, self.meta_path):
+            if path:
+                self.scratch.remove_file(path)
+        self.download_path = None
+        self.meta_path = None
+        self.data = None
 
 
 class BaseMetadataCreateTask(BaseTask):
@@ -364,9 +678,14 @@ class BaseMetadataCreateTask(BaseTask):
     by uploading to the appropriate S3 bucket
     """
     UPLOAD_OVERRIDE = False
+    # staged engines keep each file on scratch disk as download and again
+    # inside the bundle, run only keeps files fetched ahead on scratch disk
+    SCRATCH_COPIES = 2
 
     def __init__(
         self, message, file_tasks, destination_bucket, message_id, role, object_id,
+        offload=INLINE, organisation_id=None, prefetch=SERIAL, scratch=None,
+        memory_bundle_bytes=0,
     ):
         """
         :param dict message: source message
@@ -375,6 +694,16 @@ class BaseMetadataCreateTask(BaseTask):
         :param boto3.S3.Bucket: destination_bucket
         :param str message_id: message header id
         :param str role: tag role
+        :param offload: backend compressing large files
+        :type offload: preservicaservice.offload.OffloadBackend
+        :param str organisation_id: depositing organisation, labels metrics
+        :param prefetch: downloads files concurrently
+        :type prefetch: preservicaservice.prefetch.Prefetcher
+        :param scratch: where temporary files of the message go, an area of
+            its own by default
+        :type scratch: preservicaservice.scratch.ScratchArea
+        :param int memory_bundle_bytes: messages with files of known sizes
+            totalling at most this are bundled in memory, 0 to disable
         """
         self.message = message
         self.file_tasks = file_tasks
@@ -382,6 +711,14 @@ class BaseMetadataCreateTask(BaseTask):
         self.message_id = message_id
         self.object_id = object_id
         self.role = role
+        self.offload = offload
+        self.organisation_id = organisation_id
+        self.prefetch = prefetch
+        self.scratch = scratch or DEFAULT_SCRATCH.area(message_id)
+        self.memory_bundle_bytes = memory_bundle_bytes
+        self.zip_path = None
+        self.bundle_data = None
+        self.bundle = None
 
     @classmethod
     def build(cls, message, config):
@@ -395,7 +732,11 @@ class BaseMetadataCreateTask(BaseTask):
         role = require_organisation_role(message)
 
         upload_url = config.organisation_buckets.get(organisation_id)
-        if upload_url:
+        if config.dry_destination_dir:
+            destination_bucket = LocalBucket(
+                os.path.join(config.dry_destination_dir, organisation_id),
+            )
+        elif upload_url:
             session = boto3.Session()
             s3 = session.resource('s3')
             destination_bucket = s3.Bucket(upload_url.host)
@@ -434,9 +775,23 @@ class BaseMetadataCreateTask(BaseTask):
         if not isinstance(objects, list):
             raise MalformedBodyError('expected objectFile as list')
 
+        offload = get_backend(
+            config.offload_workers, config.offload_min_bytes,
+            config.parallel_deflate_threads, config.parallel_deflate_min_bytes,
+        )
+        compression = get_policy(config.compression_policy)
+        scratch = get_space(
+            config.scratch_dirs, config.scratch_small_dir,
+            config.scratch_small_file_bytes,
+        ).area(message_id)
         file_tasks = []
         for obj in objects:
-            file_tasks.append(cls.build_file_task(obj, message_id, object_id))
+            file_tasks.append(
+                cls.build_file_task(
+                    obj, message_id, object_id, offload, organisation_id,
+                    compression, config.file_size_limit, scratch,
+                ),
+            )
 
         return cls(
             message,
@@ -445,10 +800,29 @@ class BaseMetadataCreateTask(BaseTask):
             message_id,
             role,
             object_id,
+            offload=offload,
+            organisation_id=organisation_id,
+            prefetch=get_prefetcher(
+                config.download_workers, config.message_download_workers,
+            ),
+            scratch=scratch,
+            memory_bundle_bytes=config.memory_bundle_bytes,
+        )
+
+    @classmethod
+    def ledger_key(cls, message, config):
+        message_id = env_prefix_message_key(
+            message, 'messageHeader', 'messageId', config.environment,
         )
+        # bundle_name is the message id
+        return message_id, message_id
 
     @classmethod
-    def build_file_task(cls, object_file, message_id, object_id):
+    def build_file_task(
+        cls, object_file, message_id, object_id, offload=INLINE,
+        organisation_id=None, compression=CONTENT,
+        file_size_limit=FileTask.DEFAULT_FILE_SIZE_LIMIT, scratch=None,
+    ):
         try:
             url = object_file['fileStorageLocation']
             file_name = object_file['fileName']
@@ -457,6 +831,7 @@ class BaseMetadataCreateTask(BaseTask):
             storage_platform = object_file.get('fileStoragePlatform', {})
             storage_type = storage_platform.get('storagePlatformType', 2)
             file_checksum = object_file['fileChecksum']
+            declared_size = object_file.get('fileSize')
 
         except (TypeError, KeyError) as exception:
             raise MalformedBodyError(
@@ -485,55 +860,285 @@ class BaseMetadataCreateTask(BaseTask):
             message_id,
             object_id,
             file_checksum,
+            offload=offload,
+            declared_size=declared_size if isinstance(declared_size, int) else None,
+            organisation_id=organisation_id,
+            compression=compression,
+            file_size_limit=file_size_limit,
+            scratch=scratch,
         )
 
     def run(self):
-        zip_path = get_tmp_file()
+        """ Build bundle while uploading it
+
+        Every file is sized first, so oversize deposits are rejected before
+        any download. The first file streams into the bundle while the next
+        ones download to temporary files, or memory for small messages,
+        which are added in declared order. Files large enough for parallel
+        deflate or offload are fetched first, the first one included.
+        """
+        self.preflight()
+        if not self.UPLOAD_OVERRIDE:
+            self.require_not_uploaded(self.destination_bucket)
+
+        in_memory = self.in_memory()
+        upload = self.open_upload(self.destination_bucket)
         try:
-            # message level meta
-            self.bundle_meta(zip_path)
+            with BundleWriter(upload) as bundle:
+                f = bundle.zip_file
+                # message level meta
+                self.write_bundle_meta(f)
+
+                # per file data
+                with contextlib.closing(
+                    self.prefetch.ordered(
+                        self.file_tasks, stream_head=self.stream_head(),
+                        in_memory=in_memory,
+                    ),
+                ) as file_tasks:
+                    for task, fetched in file_tasks:
+                        if not fetched and task.should_stream():
+                            task.stream_bundle(f)
+                            continue
+                        try:
+                            if not fetched and in_memory:
+                                task.load()
+                            elif not fetched:
+                                task.fetch()
+                            task.add_fetched_to_bundle(f)
+                        finally:
+                            task.cleanup()
+
+            metadata = self.collect_meta(bundle)
+            metadata['md5chksum'] = upload.md5_checksum
+            upload.publish(metadata)
+        except Exception:
+            upload.abort()
+            raise
+        finally:
+            self.scratch.remove()
 
-            # per file data
-            for task in self.file_tasks:
-                task.run(zip_path)
+    def stream_head(self):
+        """ Check if run streams the first file rather than fetching it
+
+        :rtype: bool
+        """
+        return not self.file_tasks or self.file_tasks[0].should_stream()
+
+    def estimate_run_scratch_bytes(self, default_file_bytes):
+        """ Scratch disk run needs for files fetched ahead of the bundle
 
-            # target s3 upload
-            self.upload_bundle(
+        The first file streams unless the offload backend takes it, at most
+        one window of the prefetcher of the others is on disk at once.
+        Without prefetch, files the offload backend takes are fetched one at
+        a time. Small messages are fetched to memory.
+
+        :param int default_file_bytes: size assumed for files of unknown size
+        :rtype: int
+        :raise: UnderlyingSystemError if a file or the bundle is too big
+        """
+        sizes = self.preflight()
+        if self.in_memory():
+            return 0
+        if not self.prefetch.enabled:
+            return max(
+                (
+                    size for task, size in zip(self.file_tasks, sizes)
+                    if not task.should_stream()
+                ),
+                default=0,
+            )
+        if self.stream_head():
+            sizes = sizes[1:]
+        fetched = sorted(
+            (default_file_bytes if size is None else size for size in sizes),
+            reverse=True,
+        )
+        return sum(fetched[:self.prefetch.per_message])
+
+    def estimate_scratch_bytes(self, default_file_bytes):
+        """ Scratch disk the task needs while running in stages
+
+        :param int default_file_bytes: size assumed for files of unknown size
+        :rtype: int
+        :raise: UnderlyingSystemError if a file or the bundle is too big
+        """
+        total = 0
+        for size in self.preflight():
+            total += default_file_bytes if size is None else size
+        return total * self.SCRATCH_COPIES
+
+    def preflight(self):
+        """ Size every file before any is downloaded
+
+        Sizes not declared in the message are asked of the remotes, several
+        at once when files are prefetched.
+
+        :return: size of each file, None where unknown
+        :rtype: list of int
+        :raise: UnderlyingSystemError if a file or the bundle is too big
+        :raise: ResourceNotFoundError if a file is missing
+        """
+        with metrics.timer('preflight_seconds', organisation=self.organisation_id):
+            sizes = self.prefetch.map(FileTask.preflight, self.file_tasks)
+        total = sum(size for size in sizes if size is not None)
+        if total > MAX_OBJECT_BYTES:
+            raise UnderlyingSystemError(
+                'bundle of {} bytes exceeds S3 object size limit'.format(total),
+            )
+        return sizes
+
+    def in_memory(self):
+        """ Check if message is small enough to be bundled in memory
+
+        Only sizes declared or found by preflight count, messages with a
+        file of unknown size use scratch disk.
+
+        :rtype: bool
+        """
+        sizes = [task.known_size() for task in self.file_tasks]
+        return (
+            self.memory_bundle_bytes > 0 and None not in sizes and
+            sum(sizes) <= self.memory_bundle_bytes
+        )
+
+    def download_files(self):
+        """ Fetch every file of the message to temporary files, or to
+        memory for small messages
+        """
+        in_memory = self.in_memory()
+        with contextlib.closing(
+            self.prefetch.ordered(
+                self.file_tasks, stream_head=False, in_memory=in_memory,
+            ),
+        ) as file_tasks:
+            for task, fetched in file_tasks:
+                if not fetched and in_memory:
+                    task.load()
+                elif not fetched:
+                    task.prepare()
+
+    async def download_files_async(self, transfer_slots, http_session=None):
+        """ Fetch every file of the message concurrently
+
+        Waits for all transfers even if one fails, so none is left writing
+        after cleanup.
+
+        :param asyncio.Semaphore transfer_slots: limits concurrent transfers
+        :param aiohttp.ClientSession http_session: shared HTTP session
+        """
+        results = await asyncio.gather(
+            *[
+                task.prepare_async(transfer_slots, http_session)
+                for task in self.file_tasks
+            ],
+            return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+
+    def build_bundle(self):
+        """ Zip message meta and downloaded files, releasing downloads
+
+        Small messages are bundled in memory, others to scratch disk.
+        Sizes S3 metadata needs are counted while the zip is written.
+        """
+        if self.in_memory():
+            output = io.BytesIO()
+            self.bundle = self.write_bundle(output)
+            self.bundle_data = output.getvalue()
+            return
+
+        sizes = [task.known_size() for task in self.file_tasks]
+        self.zip_path = self.scratch.new_file(
+            None if None in sizes else sum(sizes),
+        )
+        with open(self.zip_path, 'wb') as output:
+            self.bundle = self.write_bundle(output)
+
+    def write_bundle(self, output):
+        """ Zip message meta and fetched files to output, releasing them
+
+        :param output: writable file object
+        :return: closed writer with bundle totals
+        :rtype: preservicaservice.bundle.BundleWriter
+        """
+        with BundleWriter(output) as bundle:
+            self.write_bundle_meta(bundle.zip_file)
+            for task in self.file_tasks:
+                task.add_fetched_to_bundle(bundle.zip_file)
+                task.cleanup()
+        return bundle
+
+    def upload(self):
+        """ Upload built bundle to destination bucket """
+        metadata = self.collect_meta(self.bundle)
+        if self.bundle_data is not None:
+            self.upload_stream(
                 self.destination_bucket,
-                zip_path,
-                self.collect_meta(zip_path),
+                io.BytesIO(self.bundle_data),
+                metadata,
                 self.UPLOAD_OVERRIDE,
             )
-        finally:
-            if os.path.exists(zip_path):
-                os.unlink(zip_path)
+            return
+        self.upload_bundle(
+            self.destination_bucket,
+            self.zip_path,
+            metadata,
+            self.UPLOAD_OVERRIDE,
+        )
 
-    def bundle_meta(self, zip_path):
-        """ Generate root metadata file for given message
+    def cleanup(self):
+        """ Remove any temporary files left by the task """
+        for task in self.file_tasks:
+            task.cleanup()
+        if self.zip_path:
+            self.scratch.remove_file(self.zip_path)
+        self.zip_path = None
+        self.bundle = None
+        self.bundle_data = None
+        self.scratch.remove()
+
+    def write_bundle_meta(self, zip_file):
+        """ Add root metadata file for given message
+
+        :param zipfile.ZipFile zip_file: archive open for writing
+        """
+        zip_file.writestr(
+            member_info('{0}/{0}.metadata'.format(self.object_id)),
+            message_meta(self.message),
+        )
 
-        :param str zip_path: target zip file
+    def open_upload(self, destination_bucket):
+        """ Writable stream to bundle object
+
+        :param destination_bucket: target s3 bucket or LocalBucket
+        :rtype: preservicaservice.multipart.StreamingUpload
         """
-        with tempfile.NamedTemporaryFile() as tmp_file:
-            meta_path = tmp_file.name
-            write_message_meta(meta_path, self.message)
+        if isinstance(destination_bucket, LocalBucket):
+            return destination_bucket.open_upload(self.bundle_name)
+        return StreamingUpload(
+            destination_bucket,
+            self.bundle_name,
+            labels={'organisation': self.organisation_id},
+        )
 
-            with zipfile.ZipFile(
-                zip_path, 'a', compression=zipfile.ZIP_DEFLATED,
-            ) as f:
-                f.write(
-                    meta_path,
-                    '{0}/{0}.metadata'.format(self.object_id),
-                )
+    def require_not_uploaded(self, destination_bucket):
+        """ Fail if bundle is already in destination
 
-    def _generate_md5_checksum(self, file_path, buf_size=4096):
-        """ Generates a MD5 checksum for inclusion in the upload to s3.
-            Uses an iterator over file contents for consistent memory usage.
-            """
-        md5_checksum = hashlib.md5()
-        with open(file_path, 'rb') as f_in:
-            for file_chunk in iter(lambda: f_in.read(buf_size), b''):
-                md5_checksum.update(file_chunk)
-        return base64.b64encode(md5_checksum.digest()).decode('utf-8')
+        :param destination_bucket: target s3 bucket
+        :raise: ResourceAlreadyExistsError if it is
+        """
+        with metrics.timer(
+            'exists_check_seconds', organisation=self.organisation_id,
+        ):
+            exists = list(
+                destination_bucket.objects.filter(Prefix=self.bundle_name),
+            )
+        if exists:
+            # TODO: clarify exception
+            raise ResourceAlreadyExistsError('object already exists is s3')
 
     def upload_bundle(self, destination_bucket, zip_path, metadata, override):
         """ Upload given zip to target
@@ -545,44 +1150,57 @@ class BaseMetadataCreateTask(BaseTask):
         :param bool override: don't fail if file exists
         :return:
         """
-        md5_checksum = self._generate_md5_checksum(zip_path)
-        metadata['md5chksum'] = md5_checksum
+        with open(zip_path, 'rb') as data:
+            self.upload_stream(destination_bucket, data, metadata, override)
 
+    def upload_stream(self, destination_bucket, data, metadata, override):
+        """ Upload bundle read from given file object
+
+        :param destination_bucket: target s3 bucket
+        :type destination_bucket: boto3.S3.Bucket
+        :param data: readable file object with the bundle
+        :param dict metadata: metadata to set on s3 object
+        :param bool override: don't fail if file exists
+        """
         if not override:
-            if list(destination_bucket.objects.filter(Prefix=self.bundle_name)):
-                # TODO: clarify exception
-                raise ResourceAlreadyExistsError('object already exists is s3')
+            self.require_not_uploaded(destination_bucket)
 
-        with open(zip_path, 'rb') as data:
-            destination_bucket.put_object(
-                Body=data,
-                Key=self.bundle_name,
-                ContentMD5=md5_checksum,
-                Metadata=metadata,
-            )
+        upload = self.open_upload(destination_bucket)
+        try:
+            shutil.copyfileobj(data, upload, STREAM_CHUNK_SIZE)
+            metadata['md5chksum'] = upload.md5_checksum
+            upload.publish(metadata)
+        except Exception:
+            upload.abort()
+            raise
 
     @property
     def bundle_name(self):
         return self.message_id
 
-    def collect_meta(self, zip_file_path):
+    def collect_meta(self, bundle):
         """ S3 object metadata
 
-        :param zip_file_path:
+        :param preservicaservice.bundle.BundleWriter bundle: closed writer
+            of the bundle
         :rtype: dict of (str, str)
         """
-        size_uncompressed = 0
-        with zipfile.ZipFile(zip_file_path) as f:
-            for info in f.infolist():
-                size_uncompressed += info.file_size
+        return self.object_metadata(bundle.size, bundle.size_uncompressed)
+
+    def object_metadata(self, size, size_uncompressed):
+        """ S3 object metadata of bundle with given sizes
 
+        :param int size: bundle size
+        :param int size_uncompressed: total size of bundle members
+        :rtype: dict of (str, str)
+        """
         # make sure all values are strings
         return {
             'key': self.message_id,
             'bucket': self.destination_bucket.name,
             'status': 'ready',
             'name': '{}.zip'.format(self.bundle_name),
-            'size': str(os.stat(zip_file_path).st_size),
+            'size': str(size),
             'size_uncompressed': str(size_uncompressed),
             'createddate': datetime.datetime.now().isoformat(),
             'createdby': self.role,
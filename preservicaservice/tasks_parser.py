@@ -3,7 +3,9 @@ import binascii
 import json
 import logging
 
+from . import metrics
 from .errors import (
+    BaseError,
     MalformedJsonBodyError,
     MalformedHeaderError,
     UnsupportedMessageTypeError
@@ -24,8 +26,9 @@ def decode_record(record):
     :raise: preservicaservice.errors.MalformedJsonBodyError
     """
     try:
-        value = base64.b64decode(record.data)
-        message = json.loads(value.decode('utf-8'))
+        with metrics.timer('decode_seconds'):
+            value = base64.b64decode(record.data)
+            message = json.loads(value.decode('utf-8'))
     except (TypeError, ValueError, binascii.Error):
         raise MalformedJsonBodyError()
 
@@ -74,7 +77,37 @@ def record_to_task(record, config):
     """
     message = decode_record(record)
     logger.debug('received message %s', message)
+    return message_to_task(message, config)
+
+
+def message_to_task(message, config):
+    """ Build task out of decoded message
+
+    :param dict message: raw data
+    :param preservicaservice.Config config: job config
+    :raise: preservicaservice.errors.MalformedJsonBodyError
+    :raise: preservicaservice.errors.UnsupportedMessageTypeError
+    :raise: preservicaservice.errors.MalformedHeaderError
+    :rtype: preservicaservice.tasks.BaseTask
+    """
     try:
         return create_supported_tasks(message, config)
     except ValueError as e:
         raise MalformedJsonBodyError(str(e))
+
+
+def ledger_key(message, config):
+    """ Ingest ledger key of message if it can be determined
+
+    Invalid messages give None and are left to fail when built.
+
+    :param dict message: raw data
+    :param preservicaservice.Config config: job config
+    :return: (message id, bundle name) or None
+    :rtype: tuple of (str, str)
+    """
+    try:
+        message_type = message['messageHeader']['messageType'].strip()
+        return TYPE_TO_TASKS[message_type].ledger_key(message, config)
+    except (TypeError, KeyError, AttributeError, BaseError):
+        return None
@@ -0,0 +1,268 @@
+import functools
+import io
+import os
+import shutil
+import struct
+import time
+import zipfile
+import zlib
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def zipinfo_for_file(path, arcname, compress_type=zipfile.ZIP_DEFLATED):
+    """ Build archive member info from local file attributes
+
+    :param str path: local file
+    :param str arcname: name inside archive
+    :param int compress_type: zipfile compression constant
+    :rtype: zipfile.ZipInfo
+    """
+    st = os.stat(path)
+    zinfo = zipfile.ZipInfo(arcname, time.localtime(st.st_mtime)[0:6])
+    zinfo.external_attr = (st.st_mode & 0xFFFF) << 16
+    zinfo.compress_type = compress_type
+    zinfo.file_size = st.st_size
+    return zinfo
+
+
+def needs_zip64(size):
+    """ Check if member of given size needs Zip64 sizes, as zipfile does
+
+    :param int size: expected member size, None if unknown
+    :rtype: bool
+    """
+    return size is None or size * 1.05 > zipfile.ZIP64_LIMIT
+
+
+def write_raw_member(zip_file, zinfo, raw_file):
+    """ Append already compressed data as a new archive member.
+
+    zipfile can only compress data itself, this writes the local header
+    and the given bytes as is, so compression can happen elsewhere.
+
+    :param zipfile.ZipFile zip_file: archive open for writing
+    :param zipfile.ZipInfo zinfo: member info with compress_type, CRC,
+        compress_size and file_size set
+    :param raw_file: file object with compressed member data
+    :raise: zipfile.LargeZipFile if zip64 needed but not allowed
+    """
+    zip64 = (
+        zinfo.file_size > zipfile.ZIP64_LIMIT or
+        zinfo.compress_size > zipfile.ZIP64_LIMIT
+    )
+    if zip64 and not zip_file._allowZip64:
+        raise zipfile.LargeZipFile('Filesize would require ZIP64 extensions')
+    # sizes are known up front, no data descriptor follows the data
+    zinfo.flag_bits &= ~0x08
+
+    with zip_file._lock:
+        if getattr(zip_file, '_writing', False):
+            raise ValueError(
+                "Can't write to ZIP archive while an open writing handle "
+                'exists',
+            )
+        if zip_file._seekable:
+            zip_file.fp.seek(zip_file.start_dir)
+        zinfo.header_offset = zip_file.fp.tell()
+        zip_file._writecheck(zinfo)
+        zip_file._didModify = True
+        zip_file.fp.write(zinfo.FileHeader(zip64))
+        shutil.copyfileobj(raw_file, zip_file.fp, COPY_CHUNK_SIZE)
+        zip_file.filelist.append(zinfo)
+        zip_file.NameToInfo[zinfo.filename] = zinfo
+        zip_file.start_dir = zip_file.fp.tell()
+
+
+class DeflatedMemberWriter:
+    """
+    Writable archive member deflated with a given zlib level.
+
+    ZipFile.open only takes a compression level from Python 3.7. This
+    compresses with zlib itself and writes the local header, the data and
+    a data descriptor with CRC and sizes, as zipfile does when streaming.
+    Level 0 copies the data.
+    """
+
+    def __init__(self, zip_file, zinfo, level, force_zip64=False):
+        """
+        :param zipfile.ZipFile zip_file: archive open for writing
+        :param zipfile.ZipInfo zinfo: member info, file_size may hold the
+            expected size
+        :param int level: zlib compression level
+        :param bool force_zip64: use Zip64 sizes whatever the expected size
+        :raise: zipfile.LargeZipFile if zip64 needed but not allowed
+        """
+        self.zip_file = zip_file
+        self.zinfo = zinfo
+        self.zip64 = force_zip64 or zinfo.file_size * 1.05 > zipfile.ZIP64_LIMIT
+        if self.zip64 and not zip_file._allowZip64:
+            raise zipfile.LargeZipFile('Filesize would require ZIP64 extensions')
+        zinfo.compress_type = zipfile.ZIP_DEFLATED
+        # sizes are only known after the data
+        zinfo.flag_bits |= 0x08
+        zinfo.CRC = 0
+        zinfo.compress_size = 0
+        zinfo.file_size = 0
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        self.closed = False
+
+        with zip_file._lock:
+            if getattr(zip_file, '_writing', False):
+                raise ValueError(
+                    "Can't write to ZIP archive while an open writing handle "
+                    'exists',
+                )
+            if zip_file._seekable:
+                zip_file.fp.seek(zip_file.start_dir)
+            zinfo.header_offset = zip_file.fp.tell()
+            zip_file._writecheck(zinfo)
+            zip_file._didModify = True
+            zip_file.fp.write(zinfo.FileHeader(self.zip64))
+            zip_file._writing = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, data):
+        self.zinfo.file_size += len(data)
+        self.zinfo.CRC = zlib.crc32(data, self.zinfo.CRC)
+        self._write_raw(self.compressor.compress(data))
+        return len(data)
+
+    def _write_raw(self, data):
+        self.zinfo.compress_size += len(data)
+        self.zip_file.fp.write(data)
+
+    def close(self):
+        """ Finish member, writing its data descriptor
+
+        :raise: RuntimeError if member outgrew sizes without zip64
+        """
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self._write_raw(self.compressor.flush())
+            zinfo = self.zinfo
+            if not self.zip64 and (
+                zinfo.file_size > zipfile.ZIP64_LIMIT or
+                zinfo.compress_size > zipfile.ZIP64_LIMIT
+            ):
+                raise RuntimeError('File size too large, try using force_zip64')
+            self.zip_file.fp.write(struct.pack(
+                '<LLQQ' if self.zip64 else '<LLLL',
+                0x08074b50, zinfo.CRC, zinfo.compress_size, zinfo.file_size,
+            ))
+            self.zip_file.start_dir = self.zip_file.fp.tell()
+            self.zip_file.filelist.append(zinfo)
+            self.zip_file.NameToInfo[zinfo.filename] = zinfo
+        finally:
+            self.zip_file._writing = False
+
+
+def write_member(zip_file, zinfo, data, compress_type, level):
+    """ Add member with data in memory, sizes and CRC in its header
+
+    :param zipfile.ZipFile zip_file: archive open for writing
+    :param zipfile.ZipInfo zinfo: member info
+    :param bytes data: member data
+    :param int compress_type: ZIP_DEFLATED or ZIP_STORED
+    :param int level: zlib compression level of deflated members
+    """
+    zinfo.compress_type = compress_type
+    zinfo.file_size = len(data)
+    zinfo.CRC = zlib.crc32(data)
+    if compress_type == zipfile.ZIP_DEFLATED:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        data = compressor.compress(data) + compressor.flush()
+    zinfo.compress_size = len(data)
+    write_raw_member(zip_file, zinfo, io.BytesIO(data))
+
+
+def file_crc(path, chunk_size=COPY_CHUNK_SIZE):
+    """ CRC-32 of file as stored in archive member info
+
+    :param str path: file to read
+    :rtype: int
+    """
+    crc = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+
+def store_file(zip_file, path, arcname):
+    """ Add file to archive uncompressed, sizes and CRC in its header
+
+    Unlike ZipFile.write on unseekable archives no data descriptor follows,
+    which some readers refuse after stored data.
+
+    :param zipfile.ZipFile zip_file: archive open for writing
+    :param str path: file to add
+    :param str arcname: name inside archive
+    """
+    zinfo = zipinfo_for_file(path, arcname, zipfile.ZIP_STORED)
+    zinfo.CRC = file_crc(path)
+    zinfo.compress_size = zinfo.file_size
+    with open(path, 'rb') as raw:
+        write_raw_member(zip_file, zinfo, raw)
+
+
+def _gf2_matrix_times(matrix, vector):
+    total = 0
+    i = 0
+    while vector:
+        if vector & 1:
+            total ^= matrix[i]
+        vector >>= 1
+        i += 1
+    return total
+
+
+def _gf2_matrix_square(matrix):
+    return [_gf2_matrix_times(matrix, row) for row in matrix]
+
+
+@functools.lru_cache(maxsize=64)
+def _zeros_operator(length):
+    """ Matrix moving a CRC-32 past length zero bytes, as in zlib
+
+    :param int length: bytes, at least 1
+    :rtype: list of int
+    """
+    # one zero bit, squared up to one zero byte
+    operator = [0xEDB88320] + [1 << n for n in range(31)]
+    for _ in range(3):
+        operator = _gf2_matrix_square(operator)
+
+    result = None
+    while length:
+        if length & 1:
+            result = operator if result is None else [
+                _gf2_matrix_times(operator, row) for row in result
+            ]
+        length >>= 1
+        if length:
+            operator = _gf2_matrix_square(operator)
+    return result
+
+
+def crc32_combine(crc1, crc2, len2):
+    """ CRC-32 of two blocks joined, from the CRC-32 of each
+
+    Blocks of the same length share the operator, which is cached, so
+    combining is cheap for fixed size blocks.
+
+    :param int crc1: CRC-32 of first block
+    :param int crc2: CRC-32 of second block
+    :param int len2: length of second block
+    :rtype: int
+    """
+    if not len2:
+        return crc1
+    return _gf2_matrix_times(_zeros_operator(len2), crc1) ^ crc2
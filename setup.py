@@ -10,6 +10,9 @@ setup(
         'dicttoxml',
         'lxml',
     ],
+    extras_require={
+        'asyncio': ['aiohttp'],
+    },
     tests_require=[
         'autopep8',
         'pep8',
@@ -23,9 +26,11 @@ setup(
     entry_points={
         'console_scripts': [
             'preservicaservice = preservicaservice.preservicaservice:main',
+            'preservicaservice-replay = preservicaservice.replay:main',
         ],
     },
     include_package_data=True,
+    python_requires='>=3.6',
     classifiers=[
         'Development Status :: 5 - Production/Stable',
         'Natural Language :: English',
@@ -33,6 +38,6 @@ setup(
         'Operating System :: OS Independent',
         'Programming Language :: Python',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.5',
+        'Programming Language :: Python :: 3.6',
     ],
 )
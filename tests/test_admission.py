@@ -0,0 +1,53 @@
+import threading
+
+import pytest
+
+from preservicaservice import admission
+from preservicaservice.errors import UnderlyingSystemError
+
+
+@pytest.fixture
+def controller(tmpdir):
+    yield admission.AdmissionController(100, str(tmpdir), 0, 0.01)
+
+
+def test_reserve_within_budget(controller):
+    assert controller.try_reserve(60)
+    assert controller.try_reserve(40)
+    assert not controller.try_reserve(1)
+
+    controller.release(40)
+    assert controller.try_reserve(1)
+    assert controller.in_flight_bytes == 61
+    assert controller.in_flight_count == 2
+
+
+def test_oversized_admitted_alone(controller):
+    assert controller.try_reserve(500)
+    assert not controller.try_reserve(1)
+    controller.release(500)
+    assert controller.in_flight_count == 0
+
+
+def test_reserve_waits_for_release(controller):
+    controller.reserve(100)
+    admitted = threading.Event()
+
+    def reserve():
+        with controller.admitted(50):
+            admitted.set()
+
+    thread = threading.Thread(target=reserve)
+    thread.start()
+    assert not admitted.wait(0.05)
+    controller.release(100)
+    thread.join(1)
+    assert admitted.is_set()
+    assert controller.in_flight_bytes == 0
+
+
+def test_not_enough_disk(tmpdir):
+    controller = admission.AdmissionController(100, str(tmpdir), 0)
+    free = controller.free_disk_bytes()
+    with pytest.raises(UnderlyingSystemError):
+        controller.try_reserve(free + 1)
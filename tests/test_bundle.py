@@ -0,0 +1,35 @@
+import io
+import zipfile
+
+import pytest
+
+from preservicaservice.bundle import BundleWriter
+
+
+def test_totals_counted_on_close():
+    output = io.BytesIO()
+    with BundleWriter(output) as bundle:
+        bundle.zip_file.writestr('foo', 'x' * 1000)
+        bundle.zip_file.writestr('bar', 'y' * 10)
+
+    assert bundle.closed
+    assert bundle.size == len(output.getvalue())
+    assert bundle.size_uncompressed == 1010
+    with zipfile.ZipFile(output) as f:
+        assert f.read('bar') == b'y' * 10
+
+
+def test_bundle_discarded_on_error():
+    output = io.BytesIO()
+    with pytest.raises(ValueError):
+        with BundleWriter(output) as bundle:
+            bundle.zip_file.writestr('foo', 'x' * 1000)
+            raise ValueError('download failed')
+
+    written = len(output.getvalue())
+    assert bundle.closed
+    assert bundle.size_uncompressed == 0
+    # no central directory now or once the zip file is collected
+    bundle.zip_file.close()
+    assert len(output.getvalue()) == written
+    assert not zipfile.is_zipfile(output)
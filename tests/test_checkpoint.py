@@ -0,0 +1,128 @@
+from collections import namedtuple
+
+import mock
+import pytest
+from amazon_kclpy import kcl
+
+from preservicaservice import checkpoint
+
+Record = namedtuple('Record', 'sequence_number')
+
+
+class FakeCheckpointer:
+    def __init__(self, errors=()):
+        self.errors = list(errors)
+        self.calls = []
+
+    def checkpoint(self, sequence_number=None):
+        self.calls.append(sequence_number)
+        if self.errors:
+            raise kcl.CheckpointError(self.errors.pop(0))
+
+
+def test_tracker_advances_only_when_contiguous():
+    tracker = checkpoint.SequenceTracker()
+    for seq in ('1', '2', '3'):
+        tracker.started(seq)
+
+    tracker.completed('2')
+    assert tracker.safe_sequence_number is None
+
+    tracker.completed('1')
+    assert tracker.safe_sequence_number == '2'
+
+    tracker.completed('3')
+    assert tracker.safe_sequence_number == '3'
+    assert tracker.in_flight_count == 0
+
+
+def test_tracker_ignores_unknown():
+    tracker = checkpoint.SequenceTracker()
+    tracker.completed('1')
+    assert tracker.safe_sequence_number is None
+    assert tracker.completed_count == 0
+
+
+def test_checkpoint_every_records():
+    checkpointer = FakeCheckpointer()
+    batch = checkpoint.BatchCheckpointer(2, 1000)
+    records = [Record(str(i)) for i in range(1, 5)]
+    for record in records:
+        batch.started(record)
+
+    for record in records:
+        batch.completed(record)
+        batch.maybe_checkpoint(checkpointer)
+
+    assert checkpointer.calls == ['2', '4']
+
+
+def test_checkpoint_out_of_order():
+    checkpointer = FakeCheckpointer()
+    batch = checkpoint.BatchCheckpointer(1, 1000)
+    records = [Record(str(i)) for i in range(1, 4)]
+    for record in records:
+        batch.started(record)
+
+    for record in (records[2], records[1], records[0]):
+        batch.completed(record)
+        batch.maybe_checkpoint(checkpointer)
+
+    assert checkpointer.calls == ['3']
+
+
+def test_checkpoint_every_seconds():
+    checkpointer = FakeCheckpointer()
+    batch = checkpoint.BatchCheckpointer(1000, 10)
+    record = Record('1')
+    batch.started(record)
+    batch.completed(record)
+
+    batch.maybe_checkpoint(checkpointer)
+    assert checkpointer.calls == []
+
+    batch.last_time -= 11
+    batch.maybe_checkpoint(checkpointer)
+    assert checkpointer.calls == ['1']
+
+
+def test_records_without_sequence_number_ignored():
+    class FakeRecord():
+        data = ''
+
+    batch = checkpoint.BatchCheckpointer(1, 1)
+    batch.started(FakeRecord())
+    batch.completed(FakeRecord())
+    assert batch.tracker.in_flight_count == 0
+
+
+@mock.patch('time.sleep')
+def test_checkpoint_retries_throttling(sleep):
+    checkpointer = FakeCheckpointer(['ThrottlingException'])
+    batch = checkpoint.BatchCheckpointer(1, 1)
+    assert batch.checkpoint(checkpointer, '1')
+    assert checkpointer.calls == ['1', '1']
+    assert sleep.call_count == 1
+
+
+@mock.patch('time.sleep')
+def test_checkpoint_gives_up(sleep):
+    checkpointer = FakeCheckpointer(['ThrottlingException'] * 3)
+    batch = checkpoint.BatchCheckpointer(1, 1, number_of_tries=3)
+    assert not batch.checkpoint(checkpointer, '1')
+    assert len(checkpointer.calls) == 3
+
+
+@pytest.mark.parametrize(
+    'error', [
+        'ShutdownException',
+        'InvalidStateException',
+    ],
+)
+@mock.patch('time.sleep')
+def test_checkpoint_stops_on(sleep, error):
+    checkpointer = FakeCheckpointer([error])
+    batch = checkpoint.BatchCheckpointer(1, 1)
+    assert not batch.checkpoint(checkpointer, '1')
+    assert checkpointer.calls == ['1']
+    assert not sleep.called
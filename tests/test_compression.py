@@ -0,0 +1,112 @@
+import io
+import os
+import struct
+import zipfile
+import zlib
+
+import pytest
+
+from preservicaservice import compression, metrics
+
+
+@pytest.fixture
+def policy():
+    return compression.ContentPolicy()
+
+
+@pytest.mark.parametrize(
+    'name, head, compress_type, rule', [
+        ('scan.JPG', b'', zipfile.ZIP_STORED, 'extension'),
+        ('data.csv', os.urandom(100), zipfile.ZIP_DEFLATED, 'extension'),
+        ('archive', b'PK\x03\x04' + b'\x00' * 100, zipfile.ZIP_STORED, 'magic'),
+        ('video', b'\x00\x00\x00\x18ftypmp42', zipfile.ZIP_STORED, 'magic'),
+        ('noise.bin', os.urandom(10000), zipfile.ZIP_STORED, 'trial'),
+        ('report.pdf', b'%PDF-1.4 ' * 1000, zipfile.ZIP_DEFLATED, 'trial'),
+    ],
+)
+def test_choose(policy, name, head, compress_type, rule):
+    decision = policy.choose(name, head)
+    assert decision.compress_type == compress_type
+    assert decision.policy == rule
+
+
+def test_trial_picks_fast_level_for_marginal_gain(policy):
+    # mostly random, deflate shrinks it by about a tenth
+    sample = os.urandom(9000) + b'a' * 1000
+    decision = policy.choose('mixed.bin', sample)
+    assert decision == (zipfile.ZIP_DEFLATED, compression.FAST_LEVEL, 'trial')
+
+
+def test_deflate_policy_deflates_everything():
+    decision = compression.DEFLATE.choose('scan.jpg', b'\xff\xd8\xff')
+    assert decision.compress_type == zipfile.ZIP_DEFLATED
+
+
+def raw_member(data, info):
+    """ Compressed bytes of member as stored in archive """
+    name_length, extra_length = struct.unpack(
+        '<HH', data[info.header_offset + 26:info.header_offset + 30],
+    )
+    start = info.header_offset + 30 + name_length + extra_length
+    return data[start:start + info.compress_size]
+
+
+def deflated(data, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush()
+
+
+@pytest.mark.parametrize(
+    'decision, level', [
+        (compression.Decision(zipfile.ZIP_STORED, 0, 'extension'), 0),
+        (compression.Decision(zipfile.ZIP_DEFLATED, compression.FAST_LEVEL, 'trial'), 1),
+        (compression.Decision(zipfile.ZIP_DEFLATED, compression.DEFAULT_LEVEL, 'trial'), 6),
+    ],
+)
+def test_member_written_with_decided_level(decision, level):
+    data = b''.join(str(i).encode('ascii') for i in range(20000))
+    output = io.BytesIO()
+    with zipfile.ZipFile(output, 'w') as f:
+        with decision.open(f, zipfile.ZipInfo('streamed')) as member:
+            member.write(data[:1000])
+            member.write(data[1000:])
+        decision.write(f, zipfile.ZipInfo('in-memory'), data)
+
+    archive = output.getvalue()
+    with zipfile.ZipFile(io.BytesIO(archive)) as f:
+        streamed = f.getinfo('streamed')
+        assert streamed.compress_type == zipfile.ZIP_DEFLATED
+        assert raw_member(archive, streamed) == deflated(data, level)
+        assert f.read('streamed') == data
+
+        in_memory = f.getinfo('in-memory')
+        assert in_memory.compress_type == decision.compress_type
+        if decision.stored:
+            assert in_memory.compress_size == len(data)
+        else:
+            assert raw_member(archive, in_memory) == deflated(data, level)
+        assert f.read('in-memory') == data
+
+
+def test_record_counts_savings(tmpdir, policy):
+    sink = metrics.PrometheusSink('Test', str(tmpdir.join('adaptor.prom')))
+    registry = metrics.configure(sink)
+    try:
+        policy.record(
+            compression.Decision(zipfile.ZIP_STORED, 0, 'magic'), 1000, 1000,
+        )
+        policy.record(
+            compression.Decision(zipfile.ZIP_DEFLATED, 6, 'trial'), 1000, 300,
+        )
+        registry.flush()
+    finally:
+        metrics.configure(metrics.NullSink())
+
+    with open(sink.path) as f:
+        lines = f.read().replace(',pid="{}"'.format(sink.pid), '').splitlines()
+    assert 'test_compression_stored_bytes_total{policy="magic"} 1000' in lines
+    assert 'test_compression_saved_bytes_total{policy="trial"} 700' in lines
+    assert any(
+        line.startswith('test_compression_cpu_saved_seconds_total{policy="magic"}')
+        for line in lines
+    )
@@ -74,6 +74,7 @@ def test_valid_config(valid_config_arguments):
     assert len(c.organisation_buckets) == 2
     assert c.organisation_buckets['1'].url == arguments['organisation_buckets']['1']
     assert c.organisation_buckets['2'].url == arguments['organisation_buckets']['2']
+    assert c.record_workers == config.DEFAULT_RECORD_WORKERS
 
 
 @pytest.mark.parametrize(
@@ -87,6 +88,27 @@ def test_valid_config(valid_config_arguments):
         (dict(input_stream_name='ßßß'), 'input_stream_name'),
         (dict(adaptor_aws_region='eu-north-2'), 'adaptor_aws_region'),
         (dict(error_stream_name='-3'), 'error_stream_name'),
+        (dict(record_workers=0), 'record_workers'),
+        (dict(record_workers='2'), 'record_workers'),
+        (dict(engine='fibers'), 'engine'),
+        (dict(pipeline_download_workers=0), 'pipeline_download_workers'),
+        (dict(offload_workers=-1), 'offload_workers'),
+        (dict(parallel_deflate_threads=-1), 'parallel_deflate_threads'),
+        (dict(message_download_workers=0), 'message_download_workers'),
+        (dict(compression_policy='lzma'), 'compression_policy'),
+        (dict(file_size_limit=0), 'file_size_limit'),
+        (dict(scratch_dirs='/tmp'), 'scratch_dirs'),
+        (dict(scratch_dirs=[]), 'scratch_dirs'),
+        (dict(scratch_small_file_bytes=-1), 'scratch_small_file_bytes'),
+        (dict(memory_bundle_bytes=-1), 'memory_bundle_bytes'),
+        (dict(admission_budget_bytes=0), 'admission_budget_bytes'),
+        (dict(record_order='random'), 'record_order'),
+        (dict(admission_min_free_bytes=-1), 'admission_min_free_bytes'),
+        (dict(metrics_sink='statsd'), 'metrics_sink'),
+        (dict(metrics_sink='prometheus'), 'metrics_path'),
+        (dict(metrics_flush_seconds=0), 'metrics_flush_seconds'),
+        (dict(profile_signal='SIGKILL'), 'profile_signal'),
+        (dict(profile_record_fraction=1.5), 'profile_record_fraction'),
     ],
 )
 def test_config_validation(valid_config_arguments, arguments, error):
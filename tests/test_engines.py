@@ -0,0 +1,32 @@
+import logging
+
+from preservicaservice import engines
+
+
+class FakeRecord:
+    def __init__(self, sequence_number):
+        self.sequence_number = sequence_number
+
+
+class FakeProcessor:
+    class config:
+        record_workers = 2
+
+    def process_record(self, index, record):
+        if record.sequence_number == '2':
+            raise RuntimeError('boom')
+
+
+def test_thread_pool_logs_unhandled_record_failure(caplog):
+    engine = engines.ThreadPoolEngine(FakeProcessor())
+    records = [FakeRecord(str(i)) for i in range(3)]
+    completed = []
+    try:
+        with caplog.at_level(logging.ERROR, logger=engines.__name__):
+            engine.process_batch(records, completed.append)
+    finally:
+        engine.shutdown()
+
+    assert sorted(completed, key=lambda r: r.sequence_number) == records
+    assert 'record 2 failed unhandled' in caplog.text
+    assert 'boom' in caplog.text
@@ -0,0 +1,35 @@
+import os
+
+from preservicaservice import ledger
+
+
+def test_record_and_contains(temp_file):
+    store = ledger.IngestLedger(temp_file)
+    assert not store.contains('message', 'bundle')
+
+    store.record('message', 'bundle')
+    store.record('message', 'bundle')
+
+    assert store.contains('message', 'bundle')
+    assert not store.contains('message', 'other')
+    store.close()
+
+
+def test_survives_reopen(temp_file):
+    store = ledger.IngestLedger(temp_file)
+    store.record('message', 'bundle')
+    store.close()
+
+    assert ledger.IngestLedger(temp_file).contains('message', 'bundle')
+
+
+def test_creates_directory(tmpdir):
+    path = os.path.join(str(tmpdir), 'nested', 'ledger.sqlite3')
+    ledger.IngestLedger(path).record('message', 'bundle')
+    assert os.path.exists(path)
+
+
+def test_open_ledger_without_path():
+    store = ledger.open_ledger(None)
+    store.record('message', 'bundle')
+    assert not store.contains('message', 'bundle')
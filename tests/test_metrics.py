@@ -0,0 +1,98 @@
+import json
+import os
+
+from preservicaservice import metrics
+
+
+def test_null_sink_records_nothing():
+    registry = metrics.Registry()
+    with registry.timer('zip_seconds', organisation='org'):
+        pass
+    registry.increment('zip_bytes', 10)
+    registry.flush()
+    assert not registry.histograms
+    assert not registry.counters
+
+
+def test_timer_labels_set_in_block(tmpdir):
+    path = str(tmpdir.join('metrics.jsonl'))
+    registry = metrics.Registry(metrics.EmfSink('Test', path))
+    with registry.timer('task_build_seconds') as timer:
+        timer.labels['organisation'] = None
+    registry.increment('download_bytes', 5, organisation='org', storage_platform='s3')
+    registry.increment('download_bytes', 7, organisation='org', storage_platform='s3')
+    registry.flush()
+
+    with open(path) as f:
+        lines = [json.loads(line) for line in f]
+    assert len(lines) == 2
+    timing, downloaded = lines
+    assert timing['organisation'] == 'unknown'
+    assert len(timing['task_build_seconds']) == 1
+    definition = timing['_aws']['CloudWatchMetrics'][0]
+    assert definition['Namespace'] == 'Test'
+    assert definition['Dimensions'] == [['organisation']]
+    assert definition['Metrics'] == [
+        {'Name': 'task_build_seconds', 'Unit': 'Seconds'},
+    ]
+    assert downloaded['download_bytes'] == 12
+    assert downloaded['storage_platform'] == 's3'
+
+    # values are only written once
+    registry.flush()
+    with open(path) as f:
+        assert len(f.readlines()) == 2
+
+
+def test_prometheus_sink(tmpdir):
+    sink = metrics.PrometheusSink('PreservicaAdaptor', str(tmpdir.join('adaptor.prom')))
+    registry = metrics.Registry(sink)
+    registry.observe('download_seconds', 0.2, organisation='a')
+    registry.increment('upload_bytes', 100, organisation='a')
+    registry.observe('download_seconds', 700, organisation='b')
+    registry.gauge('scratch_bytes', 5, root='/tmp')
+    registry.gauge('scratch_bytes', 3, root='/tmp')
+    registry.flush()
+    registry.flush()
+
+    pid = os.getpid()
+    assert sink.path == str(tmpdir.join('adaptor.{}.prom'.format(pid)))
+    with open(sink.path) as f:
+        lines = f.read().replace('pid="{}"'.format(pid), 'pid="PID"').splitlines()
+    assert lines.count('# TYPE preservicaadaptor_download_seconds histogram') == 1
+    assert (
+        'preservicaadaptor_download_seconds_bucket'
+        '{organisation="a",pid="PID",le="0.25"} 1'
+    ) in lines
+    assert (
+        'preservicaadaptor_download_seconds_bucket'
+        '{organisation="b",pid="PID",le="600.0"} 0'
+    ) in lines
+    assert (
+        'preservicaadaptor_download_seconds_bucket'
+        '{organisation="b",pid="PID",le="+Inf"} 1'
+    ) in lines
+    assert (
+        'preservicaadaptor_download_seconds_count{organisation="a",pid="PID"} 1'
+    ) in lines
+    assert 'preservicaadaptor_upload_bytes_total{organisation="a",pid="PID"} 100' in lines
+    assert '# TYPE preservicaadaptor_scratch_bytes gauge' in lines
+    assert 'preservicaadaptor_scratch_bytes{root="/tmp",pid="PID"} 3' in lines
+    assert not tmpdir.listdir(lambda p: p.ext == '.tmp')
+
+
+def test_prometheus_sinks_of_processes_keep_own_files(tmpdir, monkeypatch):
+    path = str(tmpdir.join('adaptor.prom'))
+    monkeypatch.setattr(os, 'getpid', lambda: 100)
+    first = metrics.Registry(metrics.PrometheusSink('Test', path))
+    monkeypatch.setattr(os, 'getpid', lambda: 200)
+    second = metrics.Registry(metrics.PrometheusSink('Test', path))
+    first.increment('upload_bytes', 1, shard='a')
+    second.increment('upload_bytes', 2, shard='b')
+    first.flush()
+    second.flush()
+
+    with open(str(tmpdir.join('adaptor.100.prom'))) as f:
+        assert 'test_upload_bytes_total{shard="a",pid="100"} 1' in f.read()
+    with open(str(tmpdir.join('adaptor.200.prom'))) as f:
+        assert 'test_upload_bytes_total{shard="b",pid="200"} 2' in f.read()
@@ -0,0 +1,99 @@
+import base64
+import hashlib
+import logging
+import os
+
+import moto
+import pytest
+
+from preservicaservice import multipart
+from .helpers import create_bucket
+
+PART_SIZE = 5 * 1024 * 1024
+
+
+@pytest.fixture(autouse=True)
+def plain_part_uploads(monkeypatch):
+    # newer botocore sends parts aws-chunked, which moto stores as is
+    monkeypatch.setenv('AWS_REQUEST_CHECKSUM_CALCULATION', 'when_required')
+
+
+def md5_checksum(data):
+    return base64.b64encode(hashlib.md5(data).digest()).decode('utf-8')
+
+
+@moto.mock_s3
+def test_small_upload_put_directly():
+    bucket = create_bucket('upload')
+    upload = multipart.StreamingUpload(bucket, 'bundle', PART_SIZE)
+    upload.write(b'foo')
+    upload.write(b'bar')
+    upload.publish({'status': 'ready'})
+
+    assert upload.size == 6
+    assert upload.md5_checksum == md5_checksum(b'foobar')
+    bundle = bucket.Object('bundle')
+    assert bundle.get()['Body'].read() == b'foobar'
+    assert bundle.metadata == {'status': 'ready'}
+    assert [o.key for o in bucket.objects.all()] == ['bundle']
+
+
+@moto.mock_s3
+def test_large_upload_in_parts():
+    bucket = create_bucket('upload')
+    data = os.urandom(2 * PART_SIZE + 100)
+    upload = multipart.StreamingUpload(bucket, 'bundle', PART_SIZE)
+    for i in range(0, len(data), 1024 * 1024):
+        upload.write(data[i:i + 1024 * 1024])
+    assert len(upload.parts) == 2
+
+    upload.publish({'status': 'ready', 'md5chksum': upload.md5_checksum})
+
+    assert len(upload.parts) == 3
+    bundle = bucket.Object('bundle')
+    assert bundle.get()['Body'].read() == data
+    assert bundle.metadata == {
+        'status': 'ready', 'md5chksum': md5_checksum(data),
+    }
+    assert [o.key for o in bucket.objects.all()] == ['bundle']
+
+
+@moto.mock_s3
+def test_staged_copy_left_when_delete_fails(monkeypatch, caplog):
+    bucket = create_bucket('upload')
+    upload = multipart.StreamingUpload(bucket, 'bundle', PART_SIZE)
+    upload.write(b'x' * (PART_SIZE + 1))
+
+    def delete_object(**kwargs):
+        raise Exception('access denied')
+
+    monkeypatch.setattr(upload.client, 'delete_object', delete_object)
+    with caplog.at_level(logging.WARNING, logger=multipart.__name__):
+        upload.publish({'status': 'ready'})
+
+    assert bucket.Object('bundle').metadata == {'status': 'ready'}
+    assert not upload.staged
+    assert 'incomplete/bundle staged for bundle' in caplog.text
+
+
+@moto.mock_s3
+def test_abort_drops_parts():
+    bucket = create_bucket('upload')
+    upload = multipart.StreamingUpload(bucket, 'bundle', PART_SIZE)
+    upload.write(b'x' * PART_SIZE)
+    assert upload.upload_id
+
+    upload.abort()
+
+    assert upload.upload_id is None
+    assert not list(bucket.multipart_uploads.all())
+    assert not list(bucket.objects.all())
+
+
+@moto.mock_s3
+def test_part_size_grows():
+    upload = multipart.StreamingUpload(create_bucket('upload'), 'bundle', PART_SIZE)
+    upload.parts = [None] * multipart.PART_SIZE_STEP
+    assert upload.next_part_size() == 2 * PART_SIZE
+    upload.parts = [None] * (multipart.MAX_PARTS - 1)
+    assert upload.next_part_size() == 512 * PART_SIZE
@@ -0,0 +1,74 @@
+import zipfile
+
+import pytest
+
+from preservicaservice import offload
+from preservicaservice.hashing import HashingWriter
+
+
+@pytest.fixture
+def backend():
+    b = offload.OffloadBackend(workers=1, min_bytes=100)
+    yield b
+    b.shutdown()
+
+
+@pytest.mark.parametrize(
+    'size, offloaded', [
+        (10, False),
+        (1000, True),
+    ],
+)
+def test_should_offload(temp_file, backend, size, offloaded):
+    with open(temp_file, 'w') as f:
+        f.write('x' * size)
+    assert backend.should_offload(temp_file) == offloaded
+
+
+def test_inline_backend_never_offloads(temp_file):
+    with open(temp_file, 'w') as f:
+        f.write('x' * 1000)
+    assert not offload.INLINE.should_offload(temp_file)
+
+
+def test_backend_write(temp_file, temp_file2, temp_file3, backend):
+    with open(temp_file2, 'w') as f:
+        f.write('small')
+    with open(temp_file3, 'w') as f:
+        f.write('large ' * 1000)
+
+    with zipfile.ZipFile(temp_file, 'w', compression=zipfile.ZIP_DEFLATED) as f:
+        backend.write(f, temp_file2, 'small')
+        backend.write(f, temp_file3, 'large')
+    with zipfile.ZipFile(temp_file, 'a', compression=zipfile.ZIP_DEFLATED) as f:
+        backend.write(f, temp_file3, 'appended')
+
+    with zipfile.ZipFile(temp_file) as f:
+        assert f.testzip() is None
+        assert f.read('small') == b'small'
+        assert f.read('large') == b'large ' * 1000
+        assert f.read('appended') == b'large ' * 1000
+        info = f.getinfo('large')
+        assert info.compress_type == zipfile.ZIP_DEFLATED
+        assert info.compress_size < info.file_size
+
+
+def test_get_backend_shared():
+    assert offload.get_backend(0, 10) is offload.INLINE
+    assert offload.get_backend(2, 10) is offload.get_backend(2, 10)
+
+
+def test_write_stored_has_no_data_descriptor(temp_file, temp_file2):
+    with open(temp_file2, 'wb') as f:
+        f.write(b'\xff\xd8\xff' + b'x' * 1000)
+
+    with open(temp_file, 'wb') as raw:
+        # unseekable, as when streaming to upload
+        with zipfile.ZipFile(HashingWriter(raw), 'w') as z:
+            offload.INLINE.write(z, temp_file2, 'scan.jpg', zipfile.ZIP_STORED)
+
+    with zipfile.ZipFile(temp_file) as z:
+        info = z.getinfo('scan.jpg')
+        assert info.compress_type == zipfile.ZIP_STORED
+        assert not info.flag_bits & 0x08
+        assert z.read('scan.jpg') == b'\xff\xd8\xff' + b'x' * 1000
@@ -0,0 +1,73 @@
+import os
+import zipfile
+import zlib
+
+import pytest
+
+from preservicaservice import offload, pdeflate
+from preservicaservice.ziputil import crc32_combine
+
+
+@pytest.fixture
+def deflater():
+    d = pdeflate.ParallelDeflater(threads=4, min_bytes=100, block_size=4096)
+    yield d
+    d.shutdown()
+
+
+@pytest.mark.parametrize(
+    'first, second', [
+        (b'abc', b'defg'),
+        (os.urandom(1000), os.urandom(4096)),
+        (b'', b'x'),
+        (b'x', b''),
+    ],
+)
+def test_crc32_combine(first, second):
+    combined = crc32_combine(zlib.crc32(first), zlib.crc32(second), len(second))
+    assert combined == zlib.crc32(first + second)
+
+
+@pytest.mark.parametrize('size', [0, 10, 4096, 50000])
+def test_deflate_file(temp_file, temp_file2, deflater, size):
+    data = (b'some text that repeats ' * 3000)[:size // 2] + os.urandom(size // 2)
+    with open(temp_file, 'wb') as f:
+        f.write(data)
+
+    crc, compress_size, file_size = deflater.deflate_file(
+        temp_file, temp_file2, 6,
+    )
+
+    with open(temp_file2, 'rb') as f:
+        raw = f.read()
+    assert len(raw) == compress_size
+    assert file_size == len(data)
+    assert crc == zlib.crc32(data)
+    decompressor = zlib.decompressobj(-15)
+    assert decompressor.decompress(raw) == data
+    # one stream, its final block is the last
+    assert decompressor.eof and not decompressor.unused_data
+
+
+def test_backend_writes_blocks_as_one_member(temp_file, temp_file2, deflater):
+    data = b'line of a large csv file\n' * 10000
+    with open(temp_file2, 'wb') as f:
+        f.write(data)
+    backend = offload.OffloadBackend(parallel=deflater)
+
+    with zipfile.ZipFile(temp_file, 'w') as z:
+        backend.write(z, temp_file2, 'data.csv')
+
+    with zipfile.ZipFile(temp_file) as z:
+        assert z.testzip() is None
+        info = z.getinfo('data.csv')
+        assert info.compress_type == zipfile.ZIP_DEFLATED
+        assert info.compress_size < len(data) // 10
+        assert z.read('data.csv') == data
+
+
+def test_small_files_not_deflated_in_blocks(temp_file, deflater):
+    with open(temp_file, 'wb') as f:
+        f.write(b'x' * 10)
+    assert not deflater.should_deflate(temp_file)
+    assert not pdeflate.DISABLED.should_deflate(temp_file)
@@ -0,0 +1,201 @@
+import threading
+
+from preservicaservice import admission, pipeline
+from preservicaservice.config import Config
+
+
+def test_pipeline_runs_stages_in_order():
+    finished = []
+    errors = []
+    p = pipeline.Pipeline(
+        [
+            pipeline.Stage('add', lambda job: job.value + 1, 2, 1),
+            pipeline.Stage('double', lambda job: job.value * 2, 2, 1),
+        ],
+        lambda job, e: errors.append((job, e)),
+        finished.append,
+    )
+    p.start()
+    for i in range(5):
+        p.submit(pipeline.Job(i, i))
+    p.stop()
+
+    assert sorted(job.value for job in finished) == [2, 4, 6, 8, 10]
+    assert errors == []
+    stats = p.stats()
+    assert stats['add']['processed'] == 5
+    assert stats['double']['processed'] == 5
+    assert stats['double']['max_depth'] <= 1
+
+
+def test_pipeline_routes_errors_and_finishes_job():
+    finished = []
+    errors = []
+
+    def fail(job):
+        raise ValueError('boom')
+
+    second = pipeline.Stage('never', lambda job: job.value, 1, 1)
+    p = pipeline.Pipeline(
+        [pipeline.Stage('fail', fail, 1, 1), second],
+        lambda job, e: errors.append(str(e)),
+        finished.append,
+    )
+    p.start()
+    p.submit(pipeline.Job(0, 'x'))
+    p.stop()
+
+    assert errors == ['boom']
+    assert len(finished) == 1
+    assert second.stats()['processed'] == 0
+
+
+def test_stage_none_finishes_job_early():
+    finished = []
+    second = pipeline.Stage('never', lambda job: job.value, 1, 1)
+    p = pipeline.Pipeline(
+        [pipeline.Stage('skip', lambda job: None, 1, 1), second],
+        lambda job, e: None,
+        finished.append,
+    )
+    p.start()
+    p.submit(pipeline.Job(0, 'x'))
+    p.stop()
+
+    assert len(finished) == 1
+    assert second.stats()['processed'] == 0
+
+
+def test_stages_overlap():
+    started = threading.Event()
+    release = threading.Event()
+    first_finished = threading.Event()
+    finished = []
+
+    def slow(job):
+        if job.index == 0:
+            started.set()
+            release.wait(5)
+        return job.value
+
+    def on_finish(job):
+        finished.append(job)
+        first_finished.set()
+
+    p = pipeline.Pipeline(
+        [
+            pipeline.Stage('fast', lambda job: job.value, 1, 2),
+            pipeline.Stage('slow', slow, 2, 2),
+        ],
+        lambda job, e: None,
+        on_finish,
+    )
+    p.start()
+    p.submit(pipeline.Job(0, 0))
+    p.submit(pipeline.Job(1, 1))
+    assert started.wait(5)
+
+    # second job passes both stages while the first is stuck
+    assert first_finished.wait(5)
+    assert finished[0].index == 1
+
+    release.set()
+    p.stop()
+    assert len(finished) == 2
+
+
+def test_pipeline_finishes_job_when_error_reporting_fails():
+    finished = []
+
+    def fail(job):
+        raise ValueError('boom')
+
+    def report(job, e):
+        raise RuntimeError('stream down')
+
+    p = pipeline.Pipeline(
+        [pipeline.Stage('fail', fail, 1, 1)],
+        report,
+        finished.append,
+    )
+    p.start()
+    p.submit(pipeline.Job(0, 'x'))
+    p.stop()
+
+    assert len(finished) == 1
+
+
+class FakeTask:
+    def __init__(self, nbytes):
+        self.nbytes = nbytes
+
+    def download_files(self):
+        pass
+
+    def build_bundle(self):
+        pass
+
+    def upload(self):
+        pass
+
+    def cleanup(self):
+        pass
+
+
+class FakeScheduler:
+    def started(self, record):
+        pass
+
+
+class FakeProcessor:
+    def __init__(self, tmpdir):
+        self.config = Config(
+            environment='test',
+            preservica_base_url='https://test_preservica_url',
+            input_stream_name='input-stream',
+            invalid_stream_name='invalid-stream',
+            error_stream_name='error-stream',
+            adaptor_aws_region='eu-west-1',
+            organisation_buckets={},
+            engine='pipeline',
+        )
+        self.admission = admission.AdmissionController(100, str(tmpdir), 0, 0.01)
+        self.scheduler = FakeScheduler()
+        self.errors = []
+
+    def build_task(self, nbytes):
+        return FakeTask(nbytes)
+
+    def scratch_bytes(self, task):
+        return task.nbytes
+
+    def task_succeeded(self, task):
+        pass
+
+    def handle_error(self, record, error):
+        self.errors.append(error)
+
+
+def test_engine_admits_oversized_record_after_fileless_one(tmpdir, monkeypatch):
+    monkeypatch.setattr(pipeline, 'decode_record', lambda record: record)
+    processor = FakeProcessor(tmpdir)
+    engine = pipeline.PipelineEngine(processor)
+    completed = []
+    try:
+        engine.process_batch([0], completed.append)
+        assert processor.admission.in_flight_count == 0
+
+        # admitted alone, over budget
+        batch = threading.Thread(
+            target=engine.process_batch, args=([500], completed.append),
+            daemon=True,
+        )
+        batch.start()
+        batch.join(5)
+        assert not batch.is_alive()
+    finally:
+        engine.shutdown()
+
+    assert completed == [0, 500]
+    assert processor.errors == []
+    assert processor.admission.in_flight_count == 0
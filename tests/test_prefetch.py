@@ -0,0 +1,78 @@
+import threading
+import time
+
+import pytest
+
+from preservicaservice import prefetch
+
+
+class FakeFileTask:
+    def __init__(self, name, tracker, error=None):
+        self.name = name
+        self.tracker = tracker
+        self.error = error
+        self.fetched = False
+        self.cleaned = False
+
+    def fetch(self):
+        with self.tracker['lock']:
+            self.tracker['running'] += 1
+            self.tracker['peak'] = max(
+                self.tracker['peak'], self.tracker['running'],
+            )
+        time.sleep(0.02)
+        with self.tracker['lock']:
+            self.tracker['running'] -= 1
+        if self.error:
+            raise self.error
+        self.fetched = True
+
+    def cleanup(self):
+        self.cleaned = True
+
+
+@pytest.fixture
+def tracker():
+    return {'lock': threading.Lock(), 'running': 0, 'peak': 0}
+
+
+def test_serial_yields_unfetched(tracker):
+    file_tasks = [FakeFileTask(i, tracker) for i in range(3)]
+    result = list(prefetch.SERIAL.ordered(file_tasks))
+    assert result == [(task, False) for task in file_tasks]
+    assert not tracker['peak']
+
+
+def test_ordered_keeps_order_and_limit(tracker):
+    file_tasks = [FakeFileTask(i, tracker) for i in range(8)]
+    prefetcher = prefetch.Prefetcher(workers=8, per_message=3)
+
+    result = list(prefetcher.ordered(file_tasks))
+
+    assert [task.name for task, _ in result] == list(range(8))
+    assert [fetched for _, fetched in result] == [False] + [True] * 7
+    assert all(task.fetched for task in file_tasks[1:])
+    # streamed head counts against the limit
+    assert 1 < tracker['peak'] <= 3
+
+
+def test_failed_fetch_raises_and_cleans_up(tracker):
+    file_tasks = [FakeFileTask(i, tracker) for i in range(6)]
+    file_tasks[2].error = ValueError('bad')
+    prefetcher = prefetch.Prefetcher(workers=2, per_message=4)
+
+    consumed = []
+    with pytest.raises(ValueError):
+        for task, _ in prefetcher.ordered(file_tasks, stream_head=False):
+            consumed.append(task.name)
+
+    assert consumed == [0, 1]
+    # failed one and those queued behind it
+    assert all(task.cleaned for task in file_tasks[2:])
+    assert tracker['running'] == 0
+
+
+def test_get_prefetcher_shared():
+    assert prefetch.get_prefetcher(0, 4) is prefetch.SERIAL
+    assert prefetch.get_prefetcher(4, 1) is prefetch.SERIAL
+    assert prefetch.get_prefetcher(4, 2) is prefetch.get_prefetcher(4, 2)
@@ -10,6 +10,8 @@ from preservicaservice.processor import (
 from preservicaservice.config import (
     Config,
 )
+from preservicaservice.errors import UnderlyingSystemError
+from preservicaservice.remote_urls import S3RemoteUrl
 
 
 def _get_records(client, stream_name):
@@ -28,8 +30,17 @@ def _get_records(client, stream_name):
     return result['Records']
 
 
+@pytest.fixture
+def make_processor(request):
+    def make(config):
+        processor = RecordProcessor(config=config)
+        request.addfinalizer(lambda: processor.shutdown(None, 'ZOMBIE'))
+        return processor
+    return make
+
+
 @moto.mock_kinesis
-def test_record_with_invalid_json_sends_message_to_error_stream():
+def test_record_with_invalid_json_sends_message_to_error_stream(make_processor):
     client = boto3.client('kinesis', 'eu-west-1')
     client.create_stream(StreamName='error-stream', ShardCount=1)
     client.create_stream(StreamName='invalid-stream', ShardCount=1)
@@ -42,7 +53,7 @@ def test_record_with_invalid_json_sends_message_to_error_stream():
         adaptor_aws_region='eu-west-1',
         organisation_buckets={},
     )
-    processor = RecordProcessor(config=config)
+    processor = make_processor(config)
 
     class FakeRecord():
         data = base64.b64encode(b'{')
@@ -61,7 +72,7 @@ def test_record_with_invalid_json_sends_message_to_error_stream():
 
 
 @moto.mock_kinesis
-def test_record_with_invalid_rdss_message_sends_message_to_invalid_stream():
+def test_record_with_invalid_rdss_message_sends_message_to_invalid_stream(make_processor):
     client = boto3.client('kinesis', 'eu-west-1')
     client.create_stream(StreamName='error-stream', ShardCount=1)
     client.create_stream(StreamName='invalid-stream', ShardCount=1)
@@ -74,7 +85,7 @@ def test_record_with_invalid_rdss_message_sends_message_to_invalid_stream():
         adaptor_aws_region='eu-west-1',
         organisation_buckets={},
     )
-    processor = RecordProcessor(config=config)
+    processor = make_processor(config)
 
     class FakeRecord():
         data = base64.b64encode(b'{"messageHeader":{},"messageBody":{}}')
@@ -91,17 +102,15 @@ def test_record_with_invalid_rdss_message_sends_message_to_invalid_stream():
         'errorCode', 'errorDescription', 'errorDescription', 'messageHistory', 'messageType',
     }
 
-# TODO Remove to re-enable checksum and fsize validation
-
 
-@pytest.mark.skip(reason='checksum validation disabled to allow processing of prod willow messages')
 @moto.mock_s3
 @moto.mock_kinesis
-def test_record_with_invalid_checksum_sends_message_to_invalid_stream():
+def test_record_with_invalid_checksum_sends_message_to_invalid_stream(make_processor):
     s3_resource = boto3.resource('s3', region_name='us-east-1')
     s3_resource.create_bucket(Bucket='the-download-bucket')
     obj = s3_resource.Object('the-download-bucket', 'the-download-key')
     obj.put(Body=b'Some contents')
+    s3_resource.create_bucket(Bucket='the-upload-bucket')
 
     client = boto3.client('kinesis', 'eu-west-1')
     client.create_stream(StreamName='error-stream', ShardCount=1)
@@ -117,7 +126,7 @@ def test_record_with_invalid_checksum_sends_message_to_invalid_stream():
             '98765': 's3://the-upload-bucket/',
         },
     )
-    processor = RecordProcessor(config=config)
+    processor = make_processor(config)
 
     class FakeRecord():
         data = base64.b64encode(json.dumps({
@@ -158,11 +167,12 @@ def test_record_with_invalid_checksum_sends_message_to_invalid_stream():
 
 @moto.mock_s3
 @moto.mock_kinesis
-def test_record_with_valid_checksum_does_not_send_message_to_invalid_stream():
+def test_record_with_valid_checksum_does_not_send_message_to_invalid_stream(make_processor):
     s3_resource = boto3.resource('s3', region_name='us-east-1')
     s3_resource.create_bucket(Bucket='the-download-bucket')
     obj = s3_resource.Object('the-download-bucket', 'the-download-key')
     obj.put(Body=b'Some contents')
+    s3_resource.create_bucket(Bucket='the-upload-bucket')
     checksum = hashlib.md5()
     checksum.update(b'Some contents')
 
@@ -180,7 +190,7 @@ def test_record_with_valid_checksum_does_not_send_message_to_invalid_stream():
             '98765': 's3://the-upload-bucket/',
         },
     )
-    processor = RecordProcessor(config=config)
+    processor = make_processor(config)
 
     class FakeRecord():
         data = base64.b64encode(json.dumps({
@@ -218,7 +228,7 @@ def test_record_with_valid_checksum_does_not_send_message_to_invalid_stream():
 
 
 @moto.mock_kinesis
-def test_record_unable_to_download_sends_messages_to_error_stream():
+def test_record_unable_to_download_sends_messages_to_error_stream(make_processor):
     client = boto3.client('kinesis', 'eu-west-1')
     client.create_stream(StreamName='error-stream', ShardCount=1)
     client.create_stream(StreamName='invalid-stream', ShardCount=1)
@@ -233,7 +243,7 @@ def test_record_unable_to_download_sends_messages_to_error_stream():
             44: 's3://some-bucket/',
         },
     )
-    processor = RecordProcessor(config=config)
+    processor = make_processor(config)
 
     with open('tests/fixtures/create.json', 'rb') as fixture_file:
         fixture = fixture_file.read()
@@ -260,7 +270,7 @@ def test_record_unable_to_download_sends_messages_to_error_stream():
 
 @moto.mock_s3
 @moto.mock_kinesis
-def test_record_samvera_prod_processes():
+def test_record_samvera_prod_processes(make_processor):
     s3_resource = boto3.resource('s3', region_name='us-east-1')
     s3_resource.create_bucket(Bucket='some-bucket')
     client = boto3.client('kinesis', 'eu-west-1')
@@ -277,7 +287,7 @@ def test_record_samvera_prod_processes():
             747: 's3://some-bucket/',
         },
     )
-    processor = RecordProcessor(config=config)
+    processor = make_processor(config)
 
     with open('tests/fixtures/create_samvera_0.0.1-SNAPSHOT.json', 'rb') as fixture_file:
         fixture = fixture_file.read()
@@ -292,7 +302,7 @@ def test_record_samvera_prod_processes():
 
 
 @moto.mock_kinesis
-def test_record_figshare_prod_processes():
+def test_record_figshare_prod_processes(make_processor):
     client = boto3.client('kinesis', 'eu-west-1')
     client.create_stream(StreamName='error-stream', ShardCount=1)
     client.create_stream(StreamName='invalid-stream', ShardCount=1)
@@ -307,7 +317,7 @@ def test_record_figshare_prod_processes():
             89: 's3://some-bucket/',
         },
     )
-    processor = RecordProcessor(config=config)
+    processor = make_processor(config)
 
     with open('tests/fixtures/create_figshare_1.json', 'rb') as fixture_file:
         fixture = fixture_file.read()
@@ -319,3 +329,189 @@ def test_record_figshare_prod_processes():
 
     records = _get_records(client, 'error-stream')
     assert len(records) == 0
+
+
+@moto.mock_kinesis
+def test_records_processed_concurrently_all_reach_error_stream(make_processor):
+    client = boto3.client('kinesis', 'eu-west-1')
+    client.create_stream(StreamName='error-stream', ShardCount=1)
+    client.create_stream(StreamName='invalid-stream', ShardCount=1)
+    config = Config(
+        environment='test',
+        preservica_base_url='https://test_preservica_url',
+        input_stream_name='input-stream',
+        invalid_stream_name='invalid-stream',
+        error_stream_name='error-stream',
+        adaptor_aws_region='eu-west-1',
+        organisation_buckets={},
+        record_workers=3,
+    )
+    processor = make_processor(config)
+
+    class FakeRecord():
+        data = base64.b64encode(b'{')
+
+    processor.process_records([FakeRecord() for _ in range(5)], None)
+
+    records = _get_records(client, 'error-stream')
+    assert len(records) == 5
+    for record in records:
+        message = json.loads(record['Data'].decode('utf-8'))
+        assert message['messageHeader']['errorCode'] == 'GENERR007'
+
+
+@moto.mock_kinesis
+def test_pipeline_engine_routes_errors(make_processor):
+    client = boto3.client('kinesis', 'eu-west-1')
+    client.create_stream(StreamName='error-stream', ShardCount=1)
+    client.create_stream(StreamName='invalid-stream', ShardCount=1)
+    config = Config(
+        environment='test',
+        preservica_base_url='https://test_preservica_url',
+        input_stream_name='input-stream',
+        invalid_stream_name='invalid-stream',
+        error_stream_name='error-stream',
+        adaptor_aws_region='eu-west-1',
+        organisation_buckets={},
+        engine='pipeline',
+    )
+    processor = make_processor(config)
+
+    class BrokenJsonRecord():
+        data = base64.b64encode(b'{')
+
+    class InvalidHeaderRecord():
+        data = base64.b64encode(b'{"messageHeader":{},"messageBody":{}}')
+
+    processor.process_records([BrokenJsonRecord(), InvalidHeaderRecord()], None)
+
+    assert len(_get_records(client, 'error-stream')) == 1
+    assert len(_get_records(client, 'invalid-stream')) == 1
+
+
+@moto.mock_kinesis
+def test_asyncio_engine_routes_errors(make_processor):
+    pytest.importorskip('aiohttp')
+    client = boto3.client('kinesis', 'eu-west-1')
+    client.create_stream(StreamName='error-stream', ShardCount=1)
+    client.create_stream(StreamName='invalid-stream', ShardCount=1)
+    config = Config(
+        environment='test',
+        preservica_base_url='https://test_preservica_url',
+        input_stream_name='input-stream',
+        invalid_stream_name='invalid-stream',
+        error_stream_name='error-stream',
+        adaptor_aws_region='eu-west-1',
+        organisation_buckets={},
+        engine='asyncio',
+    )
+    processor = make_processor(config)
+
+    class BrokenJsonRecord():
+        data = base64.b64encode(b'{')
+
+    class InvalidHeaderRecord():
+        data = base64.b64encode(b'{"messageHeader":{},"messageBody":{}}')
+
+    processor.process_records([BrokenJsonRecord(), InvalidHeaderRecord()], None)
+
+    assert len(_get_records(client, 'error-stream')) == 1
+    assert len(_get_records(client, 'invalid-stream')) == 1
+
+
+@moto.mock_kinesis
+def test_record_already_in_ledger_is_skipped(tmpdir, make_processor):
+    client = boto3.client('kinesis', 'eu-west-1')
+    client.create_stream(StreamName='error-stream', ShardCount=1)
+    client.create_stream(StreamName='invalid-stream', ShardCount=1)
+    config = Config(
+        environment='test',
+        preservica_base_url='https://test_preservica_url',
+        input_stream_name='input-stream',
+        invalid_stream_name='invalid-stream',
+        error_stream_name='error-stream',
+        adaptor_aws_region='eu-west-1',
+        organisation_buckets={
+            44: 's3://some-bucket/',
+        },
+        ledger_path=str(tmpdir.join('ledger.sqlite3')),
+    )
+    processor = make_processor(config)
+    processor.ledger.record(
+        'test-ad6dee33-80ed-ae48-9cac-ed6f2250b017',
+        'test-ad6dee33-80ed-ae48-9cac-ed6f2250b017',
+    )
+
+    with open('tests/fixtures/create.json', 'rb') as fixture_file:
+        fixture = fixture_file.read()
+
+    class FakeRecord():
+        data = base64.b64encode(fixture)
+
+    # would fail to download if not skipped
+    processor.process_records([FakeRecord()], None)
+
+    assert len(_get_records(client, 'error-stream')) == 0
+    assert len(_get_records(client, 'invalid-stream')) == 0
+
+
+@moto.mock_kinesis
+def test_record_rejected_when_prefetch_cannot_fit_scratch(monkeypatch, make_processor):
+    client = boto3.client('kinesis', 'eu-west-1')
+    client.create_stream(StreamName='error-stream', ShardCount=1)
+    client.create_stream(StreamName='invalid-stream', ShardCount=1)
+    config = Config(
+        environment='test',
+        preservica_base_url='https://test_preservica_url',
+        input_stream_name='input-stream',
+        invalid_stream_name='invalid-stream',
+        error_stream_name='error-stream',
+        adaptor_aws_region='eu-west-1',
+        organisation_buckets={
+            '98765': 's3://the-upload-bucket/',
+        },
+        admission_min_free_bytes=2 ** 62,
+        memory_bundle_bytes=0,
+    )
+    processor = make_processor(config)
+    errors = []
+    monkeypatch.setattr(
+        processor, 'handle_error', lambda record, error: errors.append(error),
+    )
+
+    def no_download(*args):
+        raise AssertionError('downloaded')
+
+    monkeypatch.setattr(S3RemoteUrl, 'open_stream', no_download)
+
+    class FakeRecord():
+        data = base64.b64encode(json.dumps({
+            'messageHeader': {
+                'messageType': 'MetadataCreate',
+                'messageId': 'the-message-id',
+            },
+            'messageBody': {
+                'objectUuid': 'the-id',
+                'objectOrganisationRole': [{
+                    'organisation': {
+                        'organisationJiscId': 98765,
+                    },
+                    'role': 'some-role-id',
+                }],
+                'objectFile': [{
+                    'fileStorageLocation': 's3://the-download-bucket/{}'.format(name),
+                    'fileStoragePlatform': {
+                        'storagePlatformType': 1,
+                    },
+                    'fileName': name,
+                    'fileSize': 1000,
+                    'fileChecksum': [],
+                } for name in ('first', 'second')],
+            },
+        }).encode('utf-8'))
+
+    processor.process_records([FakeRecord()], None)
+
+    assert len(errors) == 1
+    assert isinstance(errors[0], UnderlyingSystemError)
+    assert 'not enough scratch space' in str(errors[0])
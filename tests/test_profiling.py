@@ -0,0 +1,72 @@
+import time
+
+from preservicaservice import profiling
+
+
+def busy_wait(seconds):
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        pass
+
+
+def test_sampler_writes_collapsed_stacks(tmpdir):
+    sampler = profiling.StackSampler(str(tmpdir), 0.001)
+    sampler.start()
+    busy_wait(0.2)
+    path = sampler.stop()
+
+    assert sampler.samples > 0
+    with open(path) as f:
+        lines = f.read().splitlines()
+    stacks = [line.rsplit(' ', 1) for line in lines]
+    assert stacks
+    assert all(int(count) > 0 for _, count in stacks)
+    assert any(stack.startswith('MainThread;') for stack, _ in stacks)
+    assert any('busy_wait (test_profiling.py:' in line for line in lines)
+    assert not any('stack-sampler' in line for line in lines)
+
+
+def test_hook_follows_sentinel(tmpdir):
+    sentinel = tmpdir.join('profile')
+    hook = profiling.ProfilingHook(str(tmpdir), str(sentinel))
+
+    hook.poll()
+    assert not hook.sampler.running
+    sentinel.write('')
+    hook.poll()
+    assert hook.sampler.running
+    sentinel.remove()
+    hook.poll()
+    assert not hook.sampler.running
+    assert len(tmpdir.listdir(lambda p: p.ext == '.collapsed')) == 1
+
+
+def test_hook_toggled_by_signal(tmpdir):
+    hook = profiling.ProfilingHook(str(tmpdir))
+    hook._on_signal(None, None)
+    hook.poll()
+    assert hook.sampler.running
+    hook.close()
+    assert not hook.sampler.running
+    assert len(tmpdir.listdir(lambda p: p.ext == '.collapsed')) == 1
+
+
+def test_record_profiler_keeps_slow_records(tmpdir):
+    profiler = profiling.RecordProfiler(1, 0, str(tmpdir))
+    with profiler.profile('49590338271490256608559692538361571095921575989136588898'):
+        busy_wait(0.01)
+
+    summaries = tmpdir.listdir(lambda p: p.ext == '.txt')
+    assert len(summaries) == 1
+    assert 'busy_wait' in summaries[0].read()
+    assert len(tmpdir.listdir(lambda p: p.ext == '.prof')) == 1
+
+
+def test_record_profiler_skips(tmpdir):
+    not_sampled = profiling.RecordProfiler(0.5, 0, str(tmpdir), sample=lambda: 0.7)
+    with not_sampled.profile('1'):
+        pass
+    fast = profiling.RecordProfiler(1, 60, str(tmpdir))
+    with fast.profile('2'):
+        pass
+    assert not tmpdir.listdir()
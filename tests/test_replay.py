@@ -0,0 +1,126 @@
+import io
+import json
+import os
+import zipfile
+
+import boto3
+import moto
+
+from preservicaservice import replay
+from preservicaservice.config import Config
+
+
+def _write_lines(path, lines):
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines))
+
+
+def _message(message_type='MetadataCreate'):
+    return {
+        'messageHeader': {
+            'messageType': message_type,
+            'messageId': 'the-message-id',
+        },
+        'messageBody': {
+            'objectUuid': 'the-id',
+            'objectOrganisationRole': [{
+                'organisation': {
+                    'organisationJiscId': 98765,
+                },
+                'role': 'some-role-id',
+            }],
+            'objectFile': [{
+                'fileStorageLocation': 's3://the-download-bucket/the-download-key',
+                'fileStoragePlatform': {
+                    'storagePlatformType': 1,
+                },
+                'fileName': 'the file name',
+                'fileChecksum': [],
+            }],
+        },
+    }
+
+
+def test_read_records(tmpdir):
+    _write_lines(str(tmpdir.join('b.jsonl')), ['{"b": 1}', '', '{"c": 1}'])
+    _write_lines(str(tmpdir.join('a.jsonl')), ['not json'])
+    _write_lines(str(tmpdir.join('ignored.txt')), ['{}'])
+
+    records = list(replay.read_records([str(tmpdir)]))
+
+    assert [os.path.basename(r.source) for r in records] == [
+        'a.jsonl:1', 'b.jsonl:1', 'b.jsonl:3',
+    ]
+
+
+def test_restore_message_type():
+    message = _message('Error')
+    message['messageHeader']['errorCode'] = 'GENERR006'
+    line = json.dumps(message).encode('utf-8')
+
+    restored = json.loads(
+        replay.restore_message_type(line, 'MetadataCreate').decode('utf-8'),
+    )
+
+    assert restored['messageHeader'] == {
+        'messageType': 'MetadataCreate',
+        'messageId': 'the-message-id',
+    }
+    assert replay.restore_message_type(b'nope', 'MetadataCreate') == b'nope'
+
+
+def test_summarise():
+    records = [replay.ReplayRecord('a', b'{}') for _ in range(4)]
+    for i, record in enumerate(records):
+        record.seconds = float(i)
+    records[0].outcome = 'error'
+
+    summary = replay.summarise(records, 2.0)
+
+    assert summary['outcomes'] == {'ok': 3, 'error': 1}
+    assert summary['records_per_second'] == 2.0
+    assert summary['max_seconds'] == 3.0
+
+
+@moto.mock_s3
+def test_replay_to_dry_destination(tmpdir):
+    s3 = boto3.resource('s3', region_name='us-east-1')
+    s3.create_bucket(Bucket='the-download-bucket')
+    s3.Object('the-download-bucket', 'the-download-key').put(Body=b'data')
+
+    source = str(tmpdir.join('messages.jsonl'))
+    _write_lines(source, [json.dumps(_message('Error')), 'not json'])
+    destination = str(tmpdir.join('bundles'))
+    config = Config(
+        environment='test',
+        preservica_base_url='https://test_preservica_url',
+        input_stream_name='input-stream',
+        invalid_stream_name='invalid-stream',
+        error_stream_name='error-stream',
+        adaptor_aws_region='eu-west-1',
+        organisation_buckets={},
+        dry_destination_dir=destination,
+    )
+    processor = replay.ReplayProcessor(config)
+    report = io.StringIO()
+
+    try:
+        done = replay.replay(
+            processor,
+            replay.read_records([source], 'MetadataCreate'),
+            10,
+            report,
+        )
+    finally:
+        processor.close()
+
+    assert [r.outcome for r in done] == ['ok', 'error']
+    lines = [json.loads(line) for line in report.getvalue().splitlines()]
+    assert lines[0]['message_id'] == 'the-message-id'
+    assert lines[1]['error'].startswith('MalformedJsonBodyError')
+
+    bundle = os.path.join(destination, '98765', 'test-the-message-id')
+    with zipfile.ZipFile(bundle) as f:
+        assert 'test-the-id/the file name' in f.namelist()
+    with open(bundle + '.metadata.json') as f:
+        assert json.load(f)['status'] == 'ready'
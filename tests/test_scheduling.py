@@ -0,0 +1,130 @@
+import base64
+import json
+
+import pytest
+
+from preservicaservice import metrics, scheduling
+
+
+class FakeRecord:
+    def __init__(self, name, data):
+        self.name = name
+        self.data = data
+
+
+def _record(name, object_files, organisation='org'):
+    body = json.dumps({
+        'messageBody': {
+            'objectFile': object_files,
+            'objectOrganisationRole': [
+                {'organisation': {'organisationJiscId': organisation}},
+            ],
+        },
+    })
+    return FakeRecord(name, base64.b64encode(body.encode('utf-8')))
+
+
+def _names(records):
+    return [record.name for record in records]
+
+
+@pytest.mark.parametrize(
+    'object_files,cost', [
+        ([], 0),
+        ([{'fileSize': 10}], 10 + scheduling.FILE_OVERHEAD_BYTES),
+        ([{}, {'fileSize': 'big'}], 2 * (5 + scheduling.FILE_OVERHEAD_BYTES)),
+        ('not a list', 0),
+    ],
+)
+def test_describe_record(object_files, cost):
+    record = _record('a', object_files, 'org')
+    assert scheduling.describe_record(record, 5) == ('org', cost)
+
+
+def test_describe_invalid_record():
+    assert scheduling.describe_record(FakeRecord('a', b'###'), 5) == (
+        scheduling.UNKNOWN_ORGANISATION, 0,
+    )
+
+
+def test_schedule_largest_first():
+    scheduler = scheduling.RecordScheduler(5, 'largest_first')
+    records = [
+        _record('metadata', []),
+        _record('small', [{'fileSize': 1}]),
+        _record('large', [{'fileSize': 1000}, {'fileSize': 1000}]),
+        _record('other metadata', []),
+    ]
+    assert _names(scheduler.schedule(records)) == [
+        'large', 'small', 'metadata', 'other metadata',
+    ]
+
+
+def test_schedule_arrival():
+    scheduler = scheduling.RecordScheduler(5, 'arrival')
+    records = [_record('small', []), _record('large', [{'fileSize': 10}])]
+    assert _names(scheduler.schedule(records)) == ['small', 'large']
+
+
+def test_schedule_fair_share():
+    scheduler = scheduling.RecordScheduler(5, 'fair_share')
+    big = 10 * scheduling.FILE_OVERHEAD_BYTES
+    records = [
+        _record('bulk 1', [{'fileSize': big}], 'bulk'),
+        _record('bulk 2', [{'fileSize': big}], 'bulk'),
+        _record('bulk 3', [{'fileSize': big}], 'bulk'),
+        _record('small 1', [{'fileSize': 1}], 'small'),
+        _record('small 2', [], 'small'),
+    ]
+    assert _names(scheduler.schedule(records)) == [
+        'bulk 1', 'small 1', 'small 2', 'bulk 2', 'bulk 3',
+    ]
+
+
+def test_stats():
+    scheduler = scheduling.RecordScheduler(5)
+    first = _record('first', [{'fileSize': 10}], 'a')
+    second = _record('second', [], 'a')
+    other = _record('other', [], 'b')
+    scheduler.schedule([first, second, other])
+    cost = 10 + scheduling.FILE_OVERHEAD_BYTES
+
+    scheduler.started(first)
+    assert scheduler.stats() == {
+        'a': {'queued': 1, 'in_flight': 1, 'in_flight_bytes': cost},
+        'b': {'queued': 1, 'in_flight': 0, 'in_flight_bytes': 0},
+    }
+
+    scheduler.completed(first)
+    scheduler.completed(other)
+    assert scheduler.stats() == {
+        'a': {'queued': 1, 'in_flight': 0, 'in_flight_bytes': 0},
+    }
+
+    scheduler.started(second)
+    scheduler.completed(second)
+    assert scheduler.stats() == {}
+
+
+def test_load_published_as_gauges(tmpdir):
+    path = str(tmpdir.join('adaptor.prom'))
+    registry = metrics.configure(metrics.PrometheusSink('Test', path))
+    try:
+        scheduler = scheduling.RecordScheduler(5)
+        first = _record('first', [{'fileSize': 10}], 'a')
+        second = _record('second', [], 'a')
+        scheduler.schedule([first, second])
+
+        def gauge(name):
+            return registry.gauges[registry.key(name, {'organisation': 'a'})].value
+
+        assert gauge('queued_records') == 2
+        scheduler.started(first)
+        assert gauge('queued_records') == 1
+        assert gauge('in_flight_bytes') == 10 + scheduling.FILE_OVERHEAD_BYTES
+        scheduler.completed(first)
+        scheduler.completed(second)
+        assert gauge('queued_records') == 0
+        assert gauge('in_flight_bytes') == 0
+    finally:
+        metrics.configure(metrics.NullSink())
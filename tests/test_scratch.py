@@ -0,0 +1,64 @@
+import os
+import subprocess
+import sys
+
+from preservicaservice import scratch
+
+
+def test_files_placed_by_size(tmpdir):
+    disk, tmpfs = str(tmpdir.mkdir('disk')), str(tmpdir.mkdir('tmpfs'))
+    space = scratch.ScratchSpace([disk], tmpfs, small_file_bytes=100)
+    area = space.area('dev/message 1')
+
+    small = area.new_file(100)
+    large = area.new_file(101)
+    unknown = area.new_file()
+
+    assert small.startswith(os.path.join(scratch.ScratchSpace.process_dir(tmpfs), ''))
+    assert large.startswith(os.path.join(scratch.ScratchSpace.process_dir(disk), ''))
+    assert os.path.dirname(unknown) == os.path.dirname(large)
+    assert os.path.basename(os.path.dirname(large)).startswith('dev_message_1-')
+
+
+def test_in_use_bytes_and_removal(tmpdir):
+    space = scratch.ScratchSpace([str(tmpdir)])
+    area = space.area('message')
+    first, second = area.new_file(), area.new_file()
+    with open(first, 'wb') as f:
+        f.write(b'x' * 10)
+    with open(second, 'wb') as f:
+        f.write(b'x' * 5)
+    assert space.in_use_bytes() == 15
+
+    area.remove_file(first)
+    assert space.in_use_bytes() == 5
+    assert os.path.exists(os.path.dirname(second))
+
+    # directory goes with its last file
+    area.remove_file(second)
+    assert not os.path.exists(os.path.dirname(second))
+
+    third = area.new_file()
+    area.remove()
+    assert not os.path.exists(third)
+    assert space.in_use_bytes() == 0
+
+
+def test_sweep_removes_dead_processes(tmpdir):
+    space = scratch.ScratchSpace([str(tmpdir)])
+    dead = subprocess.Popen([sys.executable, '-c', ''])
+    dead.wait()
+    dead_dir = tmpdir.join(scratch.SCRATCH_DIR_NAME, str(dead.pid), 'message-1')
+    dead_dir.ensure('data').write(b'x' * 7, mode='wb')
+    live_dir = tmpdir.join(scratch.SCRATCH_DIR_NAME, str(os.getppid()), 'message-2')
+    live_dir.ensure('data')
+
+    assert space.sweep() == 7
+    assert not dead_dir.check()
+    assert live_dir.check()
+
+
+def test_get_space_shared():
+    assert scratch.get_space() is scratch.DEFAULT
+    space = scratch.get_space(['/tmp'], '/dev/shm', 10)
+    assert scratch.get_space(['/tmp'], '/dev/shm', 10) is space
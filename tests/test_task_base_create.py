@@ -1,4 +1,5 @@
 import datetime
+import os
 import zipfile
 import boto3
 
@@ -8,6 +9,7 @@ import pytest
 
 from preservicaservice import errors
 from preservicaservice import tasks
+from preservicaservice.bundle import BundleWriter
 from preservicaservice.errors import MalformedBodyError
 from preservicaservice.remote_urls import S3RemoteUrl
 from .helpers import (
@@ -53,8 +55,9 @@ def task(file_task1, file_task2):
         )
 
 
-def test_bundle_meta(temp_file, task):
-    task.bundle_meta(temp_file)
+def test_write_bundle_meta(temp_file, task):
+    with open(temp_file, 'wb') as output, BundleWriter(output) as bundle:
+        task.write_bundle_meta(bundle.zip_file)
     assert_zip_contains(
         temp_file,
         'object_id/object_id.metadata',
@@ -63,25 +66,19 @@ def test_bundle_meta(temp_file, task):
     )
 
 
-def test_collect_meta(temp_file, temp_file2, temp_file3, task):
-    with open(temp_file2, 'w') as f:
-        f.write('x' * 10000)
+def test_collect_meta(temp_file, task):
+    with open(temp_file, 'wb') as output, BundleWriter(output) as bundle:
+        bundle.zip_file.writestr('foo', 'x' * 10000)
+        bundle.zip_file.writestr('bar', 'x' * 90000)
 
-    with open(temp_file3, 'w') as f:
-        f.write('x' * 90000)
-
-    with zipfile.ZipFile(temp_file, 'w', compression=zipfile.ZIP_DEFLATED) as f:
-        f.write(temp_file2, 'foo')
-        f.write(temp_file3, 'bar')
-
-    metadata = task.collect_meta(temp_file)
+    metadata = task.collect_meta(bundle)
 
     assert len(metadata.keys()) == 8
     assert metadata['key'] == 'message_id'
     assert metadata['bucket'] == 'upload'
     assert metadata['status'] == 'ready'
     assert metadata['name'] == 'message_id.zip'
-    assert metadata['size'] == '317'
+    assert metadata['size'] == str(os.path.getsize(temp_file))
     assert metadata['size_uncompressed'] == '100000'
     assert (
         datetime.datetime.now() -
@@ -90,6 +87,26 @@ def test_collect_meta(temp_file, temp_file2, temp_file3, task):
     assert metadata['createdby'] == 'role'
 
 
+def test_build_bundle_counts_sizes(tmpdir, task):
+    for i, file_task in enumerate(task.file_tasks):
+        download = tmpdir.join('download{}'.format(i))
+        download.write('x' * 10000 * (i + 1))
+        meta = tmpdir.join('meta{}'.format(i))
+        meta.write('<meta/>')
+        file_task.download_path = str(download)
+        file_task.meta_path = str(meta)
+
+    task.build_bundle()
+
+    metadata = task.collect_meta(task.bundle)
+    with zipfile.ZipFile(task.zip_path) as f:
+        size_uncompressed = sum(info.file_size for info in f.infolist())
+    assert metadata['size'] == str(os.path.getsize(task.zip_path))
+    assert metadata['size_uncompressed'] == str(size_uncompressed)
+    assert not download.check()
+    task.cleanup()
+
+
 @moto.mock_s3
 def test_upload_override(task, temp_file, temp_file2):
     bucket = create_bucket()
@@ -2,11 +2,16 @@ import datetime
 import boto3
 import dateutil.parser
 import moto
+import os
 import pytest
 import subprocess
+import zipfile
 
 from preservicaservice import errors
 from preservicaservice import tasks
+from preservicaservice.offload import OffloadBackend
+from preservicaservice.pdeflate import ParallelDeflater
+from preservicaservice.prefetch import Prefetcher
 from preservicaservice.remote_urls import S3RemoteUrl
 from .helpers import assert_zip_contains, create_bucket
 
@@ -137,3 +142,223 @@ def test_run_no_override(task):
 
     with pytest.raises(errors.ResourceAlreadyExistsError):
         task.run()
+
+
+@moto.mock_s3
+def test_run_in_stages(temp_file, task):
+    source_bucket = create_bucket('bucket')
+    source_bucket.put_object(Key='the/prefix/foo.pdf', Body='foo')
+    source_bucket.put_object(Key='the/prefix/bar.pdf', Body='bar')
+    upload_bucket = create_bucket('upload')
+
+    try:
+        task.download_files()
+        assert all(t.download_path for t in task.file_tasks)
+
+        task.build_bundle()
+        assert all(t.download_path is None for t in task.file_tasks)
+
+        task.upload()
+    finally:
+        task.cleanup()
+
+    assert task.zip_path is None
+    upload_bucket.download_file('this-is-message-uuid', temp_file)
+    assert_zip_contains(temp_file, 'object-uuid/foo.pdf', 'foo')
+    assert_zip_contains(temp_file, 'object-uuid/bar.pdf', 'bar')
+
+
+@moto.mock_s3
+def test_run_in_stages_in_memory(monkeypatch, temp_file, task):
+    source_bucket = create_bucket('bucket')
+    source_bucket.put_object(Key='the/prefix/foo.pdf', Body='foo')
+    source_bucket.put_object(Key='the/prefix/bar.pdf', Body='bar')
+    upload_bucket = create_bucket('upload')
+    task.memory_bundle_bytes = 6
+
+    def no_scratch(*args):
+        raise AssertionError('scratch file created')
+
+    monkeypatch.setattr(task.scratch, 'new_file', no_scratch)
+    for file_task in task.file_tasks:
+        monkeypatch.setattr(file_task.scratch, 'new_file', no_scratch)
+    try:
+        task.preflight()
+        assert task.in_memory()
+        task.download_files()
+        assert [t.data for t in task.file_tasks] == [b'foo', b'bar']
+
+        task.build_bundle()
+        assert all(t.data is None for t in task.file_tasks)
+        assert task.zip_path is None
+
+        task.upload()
+    finally:
+        task.cleanup()
+
+    assert task.bundle_data is None
+    upload_bucket.download_file('this-is-message-uuid', temp_file)
+    assert_zip_contains(temp_file, 'object-uuid/foo.pdf', 'foo')
+    assert_zip_contains(temp_file, 'object-uuid/bar.pdf', 'bar')
+
+
+def test_in_memory_needs_known_sizes(task):
+    task.memory_bundle_bytes = 100
+    task.file_tasks[0].declared_size = 50
+    assert not task.in_memory()
+    task.file_tasks[1].declared_size = 50
+    assert task.in_memory()
+    task.file_tasks[1].declared_size = 51
+    assert not task.in_memory()
+
+
+@moto.mock_s3
+def test_run_prefetched_files_keep_declared_order(temp_file):
+    source_bucket = create_bucket('bucket')
+    upload_bucket = create_bucket('upload')
+    file_tasks = []
+    for i in range(6):
+        key = 'the/prefix/{}.pdf'.format(i)
+        source_bucket.put_object(Key=key, Body=str(i) * (6 - i) * 1000)
+        file_tasks.append(tasks.FileTask(
+            S3RemoteUrl('s3://bucket/{}'.format(key)),
+            tasks.FileMetadata(fileName='{}.pdf'.format(i)),
+            'this-is-message-uuid',
+            'object-uuid',
+            [],
+        ))
+    task = tasks.BaseMetadataCreateTask(
+        {'foo': 'bar'},
+        file_tasks,
+        upload_bucket,
+        'this-is-message-uuid',
+        'role',
+        'object-uuid',
+        prefetch=Prefetcher(4, 3),
+    )
+
+    task.run()
+
+    upload_bucket.download_file('this-is-message-uuid', temp_file)
+    with zipfile.ZipFile(temp_file) as f:
+        assert f.namelist()[1::2] == [
+            'object-uuid/{}.pdf'.format(i) for i in range(6)
+        ]
+        assert f.read('object-uuid/5.pdf') == b'5' * 1000
+    assert all(t.download_path is None for t in file_tasks)
+
+
+@moto.mock_s3
+def test_run_rejects_oversize_file_before_download(monkeypatch):
+    source_bucket = create_bucket('bucket')
+    source_bucket.put_object(Key='the/prefix/foo.pdf', Body='x' * 100)
+    source_bucket.put_object(Key='the/prefix/bar.pdf', Body='x' * 10)
+    upload_bucket = create_bucket('upload')
+    file_tasks = [
+        tasks.FileTask(
+            S3RemoteUrl('s3://bucket/the/prefix/{}'.format(name)),
+            tasks.FileMetadata(fileName=name),
+            'this-is-message-uuid',
+            'object-uuid',
+            [],
+            file_size_limit=50,
+        ) for name in ('bar.pdf', 'foo.pdf')
+    ]
+    task = tasks.BaseMetadataCreateTask(
+        {'foo': 'bar'},
+        file_tasks,
+        upload_bucket,
+        'this-is-message-uuid',
+        'role',
+        'object-uuid',
+    )
+
+    def no_download(self):
+        raise AssertionError('downloaded {}'.format(self.url))
+
+    monkeypatch.setattr(S3RemoteUrl, 'open_stream', no_download)
+    with pytest.raises(errors.UnderlyingSystemError, match='foo.pdf'):
+        task.run()
+    assert not list(upload_bucket.objects.all())
+
+
+@moto.mock_s3
+@pytest.mark.parametrize('prefetch', [Prefetcher(), Prefetcher(4, 2)])
+def test_run_fetches_large_head_for_parallel_deflate(
+    monkeypatch, temp_file, prefetch,
+):
+    source_bucket = create_bucket('bucket')
+    upload_bucket = create_bucket('upload')
+    parallel = ParallelDeflater(2, 1000)
+    offload = OffloadBackend(parallel=parallel)
+    file_tasks = []
+    for name, size in (('large.txt', 5000), ('small.txt', 10)):
+        key = 'the/prefix/{}'.format(name)
+        source_bucket.put_object(Key=key, Body=b'x' * size)
+        file_tasks.append(tasks.FileTask(
+            S3RemoteUrl('s3://bucket/{}'.format(key)),
+            tasks.FileMetadata(fileName=name),
+            'this-is-message-uuid',
+            'object-uuid',
+            [],
+            declared_size=size,
+            offload=offload,
+        ))
+    task = tasks.BaseMetadataCreateTask(
+        {'foo': 'bar'},
+        file_tasks,
+        upload_bucket,
+        'this-is-message-uuid',
+        'role',
+        'object-uuid',
+        offload=offload,
+        prefetch=prefetch,
+    )
+    deflated = []
+    deflate_file = parallel.deflate_file
+
+    def record(src_path, dst_path, level):
+        deflated.append(os.path.getsize(src_path))
+        return deflate_file(src_path, dst_path, level)
+
+    monkeypatch.setattr(parallel, 'deflate_file', record)
+    try:
+        task.run()
+    finally:
+        parallel.shutdown()
+
+    assert deflated == [5000]
+    upload_bucket.download_file('this-is-message-uuid', temp_file)
+    with zipfile.ZipFile(temp_file) as f:
+        assert f.read('object-uuid/large.txt') == b'x' * 5000
+        assert f.read('object-uuid/small.txt') == b'x' * 10
+
+
+def test_run_scratch_bytes_cover_prefetched_window():
+    file_tasks = [
+        tasks.FileTask(
+            S3RemoteUrl('s3://bucket/the/prefix/{}.pdf'.format(i)),
+            tasks.FileMetadata(fileName='{}.pdf'.format(i)),
+            'this-is-message-uuid',
+            'object-uuid',
+            [],
+            declared_size=size,
+        ) for i, size in enumerate((1000, 10, 300, 50, 20))
+    ]
+    task = tasks.BaseMetadataCreateTask(
+        {'foo': 'bar'}, file_tasks, None, 'this-is-message-uuid', 'role',
+        'object-uuid', prefetch=Prefetcher(4, 2),
+    )
+    # head streams, two largest of the rest may be on disk at once
+    assert task.estimate_run_scratch_bytes(100) == 350
+
+    task.prefetch = Prefetcher()
+    assert task.estimate_run_scratch_bytes(100) == 0
+
+    # files taken by parallel deflate are fetched, head included
+    offload = OffloadBackend(parallel=ParallelDeflater(2, 300))
+    for file_task in file_tasks:
+        file_task.offload = offload
+    assert task.estimate_run_scratch_bytes(100) == 1000
+    task.prefetch = Prefetcher(4, 2)
+    assert task.estimate_run_scratch_bytes(100) == 1300
@@ -1,9 +1,16 @@
+import asyncio
+import hashlib
+import struct
+import zipfile
+
 import moto
 import pytest
+import responses
 
 from preservicaservice import errors
 from preservicaservice import tasks
-from preservicaservice.remote_urls import S3RemoteUrl
+from preservicaservice.bundle import BundleWriter
+from preservicaservice.remote_urls import HTTPRemoteUrl, S3RemoteUrl
 from .helpers import (
     assert_file_contents, assert_zip_contains,
     create_bucket
@@ -40,14 +47,15 @@ def test_download(temp_file, task):
     assert_file_contents(temp_file, 'bar')
 
 
+@moto.mock_s3
 @pytest.mark.parametrize(
     'size', [
         1, 10,
     ],
 )
-def test_verify_limit(temp_file, size):
-    with open(temp_file, 'w') as f:
-        f.write(10 * 'a')
+def test_download_limit(temp_file, size):
+    bucket = create_bucket()
+    bucket.put_object(Key='the/prefix/foo', Body=10 * 'a')
     task = tasks.FileTask(
         S3RemoteUrl('s3://bucket/the/prefix/foo'),
         tasks.FileMetadata(fileName='baz.pdf'),
@@ -57,17 +65,61 @@ def test_verify_limit(temp_file, size):
         size,
     )
     with pytest.raises(errors.UnderlyingSystemError):
-        task.verify_file_size(temp_file)
+        task.download(temp_file)
+
+
+@moto.mock_s3
+@pytest.mark.parametrize(
+    'checksum_value, error', [
+        (hashlib.md5(b'bar').hexdigest(), None),
+        (hashlib.md5(b'baz').hexdigest(), errors.InvalidChecksumError),
+    ],
+)
+def test_download_verifies_checksums_as_written(
+    file_metadata, temp_file, monkeypatch, checksum_value, error,
+):
+    bucket = create_bucket()
+    bucket.put_object(Key='the/prefix/foo', Body='bar')
+    task = tasks.FileTask(
+        S3RemoteUrl('s3://bucket/the/prefix/foo'),
+        file_metadata, 'message_id', 'object_id',
+        [{'checksumType': 1, 'checksumValue': checksum_value}],
+    )
+    opened = []
+    real_open = open
+
+    def tracking_open(path, mode='r', *args, **kwargs):
+        opened.append((path, mode))
+        return real_open(path, mode, *args, **kwargs)
+
+    monkeypatch.setattr('builtins.open', tracking_open)
+    if error is None:
+        task.download(temp_file)
+    else:
+        with pytest.raises(error):
+            task.download(temp_file)
+    monkeypatch.undo()
+
+    # never read back
+    assert [mode for path, mode in opened if path == temp_file] == ['wb']
 
 
-def test_zip_bundle(task, temp_file, temp_file2, temp_file3):
+def write_bundle(path, write):
+    with open(path, 'wb') as output, BundleWriter(output) as bundle:
+        write(bundle.zip_file)
+    return bundle
+
+
+def test_add_to_bundle(task, temp_file, temp_file2, temp_file3):
     with open(temp_file2, 'w') as f:
         f.write('download')
 
     with open(temp_file3, 'w') as f:
         f.write('meta')
 
-    task.zip_bundle(temp_file, temp_file2, temp_file3)
+    write_bundle(
+        temp_file, lambda f: task.add_to_bundle(f, temp_file2, temp_file3),
+    )
 
     assert_zip_contains(
         temp_file, 'object_id/foo', 'download',
@@ -75,3 +127,283 @@ def test_zip_bundle(task, temp_file, temp_file2, temp_file3):
     assert_zip_contains(
         temp_file, 'object_id/foo.metadata', 'meta',
     )
+
+
+@moto.mock_s3
+def test_prepare_async(task):
+    bucket = create_bucket()
+    bucket.put_object(Key='the/prefix/foo', Body='bar')
+
+    async def prepare():
+        await task.prepare_async(asyncio.Semaphore(1))
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(prepare())
+        assert_file_contents(task.download_path, 'bar')
+        with open(task.meta_path) as f:
+            assert 'fileName>baz.pdf<' in f.read()
+    finally:
+        task.cleanup()
+        loop.close()
+
+
+@pytest.mark.parametrize(
+    'status, error', [
+        (200, None),
+        (404, errors.ResourceNotFoundError),
+        (500, errors.UnderlyingSystemError),
+    ],
+)
+def test_http_download_async_checks_status(temp_file, status, error):
+    aiohttp = pytest.importorskip('aiohttp')
+    from aiohttp import test_utils, web
+
+    async def handler(request):
+        return web.Response(status=status, body=b'bar')
+
+    async def download():
+        app = web.Application()
+        app.router.add_get('/foo', handler)
+        async with test_utils.TestServer(app) as server:
+            remote = HTTPRemoteUrl(str(server.make_url('/foo')))
+            async with aiohttp.ClientSession() as session:
+                with open(temp_file, 'wb') as f:
+                    await remote.download_async(f, session)
+
+    loop = asyncio.new_event_loop()
+    try:
+        if error is None:
+            loop.run_until_complete(download())
+            assert_file_contents(temp_file, 'bar')
+        else:
+            with pytest.raises(error):
+                loop.run_until_complete(download())
+    finally:
+        loop.close()
+
+
+@pytest.mark.parametrize(
+    'status, error', [
+        (200, None),
+        (404, errors.ResourceNotFoundError),
+        (500, errors.UnderlyingSystemError),
+    ],
+)
+@responses.activate
+def test_http_download_checks_status(temp_file, status, error):
+    responses.add(
+        responses.GET, 'http://example.com/foo', status=status, body=b'bar',
+    )
+    remote = HTTPRemoteUrl('http://example.com/foo')
+    with open(temp_file, 'wb') as f:
+        if error is None:
+            remote.download(f)
+        else:
+            with pytest.raises(error):
+                remote.download(f)
+    if error is None:
+        assert_file_contents(temp_file, 'bar')
+    else:
+        assert_file_contents(temp_file, '')
+
+
+@pytest.mark.parametrize(
+    'status, headers, expected', [
+        (200, {'Content-Length': '3'}, 3),
+        (200, {'Content-Length': 'abc'}, None),
+        (404, {}, errors.ResourceNotFoundError),
+        (500, {}, errors.UnderlyingSystemError),
+    ],
+)
+@responses.activate
+def test_http_get_size_checks_status(status, headers, expected):
+    responses.add(
+        responses.HEAD, 'http://example.com/foo',
+        status=status, headers=headers,
+    )
+    remote = HTTPRemoteUrl('http://example.com/foo')
+    if isinstance(expected, type):
+        with pytest.raises(expected):
+            remote.get_size()
+    else:
+        assert remote.get_size() == expected
+
+
+@moto.mock_s3
+def test_expected_size(file_metadata):
+    bucket = create_bucket()
+    bucket.put_object(Key='the/prefix/foo', Body='bar')
+    remote = S3RemoteUrl('s3://bucket/the/prefix/foo')
+
+    task = tasks.FileTask(remote, file_metadata, 'message_id', 'object_id', [])
+    assert task.expected_size() == 3
+
+    task = tasks.FileTask(
+        remote, file_metadata, 'message_id', 'object_id', [],
+        declared_size=10,
+    )
+    assert task.expected_size() == 10
+
+
+def local_extra_length(path, info):
+    with open(path, 'rb') as f:
+        f.seek(info.header_offset + 28)
+        return struct.unpack('<H', f.read(2))[0]
+
+
+@moto.mock_s3
+def test_stream_bundle_into_zip(task, temp_file):
+    bucket = create_bucket()
+    bucket.put_object(Key='the/prefix/foo', Body='bar')
+
+    write_bundle(temp_file, task.stream_bundle)
+
+    assert_zip_contains(temp_file, 'object_id/foo', 'bar')
+    assert_zip_contains(
+        temp_file, 'object_id/foo.metadata', partial='fileName>baz.pdf<',
+    )
+    with zipfile.ZipFile(temp_file) as f:
+        info = f.getinfo('object_id/foo')
+    assert info.compress_type == zipfile.ZIP_DEFLATED
+    # size unknown up front, local header has zip64 extra field
+    assert local_extra_length(temp_file, info) == 20
+
+
+@moto.mock_s3
+def test_stream_bundle_copies_compressed_formats(file_metadata, temp_file):
+    bucket = create_bucket()
+    bucket.put_object(Key='the/prefix/scan.jpg', Body='a' * 100000)
+    task = tasks.FileTask(
+        S3RemoteUrl('s3://bucket/the/prefix/scan.jpg'), file_metadata,
+        'message_id', 'object_id', [],
+    )
+
+    write_bundle(temp_file, task.stream_bundle)
+
+    with zipfile.ZipFile(temp_file) as f:
+        info = f.getinfo('object_id/scan.jpg')
+        assert f.read(info) == b'a' * 100000
+    # deflate level 0, data copied rather than compressed
+    assert info.compress_size > info.file_size
+
+
+@moto.mock_s3
+def test_stream_bundle_declared_size_without_zip64(file_metadata, temp_file):
+    bucket = create_bucket()
+    bucket.put_object(Key='the/prefix/foo', Body='bar')
+    task = tasks.FileTask(
+        S3RemoteUrl('s3://bucket/the/prefix/foo'),
+        file_metadata, 'message_id', 'object_id', [],
+        declared_size=3,
+    )
+
+    write_bundle(temp_file, task.stream_bundle)
+
+    with zipfile.ZipFile(temp_file) as f:
+        assert f.read('object_id/foo') == b'bar'
+        info = f.getinfo('object_id/foo')
+    assert local_extra_length(temp_file, info) == 0
+
+
+@moto.mock_s3
+def test_stream_bundle_missing_file(task, temp_file):
+    create_bucket()
+    with pytest.raises(errors.ResourceNotFoundError):
+        write_bundle(temp_file, task.stream_bundle)
+
+
+@moto.mock_s3
+@pytest.mark.parametrize(
+    'checksum_type, checksum_value, error', [
+        (1, hashlib.md5(b'bar').hexdigest(), None),
+        (2, hashlib.sha256(b'bar').hexdigest(), None),
+        (1, hashlib.md5(b'baz').hexdigest(), errors.InvalidChecksumError),
+    ],
+)
+def test_stream_bundle_verifies_checksums(
+    file_metadata, temp_file, checksum_type, checksum_value, error,
+):
+    bucket = create_bucket()
+    bucket.put_object(Key='the/prefix/foo', Body='bar')
+    task = tasks.FileTask(
+        S3RemoteUrl('s3://bucket/the/prefix/foo'),
+        file_metadata, 'message_id', 'object_id',
+        [{'checksumType': checksum_type, 'checksumValue': checksum_value}],
+    )
+
+    if error is None:
+        write_bundle(temp_file, task.stream_bundle)
+        assert_zip_contains(temp_file, 'object_id/foo', 'bar')
+    else:
+        with pytest.raises(error):
+            write_bundle(temp_file, task.stream_bundle)
+
+
+@moto.mock_s3
+def test_stream_bundle_stops_at_size_limit(file_metadata, temp_file, monkeypatch):
+    monkeypatch.setattr(tasks, 'STREAM_CHUNK_SIZE', 4)
+    bucket = create_bucket()
+    bucket.put_object(Key='the/prefix/foo', Body='x' * 20)
+    task = tasks.FileTask(
+        S3RemoteUrl('s3://bucket/the/prefix/foo'),
+        file_metadata, 'message_id', 'object_id', [],
+        file_size_limit=8,
+    )
+
+    with open(temp_file, 'wb') as output:
+        bundle = BundleWriter(output)
+        with pytest.raises(errors.UnderlyingSystemError):
+            with bundle:
+                task.stream_bundle(bundle.zip_file)
+
+    # rejected at the chunk reaching the limit, before it was written
+    assert bundle.zip_file.getinfo('object_id/foo').file_size == 4
+    # unfinished bundle has no central directory
+    assert not zipfile.is_zipfile(temp_file)
+
+
+@moto.mock_s3
+def test_stream_bundle_larger_than_declared_size_needing_zip64(
+    file_metadata, temp_file, monkeypatch,
+):
+    monkeypatch.setattr(zipfile, 'ZIP64_LIMIT', 100)
+    monkeypatch.setattr(tasks, 'STREAM_CHUNK_SIZE', 50)
+    bucket = create_bucket()
+    bucket.put_object(Key='the/prefix/foo', Body='x' * 200)
+    task = tasks.FileTask(
+        S3RemoteUrl('s3://bucket/the/prefix/foo'),
+        file_metadata, 'message_id', 'object_id', [],
+        declared_size=10,
+    )
+
+    with pytest.raises(errors.UnderlyingSystemError, match='fileSize 10'):
+        write_bundle(temp_file, task.stream_bundle)
+
+
+@moto.mock_s3
+def test_preflight_sizes_undeclared_file_once(task):
+    bucket = create_bucket()
+    bucket.put_object(Key='the/prefix/foo', Body='bar')
+    assert task.preflight() == 3
+    bucket.Object('the/prefix/foo').delete()
+    assert task.preflight() == 3
+
+
+@moto.mock_s3
+def test_load_rejects_file_larger_than_declared(file_metadata, temp_file):
+    bucket = create_bucket()
+    bucket.put_object(Key='the/prefix/foo', Body='bar')
+    task = tasks.FileTask(
+        S3RemoteUrl('s3://bucket/the/prefix/foo'), file_metadata,
+        'message_id', 'object_id', [], declared_size=3,
+    )
+    task.load()
+    with zipfile.ZipFile(temp_file, 'w') as f:
+        task.add_fetched_to_bundle(f)
+    assert_zip_contains(temp_file, 'object_id/foo', 'bar')
+    assert_zip_contains(temp_file, 'object_id/foo.metadata', partial='baz.pdf')
+
+    task.declared_size = 2
+    with pytest.raises(errors.UnderlyingSystemError, match='larger'):
+        task.load()